@@ -1,79 +1,260 @@
 import sqlite3
 import os
+import json
+import base64
+import csv
+import io
+import hashlib
+import heapq
+import math
 import secrets
 import string
-from datetime import datetime, date
+import threading
+import time
+import queue
+from datetime import datetime, date, timedelta
 from functools import wraps
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, jsonify, g, session, abort
+    url_for, jsonify, g, session, abort, Response, stream_with_context,
+    make_response, get_template_attribute, before_render_template, template_rendered
 )
 
+from werkzeug.exceptions import NotFound
+
+try:
+    import orjson  # необов'язковий: швидше кодує колонкові відповіді
+except ImportError:
+    orjson = None
+
+import dal
+import migrations
+import transfer
+from cache import LRUCache
+from dal import ARCHIVE_KEYS, DUE_KEYS, ORDER_KEYS, SEARCH_KEYS, USER_KEYS
+from dbpool import ConnectionPool
+from events import EventHub
+from metrics import Metrics
+from shards import CATALOG, Router
+from writequeue import WriteQueue
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "naruto-ninja-super-secret-2024")
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 app.config["SESSION_COOKIE_HTTPONLY"] = True
-DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "todo.db")
+DATABASE = os.environ.get("DATABASE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "todo.db")
 
 RANKS = ["D", "C", "B", "A", "S"]
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "hokage2024")
 
 
+# ─── Metrics ────────────────────────────────────────────────────────
+# Затримка, SQL і очікування блокувань кожного запиту (див. metrics.py).
+# SLOW_QUERY_MS вмикає журнал запитів dal, довших за поріг, з EXPLAIN QUERY PLAN.
+metrics = Metrics(
+    DATABASE,
+    slow_query_ms=float(os.environ["SLOW_QUERY_MS"]) if os.environ.get("SLOW_QUERY_MS") else None,
+)
+dal.add_query_hook(metrics.on_query)
+before_render_template.connect(metrics.template_started, app)
+template_rendered.connect(metrics.template_rendered, app)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = metrics.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.finish(token, route, request.method, response.status_code)
+    return response
+
+
 # ─── Database helpers ───────────────────────────────────────────────
+# Розмір пулів відповідає кількості потоків воркера, що ходять у базу
+# (ASGI_DB_THREADS під uvicorn, --threads під gunicorn): кожен тримає
+# щонайбільше одне з'єднання для запису й одне для читання кожного
+# шарду. SSE-потоки з'єднань не тримають.
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 2))
+
+# Дані користувачів діляться на SHARDS файлів за user_id, users і коди
+# лежать у каталозі — самій DATABASE (див. shards.py). Кожен шард має
+# свої пули і свого письменника, що зливає записи /api/* у спільні
+# транзакції (див. writequeue.py): записи різних шардів ідуть паралельно.
+SHARDS = int(os.environ.get("SHARDS", 1))
+
+
+class Shard:
+    """Файл бази в цьому воркері: пули, письменник і опитувач SSE."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.write_pool = ConnectionPool(path, size=POOL_SIZE, on_connect=metrics.instrument_writes)
+        self.read_pool = ConnectionPool(path, size=POOL_SIZE, readonly=True,
+                                        on_connect=metrics.instrument)
+        self.writes = WriteQueue(
+            self.write_pool,
+            window=float(os.environ.get("WRITE_WINDOW_MS", 2)) / 1000,
+            max_batch=int(os.environ.get("WRITE_MAX_BATCH", 32)),
+            on_commit=metrics.on_commit,
+        )
+        self.events = EventHub(
+            ConnectionPool(path, size=1, readonly=True),
+            render_changes,
+            interval=float(os.environ.get("SSE_POLL_MS", 250)) / 1000,
+            max_streams=SSE_MAX_STREAMS,
+        )
+
+
+def open_shard(name, path):
+    """Схема файлу доганяється під час першого відкриття у воркері."""
+    shard = Shard(name, path)
+    if migrations.migrate(path):
+        threading.Thread(target=run_backfills, args=(shard,), name="backfill", daemon=True).start()
+    return shard
+
+
+shards = Router(DATABASE, SHARDS, open_shard)
+
+
+def get_shard():
+    """Шард користувача сесії."""
+    if "shard" not in g:
+        g.shard = shards.get(current_user()["shard"])
+    return g.shard
+
+
 def get_db():
+    """З'єднання для запису (і читань, що мають бачити цю ж транзакцію)."""
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA journal_mode=WAL")
-        g.db.execute("PRAGMA foreign_keys=ON")
+        g.db = get_shard().write_pool.acquire()
     return g.db
 
 
+def shard_read_db(shard):
+    """Read-only з'єднання шарду, одне на запит: GET-запити не стають у чергу за записами."""
+    dbs = g.setdefault("read_dbs", {})
+    if shard.name not in dbs:
+        dbs[shard.name] = shard.read_pool.acquire()
+    return dbs[shard.name]
+
+
+def get_read_db():
+    return shard_read_db(get_shard())
+
+
+def get_catalog_db():
+    """Каталог: користувачі й коди. З одним шардом — те саме з'єднання, що get_read_db()."""
+    return shard_read_db(shards.catalog)
+
+
+def release_read_dbs():
+    for name, db in g.pop("read_dbs", {}).items():
+        shards.get(name).read_pool.release(db)
+
+
 @app.teardown_appcontext
 def close_db(exc):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
-
-
-def init_db():
-    db = sqlite3.connect(DATABASE)
-    db.executescript("""
-        PRAGMA journal_mode=WAL;
-        PRAGMA foreign_keys=ON;
-
-        CREATE TABLE IF NOT EXISTS users (
-            id         INTEGER PRIMARY KEY AUTOINCREMENT,
-            code       TEXT    NOT NULL UNIQUE,
-            name       TEXT    NOT NULL DEFAULT 'Ніндзя',
-            created_at TEXT    NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS todos (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id     INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            text        TEXT    NOT NULL,
-            done        INTEGER NOT NULL DEFAULT 0,
-            rank        TEXT    NOT NULL DEFAULT 'D',
-            deadline    TEXT,
-            created_at  TEXT    NOT NULL,
-            done_at     TEXT
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_todos_user ON todos(user_id);
-        CREATE INDEX IF NOT EXISTS idx_todos_done ON todos(user_id, done);
-
-        CREATE TABLE IF NOT EXISTS subtasks (
-            id         INTEGER PRIMARY KEY AUTOINCREMENT,
-            todo_id    INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
-            text       TEXT NOT NULL,
-            done       INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
-        );
-        CREATE INDEX IF NOT EXISTS idx_subtasks_todo ON subtasks(todo_id);
-    """)
-    db.commit()
-    db.close()
+        g.shard.write_pool.release(db)
+    release_read_dbs()
+
+
+# ─── Listing & pagination ───────────────────────────────────────────
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Ключі курсора з числовими значеннями; решта — рядки дат (або NULL)
+NUMERIC_CURSOR_KEYS = {"id", "done", "position", "score"}
+
+def encode_cursor(row, keys):
+    raw = json.dumps([row[col] for col, _ in keys], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, keys):
+    """Розбирає курсор від клієнта; None, якщо він пошкоджений."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    for value, (col, _) in zip(values, keys):
+        if col.rsplit(".", 1)[-1] in NUMERIC_CURSOR_KEYS:
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            ok = value is None or isinstance(value, str)
+        if not ok:
+            return None
+    return values
+
+
+def todo_from_row(row):
+    d = row_to_dict(row)
+    if "score" in d:
+        del d["score"]
+        subs = d["matched_subtasks"]
+        d["matched_subtasks"] = [int(s) for s in subs.split(",")] if subs else []
+    return d
+
+
+def stream_page(rows, keys, limit):
+    """JSON-сторінка {"items": [...], "next_cursor": ...}, рядки серіалізуються
+    по одному прямо з курсора SQLite, без проміжного списку."""
+    yield '{"items":['
+    next_cursor = None
+    last = None
+    for i, row in enumerate(rows):
+        if i == limit:
+            next_cursor = encode_cursor(last, keys)
+            break
+        yield ("," if i else "") + app.json.dumps(todo_from_row(row))
+        last = row
+    yield '],"next_cursor":' + app.json.dumps(next_cursor) + "}"
+
+
+# Колонковий формат: назви колонок один раз і рядки-масиви з курсора
+# без dict на кожен рядок. done лишається 0/1, matched_subtasks у пошуку —
+# рядок id через кому, як їх віддає SQLite. Вмикається ?format=columnar
+# або заголовком Accept з COLUMNAR_MIMETYPE.
+COLUMNAR_MIMETYPE = "application/vnd.ninja-todo.columnar+json"
+
+
+def wants_columnar():
+    if request.args.get("format") == "columnar":
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", COLUMNAR_MIMETYPE])
+    return best == COLUMNAR_MIMETYPE
+
+
+def columnar_response(columns, rows, **extra):
+    body = {"columns": columns, "rows": rows, **extra}
+    if orjson is not None:
+        data = orjson.dumps(body)
+    else:
+        data = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+    return Response(data, mimetype=COLUMNAR_MIMETYPE)
+
+
+def columnar_page(rows, keys, limit):
+    """Сторінка місій колонками; rows — курсор dal.query_todos."""
+    if not isinstance(rows, sqlite3.Cursor):  # порожній пошуковий запит
+        return columnar_response([], [], next_cursor=None)
+    rows.row_factory = None
+    columns = [d[0] for d in rows.description]
+    page = rows.fetchmany(limit + 1)
+    next_cursor = None
+    if len(page) > limit:
+        del page[limit:]
+        next_cursor = encode_cursor(dict(zip(columns, page[-1])), keys)
+    return columnar_response(columns, page, next_cursor=next_cursor)
 
 
 def row_to_dict(row):
@@ -82,18 +263,6 @@ def row_to_dict(row):
     return d
 
 
-def get_stats(db, user_id):
-    row = db.execute("""
-        SELECT
-            COUNT(*) as total,
-            SUM(done) as done
-        FROM todos WHERE user_id = ?
-    """, (user_id,)).fetchone()
-    total = row["total"] or 0
-    done  = row["done"]  or 0
-    return {"total": total, "done": done, "pending": total - done}
-
-
 def ninja_rank(done_count):
     if done_count >= 10:
         return ("🔴", "Хокаге")
@@ -115,23 +284,44 @@ def generate_code(length=8):
 
 
 # ─── Auth helpers ────────────────────────────────────────────────────
+# Користувачі кешуються в процесі за id і за кодом. Версія таблиці users
+# каталогу (counters.users) входить у ключ: після створення чи видалення
+# користувача в будь-якому воркері старі записи більше не влучають,
+# тож видалений користувач втрачає доступ з наступного запиту.
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = 300
+user_cache = LRUCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def lookup_user(db, user_id=None, code=None):
+    """Користувач за id або за invite-кодом; None, якщо такого немає."""
+    version = dal.users_version(db)
+    key = ("id", user_id, version) if code is None else ("code", code, version)
+    user = user_cache.get(key)
+    if user is None:
+        row = dal.get_user(db, user_id) if code is None else dal.get_user_by_code(db, code)
+        if row is None:
+            return None
+        user = dict(row)
+        user["is_admin"] = bool(user.get("is_admin", 0))
+        user_cache.set(("id", user["id"], version), user)
+        user_cache.set(("code", user["code"], version), user)
+    return user
+
+
 def current_user():
-    user_id = session.get("user_id")
-    if not user_id:
-        return None
-    db = get_db()
-    row = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    if not row:
-        return None
-    d = dict(row)
-    d["is_admin"] = bool(d.get("is_admin", 0))
-    return d
+    """Користувач сесії, один раз на запит; None, якщо його вже видалено."""
+    if "user" not in g:
+        user_id = session.get("user_id")
+        g.user = lookup_user(get_catalog_db(), user_id) if user_id else None
+    return g.user
 
 
 def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        if not session.get("user_id"):
+        if current_user() is None:
+            session.pop("user_id", None)
             if request.is_json or request.path.startswith("/api/"):
                 return jsonify({"error": "Unauthorized"}), 401
             return redirect(url_for("login"))
@@ -164,8 +354,7 @@ def login():
         if not code:
             error = "Введіть код доступу"
         else:
-            db = get_db()
-            user = db.execute("SELECT * FROM users WHERE code = ?", (code,)).fetchone()
+            user = lookup_user(get_catalog_db(), code=code)
             if user:
                 session["user_id"] = user["id"]
                 session.permanent = True
@@ -182,6 +371,14 @@ def logout():
     return redirect(url_for("login"))
 
 
+@app.route("/sw.js")
+def service_worker():
+    """static/sw.js з кореня сайту: інакше його scope — лише /static/."""
+    response = app.send_static_file("sw.js")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 # ─── Admin routes ───────────────────────────────────────────────────
 @app.route("/admin", methods=["GET", "POST"])
 def admin_login():
@@ -200,58 +397,325 @@ def admin_login():
 @app.route("/admin/panel")
 @admin_required
 def admin_panel():
-    db = get_db()
-    rows = db.execute("""
-        SELECT u.id, u.code, u.name, u.created_at,
-               COUNT(t.id) as total_todos,
-               COALESCE(SUM(t.done), 0) as done_todos
-        FROM users u
-        LEFT JOIN todos t ON t.user_id = u.id
-        GROUP BY u.id
-        ORDER BY u.created_at DESC
-    """).fetchall()
-    users = []
-    for u in rows:
-        d = dict(u)
-        d['done_todos'] = int(d['done_todos'] or 0)
-        d['total_todos'] = int(d['total_todos'] or 0)
-        users.append(d)
-    return render_template("admin_panel.html", users=users)
+    search = request.args.get("q", "").strip()
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor, USER_KEYS)
+        if after is None:
+            return redirect(url_for("admin_panel", q=search or None))
+    rows = dal.list_users_page(get_catalog_db(), search, after, PAGE_SIZE)
+    users = [dict(u) for u in rows[:PAGE_SIZE]]
+    next_cursor = encode_cursor(rows[PAGE_SIZE - 1], USER_KEYS) if len(rows) > PAGE_SIZE else None
+    add_user_stats(users)
+    return render_template("admin_panel.html", users=users, totals=user_totals(),
+                           search=search, cursor=cursor, next_cursor=next_cursor,
+                           bulk_max=BULK_MAX, backup=backup_state["last"],
+                           backup_running=backup_lock.locked(), routes=metrics.summary())
+
+
+def add_user_stats(users):
+    """Лічильники місій сторінки користувачів — запитом у кожен їхній шард."""
+    by_shard = {}
+    for user in users:
+        by_shard.setdefault(user["shard"], []).append(user)
+    for name, group in by_shard.items():
+        stats = {row["user_id"]: row for row in
+                 dal.users_stats(shard_read_db(shards.get(name)), [u["id"] for u in group])}
+        for user in group:
+            row = stats.get(user["id"])
+            user["total_todos"] = row["total"] if row else 0
+            user["done_todos"] = row["done"] if row else 0
+
+
+def user_totals():
+    totals = {"users": dal.count_users(get_catalog_db()), "total_todos": 0, "done_todos": 0}
+    for shard in shards.all():
+        row = dal.todo_totals(shard_read_db(shard))
+        totals["total_todos"] += row["total_todos"]
+        totals["done_todos"] += row["done_todos"]
+    return totals
+
+
+BULK_MAX = 1000
+
+
+def create_users(db, names):
+    """Користувачі з новими кодами в каталозі; [(code, name)], час створення
+    і рядки users з уже призначеними шардами.
+
+    Кандидати перевіряються пакетами через унікальний індекс code, зайняті
+    й повтори замінюються новими, доки кодів не вистачить на всіх.
+    """
+    codes = set()
+    while len(codes) < len(names):
+        candidates = {generate_code() for _ in range(len(names) - len(codes))} - codes
+        codes |= candidates - dal.existing_codes(db, candidates)
+    rows = list(zip(codes, names))
+    created_at = dal.create_users(db, rows)
+    users = [dict(u, shard=shards.target(u["id"])) for u in dal.users_by_codes(db, codes)]
+    dal.set_user_shards(db, [(u["shard"], u["id"]) for u in users if u["shard"] != CATALOG])
+    return rows, created_at, users
+
+
+def register_users(names):
+    """create_users() у каталозі, потім копії рядків users у їхніх шардах —
+    паралельно, кожна через письменника свого шарду.
+
+    Це окремі транзакції. Якщо копії в якомусь шарді не записались, нові
+    рядки прибираються з каталогу й шардів і помилка йде далі, тож
+    напівстворених користувачів не лишається. Якщо ж воркер упав між
+    кроками, записи таких користувачів отримують 503 (див. owned_write),
+    доки `python shards.py` не допише копії, яких бракує.
+    """
+    rows, created_at, users = shards.catalog.writes.submit(create_users, names)
+    by_shard = {}
+    for user in users:
+        if user["shard"] != CATALOG:
+            by_shard.setdefault(user["shard"], []).append(user)
+    futures = {name: shards.get(name).writes.enqueue(dal.insert_user_stubs, group)
+               for name, group in by_shard.items()}
+    errors = [future.exception() for future in futures.values() if future.exception()]
+    if errors:
+        user_ids = [user["id"] for user in users]
+        for name, future in futures.items():
+            if future.exception() is None:
+                shards.get(name).writes.submit(dal.delete_users, user_ids)
+        shards.catalog.writes.submit(dal.delete_users, user_ids)
+        raise errors[0]
+    return rows, created_at
 
 
 @app.route("/admin/create", methods=["POST"])
 @admin_required
 def admin_create():
     name = request.form.get("name", "").strip() or "Ніндзя"
-    db = get_db()
-    for _ in range(10):
-        code = generate_code()
-        if not db.execute("SELECT id FROM users WHERE code=?", (code,)).fetchone():
-            break
-    db.execute(
-        "INSERT INTO users (code, name, created_at) VALUES (?, ?, ?)",
-        (code, name, datetime.now().isoformat())
-    )
-    db.commit()
+    register_users([name])
+    return redirect(url_for("admin_panel"))
+
+
+@app.route("/admin/create-bulk", methods=["POST"])
+@admin_required
+def admin_create_bulk():
+    """До BULK_MAX користувачів однією транзакцією; коди віддаються як CSV."""
+    names = [n.strip() for n in request.form.get("names", "").splitlines() if n.strip()]
+    count = len(names) or request.form.get("count", 0, type=int)
+    if not 1 <= count <= BULK_MAX:
+        return jsonify({"error": f"Від 1 до {BULK_MAX} користувачів за раз"}), 400
+    if not names:
+        prefix = request.form.get("name", "").strip() or "Ніндзя"
+        names = [f"{prefix} {i}" for i in range(1, count + 1)]
+
+    rows, created_at = register_users(names)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(("name", "code", "created_at"))
+    writer.writerows((name, code, created_at) for code, name in rows)
+    # BOM — щоб Excel відкрив кирилицю як UTF-8
+    return Response("\ufeff" + out.getvalue(), mimetype="text/csv", headers={
+        "Content-Disposition": f'attachment; filename="invite-codes-{created_at[:10]}.csv"',
+    })
+
+
+@app.route("/admin/export")
+@admin_required
+def admin_export():
+    """Уся база: користувачі, кожен зі своїми місіями й архівом — шард за шардом."""
+    sources = [(shard_read_db(shard), lambda db, name=shard.name: transfer.database_records(db, name))
+               for shard in shards.all()]
+    return export_response(sources, export_format(), "ninja-todo-all", with_users=True)
+
+
+# Онлайн-копія кроками по transfer.BACKUP_PAGES сторінок у фоновому потоці;
+# одна за раз на воркер. Кожна копія — тека в BACKUP_DIR поруч із базою
+# з каталогом і всіма шардами під їхніми іменами файлів.
+BACKUP_DIR = os.environ.get("BACKUP_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(DATABASE)), "backups")
+backup_lock = threading.Lock()
+backup_state = {"last": None}
+
+
+def run_backup(target):
+    try:
+        os.makedirs(target)
+        result = {"files": 0, "pages": 0, "seconds": 0.0, "restarts": 0}
+        for shard in shards.all():
+            copied = transfer.backup(shard.path, os.path.join(target, os.path.basename(shard.path)))
+            result["files"] += 1
+            for key in ("pages", "seconds", "restarts"):
+                result[key] += copied[key]
+        result["seconds"] = round(result["seconds"], 3)
+        backup_state["last"] = {"file": os.path.basename(target), **result,
+                                "finished_at": datetime.now().isoformat(timespec="seconds")}
+    except Exception as e:
+        app.logger.exception("backup failed")
+        backup_state["last"] = {"file": os.path.basename(target), "error": str(e),
+                                "finished_at": datetime.now().isoformat(timespec="seconds")}
+    finally:
+        backup_lock.release()
+
+
+@app.route("/admin/backup", methods=["GET", "POST"])
+@admin_required
+def admin_backup():
+    if request.method == "GET":
+        return jsonify({"running": backup_lock.locked(), "dir": BACKUP_DIR, **backup_state})
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    if backup_lock.acquire(blocking=False):
+        target = os.path.join(BACKUP_DIR, datetime.now().strftime("todo-%Y%m%d-%H%M%S"))
+        threading.Thread(target=run_backup, args=(target,), daemon=True, name="backup").start()
     return redirect(url_for("admin_panel"))
 
 
 @app.route("/admin/delete-user/<int:user_id>", methods=["POST"])
 @admin_required
 def admin_delete_user(user_id):
-    db = get_db()
-    db.execute("DELETE FROM users WHERE id=?", (user_id,))
-    db.commit()
+    """Спершу рядок каталогу, потім дані в шарді.
+
+    Після першого кроку користувача вже немає: увійти він не може, а
+    адмінка його не показує. Якщо другий не вдався, залишок у шарді
+    нікому не видно, і його прибирає `python shards.py` (sweep).
+    """
+    user = dal.get_user(get_catalog_db(), user_id)
+    if user is not None:
+        shards.catalog.writes.submit(dal.delete_user, user_id)
+        if user["shard"] != CATALOG:
+            try:
+                shards.get(user["shard"]).writes.submit(dal.delete_user, user_id)
+            except Exception:
+                app.logger.exception("shard cleanup failed")
     return redirect(url_for("admin_panel"))
 
 
+@app.route("/admin/pool")
+@admin_required
+def admin_pool():
+    """Лічильники пулів з'єднань, черг записів і кешів цього воркера за шардами."""
+    return jsonify({
+        "pid": os.getpid(),
+        "shards": {shard.name or "catalog": {
+            "write": shard.write_pool.stats(),
+            "read": shard.read_pool.stats(),
+            "write_queue": shard.writes.stats(),
+            "events": shard.events.stats(),
+        } for shard in shards.opened()},
+        "user_cache": user_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+    })
+
+
+@app.route("/admin/metrics")
+@admin_required
+def admin_metrics():
+    """Метрики цього воркера у текстовому форматі Prometheus."""
+    opened = shards.opened()
+    pools = [({"pool": kind, "shard": shard.name}, pool.stats()) for shard in opened
+             for kind, pool in (("write", shard.write_pool), ("read", shard.read_pool))]
+    queues = [({"shard": shard.name}, shard.writes.stats()) for shard in opened]
+    caches = [("user", user_cache.stats()), ("fragment", fragment_cache.stats())]
+    families = [
+        ("ninja_pool_waits_total", "counter", "Очікування вільного з'єднання в пулі.",
+         [(labels, s["waits"]) for labels, s in pools]),
+        ("ninja_pool_wait_seconds_total", "counter", "Час очікування вільного з'єднання.",
+         [(labels, s["wait_seconds"]) for labels, s in pools]),
+        ("ninja_pool_open_connections", "gauge", "Відкриті з'єднання пулу.",
+         [(labels, s["open"]) for labels, s in pools]),
+        ("ninja_write_batches_total", "counter", "Спільні транзакції письменника.",
+         [(labels, s["batches"]) for labels, s in queues]),
+        ("ninja_write_jobs_total", "counter", "Записи, виконані письменником.",
+         [(labels, s["jobs"]) for labels, s in queues]),
+        ("ninja_writer_lock_wait_seconds_total", "counter", "Очікування BEGIN IMMEDIATE письменником.",
+         [(labels, s["lock_seconds_total"]) for labels, s in queues]),
+        ("ninja_writer_commit_seconds_total", "counter", "Час COMMIT письменника.",
+         [(labels, s["commit_seconds_total"]) for labels, s in queues]),
+        ("ninja_cache_hits_total", "counter", "Влучання в кеш процесу.",
+         [({"cache": name}, s["hits"]) for name, s in caches]),
+        ("ninja_cache_misses_total", "counter", "Промахи кешу процесу.",
+         [({"cache": name}, s["misses"]) for name, s in caches]),
+        ("ninja_cache_bytes", "gauge", "Оцінка пам'яті, зайнятої кешем.",
+         [({"cache": name}, s["bytes"]) for name, s in caches]),
+        ("ninja_sse_streams", "gauge", "Відкриті SSE-потоки.",
+         [({"shard": shard.name}, shard.events.stats()["streams"]) for shard in opened]),
+    ]
+    return Response(metrics.prometheus(families), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/admin/logout")
 def admin_logout():
     session.pop("is_admin", None)
     return redirect(url_for("admin_login"))
 
 
+# ─── Conditional GET ────────────────────────────────────────────────
+# Слабкий ETag = версія даних користувача + хеш параметрів запиту.
+# Дата входить у хеш, бо від неї залежать прострочені місії.
+# Версія читається першою: якщо запис встигне між нею і даними,
+# клієнт отримає новіші дані зі старим ETag і просто перезапитає їх.
+def data_etag(user_id, *parts):
+    return version_etag(dal.get_version(get_read_db(), user_id), user_id, *parts)
+
+
+def version_etag(version, user_id, *parts):
+    key = json.dumps([user_id, date.today().isoformat(), *parts], ensure_ascii=False)
+    return f"{version}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"
+
+
+def not_modified(etag):
+    """304 без звернення до todos, якщо у клієнта актуальна копія; інакше None."""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    # Браузер зберігає відповідь, але перед кожним використанням перепитує
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
 # ─── Page route ─────────────────────────────────────────────────────
+# Ранг, статистика і перша сторінка списку рендеряться як фрагменти
+# (templates/_fragments.html) і кешуються в процесі. Версія даних
+# користувача входить у ключ, тож будь-який запис — з цього чи іншого
+# воркера — робить старі записи недосяжними, і LRU їх згодом витісняє.
+# Повторне відкриття сторінки обходиться без SQL до todos і без рендерингу
+# списку: лишаються читання версії та кешований користувач.
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 512))
+FRAGMENT_CACHE_BYTES = int(os.environ.get("FRAGMENT_CACHE_BYTES", 16 * 1024 * 1024))
+
+
+def fragments_size(fragments):
+    return sum(len(html.encode()) for html in fragments.values())
+
+
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, max_bytes=FRAGMENT_CACHE_BYTES,
+                          sizeof=fragments_size)
+
+
+def render_fragments(db, user_id, filter_by, search, today):
+    """HTML рангу, статистики і списку та JSON початкового стану списку."""
+    rows = list(dal.query_todos(db, user_id, filter_by, search, None, PAGE_SIZE))
+    todos = [todo_from_row(r) for r in rows[:PAGE_SIZE]]
+    next_cursor = None
+    if len(rows) > PAGE_SIZE:
+        next_cursor = encode_cursor(rows[PAGE_SIZE - 1], SEARCH_KEYS if search else ORDER_KEYS)
+
+    stats = dal.get_stats(db, user_id)
+    rank_icon, rank_name = ninja_rank(stats["done"])
+
+    def macro(name):
+        return get_template_attribute("_fragments.html", name)
+
+    with metrics.rendering():
+        return {
+            "rank": str(macro("rank_badge")(rank_icon, rank_name)),
+            "stats": str(macro("stats_block")(stats)),
+            "list": str(macro("todo_list")(todos, today)),
+            "state": str(macro("list_state")(todos, next_cursor)),
+        }
+
+
 @app.route("/")
 @login_required
 def index():
@@ -260,82 +724,403 @@ def index():
     filter_by = request.args.get("filter", "all")
     search = request.args.get("search", "").strip()
 
-    db = get_db()
-    conditions = ["user_id = ?"]
-    params = [user_id]
-
-    if filter_by == "active":
-        conditions.append("done = 0")
-    elif filter_by == "done":
-        conditions.append("done = 1")
-
-    if search:
-        conditions.append("text LIKE ?")
-        params.append(f"%{search}%")
+    db = get_read_db()
+    sync_version = dal.get_version(db, user_id)
+    etag = version_etag(sync_version, user_id, "index", filter_by, search)
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    query = "SELECT * FROM todos WHERE " + " AND ".join(conditions)
-    query += " ORDER BY done ASC, CASE rank WHEN 'S' THEN 0 WHEN 'A' THEN 1 WHEN 'B' THEN 2 WHEN 'C' THEN 3 ELSE 4 END, created_at DESC"
-
-    rows = db.execute(query, params).fetchall()
-    todos = [row_to_dict(r) for r in rows]
-
-    stats = get_stats(db, user_id)
-    rank_icon, rank_name = ninja_rank(stats["done"])
-    user = current_user()
     today = date.today().isoformat()
+    key = (user_id, sync_version, filter_by, search, today)
+    fragments = fragment_cache.get(key)
+    if fragments is None:
+        fragments = render_fragments(db, user_id, filter_by, search, today)
+        fragment_cache.set(key, fragments)
 
-    return render_template(
+    return with_etag(make_response(render_template(
         "index.html",
-        todos=todos,
-        stats=stats,
-        rank_icon=rank_icon,
-        rank_name=rank_name,
+        fragments=fragments,
         current_filter=filter_by,
         search=search,
         ranks=RANKS,
         today=today,
-        user=user,
-    )
+        user=current_user(),
+        sync_version=sync_version,
+    )), etag)
 
 
 # ─── API helpers ────────────────────────────────────────────────────
-ORDER_SQL = " ORDER BY done ASC, position ASC, created_at DESC"
+# Маркер «поле не передано» для часткових оновлень
+KEEP = object()
 
 
-def get_todo_or_404(db, todo_id, user_id):
-    row = db.execute(
-        "SELECT * FROM todos WHERE id = ? AND user_id = ?",
-        (todo_id, user_id)
-    ).fetchone()
-    if not row:
+class ApiError(Exception):
+    """Помилка API, яку віддаємо клієнту як {"error": ...} зі статусом status."""
+
+    def __init__(self, message, status=400, index=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.index = index
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    body = {"error": e.message}
+    if e.index is not None:
+        body["index"] = e.index
+    return jsonify(body), e.status
+
+
+def clean_text(data, empty_error="Текст не може бути порожнім"):
+    text = data.get("text") if isinstance(data, dict) else None
+    if text is not None and not isinstance(text, str):
+        raise ApiError("Текст має бути рядком")
+    text = (text or "").strip()
+    if not text:
+        raise ApiError(empty_error)
+    if len(text) > 200:
+        raise ApiError("Максимум 200 символів")
+    return text
+
+
+def clean_rank(value):
+    """Ранг великими літерами; порожній — None."""
+    if value is not None and not isinstance(value, str):
+        raise ApiError("Невірний ранг")
+    return (value or "").upper() or None
+
+
+def clean_deadline(value):
+    """Дедлайн як ISO-дата; порожній — None, KEEP так і лишається."""
+    if value is KEEP:
+        return KEEP
+    if not value:
+        return None
+    deadline = dal.iso_date(value)
+    if deadline is None:
+        raise ApiError("Невірна дата дедлайну")
+    return deadline
+
+
+def stats_payload(db, user_id):
+    stats = dal.get_stats(db, user_id)
+    icon, name = ninja_rank(stats["done"])
+    stats["rank_icon"] = icon
+    stats["rank_name"] = name
+    stats["chakra"] = round((stats["done"] / stats["total"] * 100) if stats["total"] > 0 else 0)
+    return stats
+
+
+# ─── Positions ──────────────────────────────────────────────────────
+# position — дробовий ключ: переміщення ставить місію посередині між
+# сусідами, тож перетягування коштує один UPDATE. Коли проміжок між
+# сусідами стає надто вузьким, список перенумеровується у фоні.
+POSITION_GAP = 1024.0
+REBALANCE_GAP = 1e-3
+
+
+def neighbour_positions(db, user_id, todo_id, prev_id, next_id):
+    """Позиції сусідів (lo — вище, hi — нижче); None, якщо сусіда не передано.
+
+    Сусід, якого вже немає або який в іншому списку (виконані/активні),
+    означає, що клієнт бачить застарілий список, — 409.
+    """
+    places = dal.todo_places(db, user_id, [i for i in (todo_id, prev_id, next_id) if i is not None])
+    if todo_id not in places:
+        abort(404)
+    done = places[todo_id][0]
+    for neighbour in (prev_id, next_id):
+        if neighbour is not None and places.get(neighbour, (None,))[0] != done:
+            raise ApiError("Список змінився, оновіть сторінку", 409)
+    return (places[prev_id][1] if prev_id is not None else None,
+            places[next_id][1] if next_id is not None else None)
+
+
+def position_between(lo, hi):
+    """Позиція строго між lo і hi; None, якщо місця між ними немає."""
+    if lo is None and hi is None:
+        return 0.0
+    if lo is None:
+        return hi - POSITION_GAP
+    if hi is None:
+        return lo + POSITION_GAP
+    mid = (lo + hi) / 2
+    return mid if lo < mid < hi else None
+
+
+def rebalance_positions(db, user_id):
+    """Перенумеровує позиції користувача з кроком POSITION_GAP, зберігаючи порядок."""
+    ids = dal.ordered_todo_ids(db, user_id)
+    dal.update_positions(db, user_id, [((i + 1) * POSITION_GAP, todo_id) for i, todo_id in enumerate(ids)])
+
+
+_rebalance_lock = threading.Lock()
+_rebalance_pending = set()
+
+
+def schedule_rebalance(user_id):
+    """Перенумерування у фоні: стає в чергу письменника, запит на нього не чекає."""
+    with _rebalance_lock:
+        if user_id in _rebalance_pending:
+            return
+        _rebalance_pending.add(user_id)
+    shard = get_shard()
+    future = shard.writes.enqueue(owned_write, shard.name, user_id, rebalance_positions, user_id)
+    future.add_done_callback(lambda _: _rebalance_done(user_id))
+
+
+def _rebalance_done(user_id):
+    with _rebalance_lock:
+        _rebalance_pending.discard(user_id)
+
+
+# ─── Write operations ───────────────────────────────────────────────
+# Кожна операція виконується в потоці письменника (writes.submit) всередині
+# спільної транзакції: вона не комітить сама, а помилку повідомляє винятком.
+# Власника перевіряє сама інструкція в dal, тож «немає рядка» — це 404.
+def submit_write(fn, *args):
+    """fn(db, *args) у письменнику шарду користувача сесії."""
+    shard = get_shard()
+    return shard.writes.submit(owned_write, shard.name, get_user_id(), fn, *args)
+
+
+def owned_write(db, shard_name, user_id, fn, *args):
+    """fn(db, *args), якщо user_id досі живе в шарді shard_name.
+
+    Запит обирає шард раніше, ніж стає в чергу, а shards.py тим часом
+    може перенести користувача. Перенос тримає блокування запису джерела,
+    доки каталог не перемкнеться, тож письменник бачить уже новий стан:
+    у каталозі — інший users.shard, у шарді — видалену копію рядка.
+    Такий запис не потрапляє в старий файл, а клієнт отримує 503 і
+    повторює його вже в новому шарді.
+    """
+    if dal.user_shard(db, user_id) != shard_name:
+        raise ApiError("Дані переносяться, повторіть запит", 503)
+    return fn(db, *args)
+
+
+def found_or_404(row):
+    if row is None:
         abort(404)
     return row
 
 
+def add_todo(db, user_id, text, rank, deadline):
+    return dal.insert_todo(db, user_id, text, rank, deadline, POSITION_GAP)
+
+
+def toggle_todo(db, user_id, todo_id):
+    return found_or_404(dal.toggle_todo(db, user_id, todo_id))
+
+
+def delete_todo(db, user_id, todo_id):
+    return found_or_404(dal.delete_todo(db, user_id, todo_id))
+
+
+def edit_todo(db, user_id, todo_id, text, rank, deadline):
+    """rank=None — залишити ранг; deadline=KEEP — залишити дедлайн."""
+    keep_deadline = deadline is KEEP
+    return found_or_404(dal.update_todo(
+        db, user_id, todo_id, text,
+        rank if rank in RANKS else None,
+        None if keep_deadline else (deadline or None),
+        keep_deadline,
+    ))
+
+
+def reorder_todos(db, user_id, items):
+    current = dal.get_positions(db, user_id)
+    changed = [
+        (item["position"], item["id"])
+        for item in items
+        if item["id"] in current and current[item["id"]] != item["position"]
+    ]
+    if changed:
+        dal.update_positions(db, user_id, changed)
+    return len(changed)
+
+
+def move_todo(db, user_id, todo_id, prev_id, next_id):
+    """Повертає (position, lo, hi); position=None, якщо сусіди стоять не в тому
+    порядку. Зниклий сусід — ApiError 409 (див. neighbour_positions)."""
+    lo, hi = neighbour_positions(db, user_id, todo_id, prev_id, next_id)
+    position = position_between(lo, hi)
+    if position is None:
+        # Сусіди злиплися — перенумеровуємо список і пробуємо ще раз
+        rebalance_positions(db, user_id)
+        lo, hi = neighbour_positions(db, user_id, todo_id, prev_id, next_id)
+        position = position_between(lo, hi)
+    if position is not None:
+        found_or_404(dal.set_position(db, user_id, todo_id, position))
+    return position, lo, hi
+
+
+def add_subtask(db, user_id, todo_id, text):
+    return found_or_404(dal.insert_subtask(db, user_id, todo_id, text))
+
+
+def toggle_subtask(db, user_id, sub_id):
+    """None, якщо підзадачі не існує."""
+    return dal.toggle_subtask(db, user_id, sub_id)
+
+
+def delete_subtask(db, user_id, sub_id):
+    """False, якщо підзадачі не існує."""
+    return dal.delete_subtask(db, user_id, sub_id) is not None
+
+
+def restore_todo(db, user_id, todo_id):
+    return found_or_404(dal.restore_todo(db, user_id, todo_id))
+
+
+# ─── Batch ──────────────────────────────────────────────────────────
+# /api/batch виконує впорядкований список операцій однією транзакцією.
+# Замість id можна передати "$N" — id результату N-ї операції пакета.
+# З "atomic": false операції незалежні: кожна у власному SAVEPOINT, а
+# помилка стає її результатом {"error", "status"}, не зупиняючи решту.
+# Власника перевіряє кожна інструкція сама, окремих SELECT немає.
+MAX_BATCH_OPS = 100
+
+# операція -> (поле з id місії, поле з id підзадачі)
+BATCH_OPS = {
+    "add": (None, None),
+    "toggle": ("id", None),
+    "edit": ("id", None),
+    "delete": ("id", None),
+    "move": ("id", None),
+    "subtask_add": ("todo_id", None),
+    "subtask_toggle": (None, "id"),
+    "subtask_delete": (None, "id"),
+}
+
+
+def parse_batch_op(op, index):
+    """Перевіряє операцію пакета до того, як вона потрапить до письменника."""
+    if not isinstance(op, dict) or not isinstance(op.get("op"), str) or op["op"] not in BATCH_OPS:
+        raise ApiError("Невідома операція", index=index)
+    todo_field, sub_field = BATCH_OPS[op["op"]]
+    for field in (todo_field, sub_field, "prev_id", "next_id"):
+        if field is None or (field in ("prev_id", "next_id") and op.get(field) is None):
+            continue
+        value = op.get(field)
+        is_ref = isinstance(value, str) and value[:1] == "$" and value[1:].isdigit() and int(value[1:]) < index
+        is_id = isinstance(value, int) and not isinstance(value, bool)
+        if not (is_id or is_ref):
+            raise ApiError(f"Невірне поле {field}", index=index)
+    try:
+        if op["op"] == "add":
+            rank = clean_rank(op.get("rank")) or "D"
+            return dict(op, text=clean_text(op, "Текст місії не може бути порожнім"),
+                        rank=rank if rank in RANKS else "D", deadline=clean_deadline(op.get("deadline")))
+        if op["op"] == "edit":
+            return dict(op, text=clean_text(op), rank=clean_rank(op.get("rank")),
+                        deadline=clean_deadline(op.get("deadline", KEEP)))
+        if op["op"] == "subtask_add":
+            return dict(op, text=clean_text(op))
+    except ApiError as e:
+        e.index = index
+        raise
+    return op
+
+
+def run_batch(db, user_id, ops, atomic=True):
+    """(results, stats); з atomic=False ops може містити ApiError
+    операцій, що не пройшли перевірку, — вони стають їхніми результатами."""
+    results = []
+
+    def ref(value):
+        if not isinstance(value, str):
+            return value
+        target = results[int(value[1:])]
+        if "error" in target:
+            raise ApiError("Операція, на яку посилається ця, не вдалась", 409)
+        return target["id"]
+
+    for i, op in enumerate(ops):
+        if not atomic:
+            db.execute("SAVEPOINT batch_op")
+        try:
+            if isinstance(op, ApiError):
+                raise op
+            result = run_batch_op(db, user_id, op, ref)
+        except (ApiError, NotFound) as e:
+            error = e if isinstance(e, ApiError) else ApiError("Не знайдено", 404)
+            if atomic:
+                error.index = i
+                raise error
+            db.execute("ROLLBACK TO batch_op")
+            result = {"error": error.message, "status": error.status}
+        if not atomic:
+            db.execute("RELEASE batch_op")
+        results.append(result)
+    return results, stats_payload(db, user_id)
+
+
+def run_batch_op(db, user_id, op, ref):
+    """Одна операція пакета; ApiError/NotFound — вона не вдалась."""
+    name = op["op"]
+    if name == "add":
+        return row_to_dict(add_todo(db, user_id, op["text"], op["rank"], op["deadline"]))
+    if name == "toggle":
+        return row_to_dict(toggle_todo(db, user_id, ref(op["id"])))
+    if name == "edit":
+        return row_to_dict(edit_todo(db, user_id, ref(op["id"]), op["text"], op["rank"], op["deadline"]))
+    if name == "delete":
+        return {"ok": True, "deleted": row_to_dict(delete_todo(db, user_id, ref(op["id"])))}
+    if name == "move":
+        position, lo, hi = move_todo(db, user_id, ref(op["id"]), ref(op.get("prev_id")), ref(op.get("next_id")))
+        if position is None:
+            raise ApiError("Список змінився, оновіть сторінку", 409)
+        if lo is not None and hi is not None and hi - lo < REBALANCE_GAP:
+            schedule_rebalance(user_id)
+        return {"ok": True, "id": ref(op["id"]), "position": position}
+    if name == "subtask_add":
+        return dict(add_subtask(db, user_id, ref(op["todo_id"]), op["text"]))
+    if name == "subtask_toggle":
+        row = toggle_subtask(db, user_id, ref(op["id"]))
+        if row is None:
+            raise ApiError("Не знайдено", 404)
+        return dict(row)
+    if not delete_subtask(db, user_id, ref(op["id"])):
+        raise ApiError("Не знайдено", 404)
+    return {"ok": True, "id": ref(op["id"])}
+
+
+IDEMPOTENCY_KEY_MAX = 100
+IDEMPOTENCY_TTL = timedelta(days=7)
+
+
+def run_batch_once(db, user_id, key, ops, atomic=True):
+    """run_batch, що виконується один раз на ключ; повертає (body, replayed).
+
+    Перевірка і запис ключа — у тій самій транзакції, що й пакет, тож
+    пакет і його ключ або зберігаються разом, або не зберігаються зовсім.
+    """
+    stored = dal.get_idempotent_response(db, user_id, key)
+    if stored is not None:
+        return json.loads(stored), True
+    results, stats = run_batch(db, user_id, ops, atomic)
+    body = {"results": results, "stats": stats}
+    dal.save_idempotent_response(db, user_id, key, json.dumps(body))
+    dal.prune_idempotency_keys(db, user_id, (datetime.now() - IDEMPOTENCY_TTL).isoformat())
+    return body, False
+
+
 # ─── API: Add ───────────────────────────────────────────────────────
 @app.route("/api/add", methods=["POST"])
 @login_required
 def api_add():
     user_id = get_user_id()
     data = request.get_json(silent=True) or {}
-    text = data.get("text", "").strip()
-    rank = data.get("rank", "D").upper()
-    deadline = data.get("deadline") or None
-
-    if not text:
-        return jsonify({"error": "Текст місії не може бути порожнім"}), 400
-    if len(text) > 200:
-        return jsonify({"error": "Максимум 200 символів"}), 400
+    text = clean_text(data, "Текст місії не може бути порожнім")
+    rank = clean_rank(data.get("rank")) or "D"
+    deadline = clean_deadline(data.get("deadline"))
     if rank not in RANKS:
         rank = "D"
 
-    db = get_db()
-    cur = db.execute(
-        "INSERT INTO todos (user_id, text, rank, deadline, created_at) VALUES (?, ?, ?, ?, ?)",
-        (user_id, text, rank, deadline, datetime.now().isoformat()),
-    )
-    db.commit()
-    row = db.execute("SELECT * FROM todos WHERE id = ?", (cur.lastrowid,)).fetchone()
+    row = submit_write(add_todo, user_id, text, rank, deadline)
     return jsonify(row_to_dict(row)), 201
 
 
@@ -343,25 +1128,15 @@ def api_add():
 @app.route("/api/toggle/<int:todo_id>", methods=["POST"])
 @login_required
 def api_toggle(todo_id):
-    user_id = get_user_id()
-    db = get_db()
-    row = get_todo_or_404(db, todo_id, user_id)
-    new_done = 0 if row["done"] else 1
-    done_at = datetime.now().isoformat() if new_done else None
-    db.execute("UPDATE todos SET done=?, done_at=? WHERE id=?", (new_done, done_at, todo_id))
-    db.commit()
-    return jsonify(row_to_dict(db.execute("SELECT * FROM todos WHERE id=?", (todo_id,)).fetchone()))
+    row = submit_write(toggle_todo, get_user_id(), todo_id)
+    return jsonify(row_to_dict(row))
 
 
 # ─── API: Delete ────────────────────────────────────────────────────
 @app.route("/api/delete/<int:todo_id>", methods=["DELETE"])
 @login_required
 def api_delete(todo_id):
-    user_id = get_user_id()
-    db = get_db()
-    row = get_todo_or_404(db, todo_id, user_id)
-    db.execute("DELETE FROM todos WHERE id=?", (todo_id,))
-    db.commit()
+    row = submit_write(delete_todo, get_user_id(), todo_id)
     return jsonify({"ok": True, "deleted": row_to_dict(row)})
 
 
@@ -371,26 +1146,12 @@ def api_delete(todo_id):
 def api_edit(todo_id):
     user_id = get_user_id()
     data = request.get_json(silent=True) or {}
-    db = get_db()
-    row = get_todo_or_404(db, todo_id, user_id)
-
-    text = data.get("text", "").strip()
-    rank = data.get("rank", row["rank"]).upper()
-    deadline = data.get("deadline", row["deadline"]) or None
+    text = clean_text(data)
+    rank = clean_rank(data.get("rank"))
+    deadline = clean_deadline(data.get("deadline", KEEP))
 
-    if not text:
-        return jsonify({"error": "Текст не може бути порожнім"}), 400
-    if len(text) > 200:
-        return jsonify({"error": "Максимум 200 символів"}), 400
-    if rank not in RANKS:
-        rank = row["rank"]
-
-    db.execute(
-        "UPDATE todos SET text=?, rank=?, deadline=? WHERE id=?",
-        (text, rank, deadline, todo_id),
-    )
-    db.commit()
-    return jsonify(row_to_dict(db.execute("SELECT * FROM todos WHERE id=?", (todo_id,)).fetchone()))
+    row = submit_write(edit_todo, user_id, todo_id, text, rank, deadline)
+    return jsonify(row_to_dict(row))
 
 
 # ─── API: Stats ─────────────────────────────────────────────────────
@@ -398,13 +1159,86 @@ def api_edit(todo_id):
 @login_required
 def api_stats():
     user_id = get_user_id()
-    db = get_db()
-    stats = get_stats(db, user_id)
-    icon, name = ninja_rank(stats["done"])
-    stats["rank_icon"] = icon
-    stats["rank_name"] = name
-    stats["chakra"] = round((stats["done"] / stats["total"] * 100) if stats["total"] > 0 else 0)
-    return jsonify(stats)
+    etag = data_etag(user_id, "stats")
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return with_etag(jsonify(stats_payload(get_read_db(), user_id)), etag)
+
+
+# ─── API: Due ───────────────────────────────────────────────────────
+# Календар і порядок денний: діапазони дат ідуть індексом
+# idx_todos_deadline, тож навіть за роки історії читаються лише місії
+# з потрібними дедлайнами. Лічильники прострочених і сьогоднішніх — у
+# /api/stats (user_stats), їх щодня переносить на новий день run_rollover().
+DUE_RANGE_DAYS = 30
+ROLLOVER_BATCH = 500
+
+
+def roll_over(today):
+    for shard in shards.all():
+        while shard.writes.submit(dal.roll_over_stats, today, ROLLOVER_BATCH) == ROLLOVER_BATCH:
+            time.sleep(BACKFILL_PAUSE)
+
+
+def run_rollover():
+    """Одразу після старту і щодня після півночі."""
+    while True:
+        try:
+            roll_over(date.today().isoformat())
+        except Exception:
+            app.logger.exception("rollover failed")
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        time.sleep((midnight - now).total_seconds() + 1)
+
+
+@app.route("/api/due")
+@login_required
+def api_due():
+    """?from=&to= (ISO-дати, включно); view=agenda — місії за дедлайном
+    з курсором, view=calendar — кількість активних і виконаних за днями."""
+    user_id = get_user_id()
+    start = request.args.get("from") or date.today().isoformat()
+    if dal.iso_date(start) != start:
+        return jsonify({"error": "Невірна дата from"}), 400
+    end = request.args.get("to") or (date.fromisoformat(start) + timedelta(days=DUE_RANGE_DAYS)).isoformat()
+    if dal.iso_date(end) != end or end < start:
+        return jsonify({"error": "Невірна дата to"}), 400
+    view = request.args.get("view", "agenda")
+    filter_by = request.args.get("filter", "active")
+    if view not in ("agenda", "calendar") or filter_by not in ("active", "done", "all"):
+        return jsonify({"error": "Невірний параметр"}), 400
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor, DUE_KEYS)
+        if after is None:
+            return jsonify({"error": "Невірний курсор"}), 400
+
+    etag = data_etag(user_id, "due", view, filter_by, start, end, cursor, limit)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    db = get_read_db()
+    if view == "calendar":
+        active = dal.due_counts(db, user_id, 0, start, end)
+        done = dal.due_counts(db, user_id, 1, start, end)
+        days = {day: {"active": active.get(day, 0), "done": done.get(day, 0)}
+                for day in sorted(active.keys() | done.keys())}
+        return with_etag(jsonify({"from": start, "to": end, "days": days}), etag)
+
+    flags = {"active": (0,), "done": (1,), "all": (0, 1)}[filter_by]
+    # Для all — злиття двох уже впорядкованих діапазонів індексу, без сортування
+    rows = list(heapq.merge(*(dal.due_todos(db, user_id, flag, start, end, after, limit)
+                              for flag in flags),
+                            key=lambda r: (r["deadline"], r["id"])))[:limit + 1]
+    next_cursor = encode_cursor(rows[limit - 1], DUE_KEYS) if len(rows) > limit else None
+    return with_etag(jsonify({"from": start, "to": end,
+                              "items": [row_to_dict(r) for r in rows[:limit]],
+                              "next_cursor": next_cursor}), etag)
 
 
 # ─── API: List ──────────────────────────────────────────────────────
@@ -414,103 +1248,499 @@ def api_todos():
     user_id = get_user_id()
     filter_by = request.args.get("filter", "all")
     search = request.args.get("search", "").strip()
-
-    db = get_db()
-    conditions = ["user_id = ?"]
-    params = [user_id]
-
-    if filter_by == "active":
-        conditions.append("done = 0")
-    elif filter_by == "done":
-        conditions.append("done = 1")
-    if search:
-        conditions.append("text LIKE ?")
-        params.append(f"%{search}%")
-
-    rows = db.execute(
-        "SELECT * FROM todos WHERE " + " AND ".join(conditions) + ORDER_SQL,
-        params
-    ).fetchall()
-    return jsonify([row_to_dict(r) for r in rows])
-
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    keys = SEARCH_KEYS if search else ORDER_KEYS
+
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor, keys)
+        if after is None:
+            return jsonify({"error": "Невірний курсор"}), 400
+
+    columnar = wants_columnar()
+    etag = data_etag(user_id, "todos", filter_by, search, cursor, limit, columnar)
+    cached = not_modified(etag)
+    if cached:
+        cached.vary.add("Accept")
+        return cached
+
+    db = get_read_db()
+    rows = dal.query_todos(db, user_id, filter_by, search, after, limit)
+    if columnar:
+        response = columnar_page(rows, keys, limit)
+    else:
+        response = Response(stream_with_context(stream_page(rows, keys, limit)),
+                            mimetype="application/json")
+    response.vary.add("Accept")
+    return with_etag(response, etag)
 
 
 # --- API: Reorder ---
 @app.route("/api/reorder", methods=["POST"])
 @login_required
 def api_reorder():
+    """Старий формат: позиції всього списку. Пишемо лише змінені рядки."""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ApiError("Очікується список місій")
+    for i, item in enumerate(items):
+        todo_id = item.get("id") if isinstance(item, dict) else None
+        position = item.get("position") if isinstance(item, dict) else None
+        if not (isinstance(todo_id, int) and not isinstance(todo_id, bool)
+                and isinstance(position, (int, float)) and not isinstance(position, bool)
+                and math.isfinite(position)):
+            raise ApiError("Невірна місія: потрібні id і position", index=i)
+    updated = submit_write(reorder_todos, get_user_id(), items)
+    return jsonify({"ok": True, "updated": updated})
+
+
+# --- API: Move ---
+@app.route("/api/move/<int:todo_id>", methods=["POST"])
+@login_required
+def api_move(todo_id):
+    """Ставить місію між prev_id і next_id (сусіди у видимому списку) одним UPDATE."""
     user_id = get_user_id()
-    items = request.get_json(silent=True) or []
-    db = get_db()
-    for item in items:
-        db.execute("UPDATE todos SET position=? WHERE id=? AND user_id=?",
-                   (item["position"], item["id"], user_id))
-    db.commit()
-    return jsonify({"ok": True})
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        raise ApiError("Очікується JSON-об'єкт")
+    for field in ("prev_id", "next_id"):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ApiError(f"Невірне поле {field}")
+    position, lo, hi = submit_write(
+        move_todo, user_id, todo_id, data.get("prev_id"), data.get("next_id")
+    )
+    if position is None:
+        return jsonify({"error": "Список змінився, оновіть сторінку"}), 409
+    if lo is not None and hi is not None and hi - lo < REBALANCE_GAP:
+        schedule_rebalance(user_id)
+    return jsonify({"ok": True, "position": position})
 
 
 @app.route("/api/subtasks/<int:todo_id>")
 @login_required
 def api_get_subtasks(todo_id):
     user_id = get_user_id()
-    db = get_db()
-    get_todo_or_404(db, todo_id, user_id)
-    rows = db.execute(
-        "SELECT * FROM subtasks WHERE todo_id=? ORDER BY created_at ASC",
-        (todo_id,)
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    columnar = wants_columnar()
+    etag = data_etag(user_id, "subtasks", todo_id, columnar)
+    cached = not_modified(etag)
+    if cached:
+        cached.vary.add("Accept")
+        return cached
+    if columnar:
+        result = dal.list_subtasks_columns(get_read_db(), user_id, todo_id)
+        if result is None:
+            abort(404)
+        response = columnar_response(*result)
+    else:
+        rows = dal.list_subtasks(get_read_db(), user_id, todo_id)
+        if rows is None:
+            abort(404)
+        response = jsonify([dict(r) for r in rows])
+    response.vary.add("Accept")
+    return with_etag(response, etag)
+
+
+# ─── API: Archive ───────────────────────────────────────────────────
+# Виконані місії, старші за ARCHIVE_AFTER_DAYS, кожні ARCHIVE_INTERVAL
+# секунд переносяться в архів пакетами по ARCHIVE_BATCH через письменника.
+# Кожен воркер запускає свій архіватор; пакети ідемпотентні, тож зайвий
+# прохід просто нічого не знаходить. ARCHIVE_AFTER_DAYS=0 вимикає архів.
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_INTERVAL = int(os.environ.get("ARCHIVE_INTERVAL", 3600))
+ARCHIVE_BATCH = 500
+
+
+def archive_batch(db, before, archived_at):
+    ids = dal.archivable_todo_ids(db, before, ARCHIVE_BATCH)
+    if ids:
+        dal.archive_todos(db, ids, archived_at)
+    return len(ids)
+
+
+def archive_old_todos():
+    """Переносить в архів усе, що вже настав час перенести; повертає кількість."""
+    before = (datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    total = 0
+    for shard in shards.all():
+        while True:
+            moved = shard.writes.submit(archive_batch, before, datetime.now().isoformat())
+            total += moved
+            if moved < ARCHIVE_BATCH:
+                break
+            time.sleep(BACKFILL_PAUSE)
+    return total
+
+
+def run_archiver():
+    while True:
+        try:
+            archive_old_todos()
+        except Exception:
+            app.logger.exception("archive failed")
+        time.sleep(ARCHIVE_INTERVAL)
+
+
+@app.route("/api/archive")
+@login_required
+def api_archive():
+    """Сторінка архіву: місії разом із підзадачами, від нещодавно виконаних."""
+    user_id = get_user_id()
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor, ARCHIVE_KEYS)
+        if after is None:
+            return jsonify({"error": "Невірний курсор"}), 400
+
+    etag = data_etag(user_id, "archive", cursor, limit)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    db = get_read_db()
+    rows = dal.list_archive(db, user_id, after, limit)
+    items = [row_to_dict(r) for r in rows[:limit]]
+    subtasks = {item["id"]: item.setdefault("subtasks", []) for item in items}
+    for sub in dal.archived_subtasks(db, list(subtasks)):
+        subtasks[sub["todo_id"]].append(row_to_dict(sub))
+    next_cursor = encode_cursor(rows[limit - 1], ARCHIVE_KEYS) if len(rows) > limit else None
+    return with_etag(jsonify({"items": items, "next_cursor": next_cursor}), etag)
+
+
+@app.route("/api/archive/<int:todo_id>/restore", methods=["POST"])
+@login_required
+def api_restore(todo_id):
+    row = submit_write(restore_todo, get_user_id(), todo_id)
+    return jsonify(row_to_dict(row))
+
+
+# ─── API: Export / import ───────────────────────────────────────────
+# Експорт іде прямо з курсора в одному знімку бази, імпорт читає тіло
+# построково і пише шматками по transfer.IMPORT_CHUNK місій через
+# письменника. Формат — ?format=ndjson|csv (для імпорту ще Content-Type).
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_response(sources, fmt, name, with_users=False):
+    """sources — (з'єднання, records(db)); кожне читається у своєму знімку."""
+
+    def records():
+        for db, source in sources:
+            with transfer.snapshot(db):
+                yield from source(db)
+
+    def generate():
+        if fmt == "csv":
+            yield "\ufeff"  # як і CSV з кодами — для Excel
+        yield from transfer.export_lines(records(), fmt, with_users)
+
+    filename = f"{name}-{date.today().isoformat()}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+
+
+def export_format():
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_MIMETYPES:
+        raise ApiError("Формат — ndjson або csv")
+    return fmt
+
+
+@app.route("/api/export")
+@login_required
+def api_export():
+    """Усі місії користувача з підзадачами, разом з архівом."""
+    user_id = get_user_id()
+    return export_response([(get_read_db(), lambda db: transfer.user_records(db, user_id))],
+                           export_format(), "ninja-todo")
+
+
+@app.route("/api/import", methods=["POST"])
+@login_required
+def api_import():
+    """Місії з дампу /api/export додаються до списку користувача.
+
+    Шматки, записані до помилки, лишаються: відповідь з помилкою каже,
+    скільки вже імпортовано.
+    """
+    user_id = get_user_id()
+    fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if fmt not in EXPORT_MIMETYPES:
+        raise ApiError("Формат — ndjson або csv")
+    lines = io.TextIOWrapper(io.BufferedReader(request.stream), encoding="utf-8-sig", newline="")
+    todos = subtasks = 0
+    try:
+        for chunk in transfer.chunks(transfer.parse(lines, fmt)):
+            _, n, m = submit_write(transfer.import_chunk, chunk, user_id, False)
+            todos += n
+            subtasks += m
+    except transfer.BadRecord as e:
+        return jsonify({"error": str(e), "todos": todos, "subtasks": subtasks}), 400
+    except UnicodeDecodeError:
+        return jsonify({"error": "Файл має бути в UTF-8", "todos": todos, "subtasks": subtasks}), 400
+    return jsonify({"todos": todos, "subtasks": subtasks})
+
+
+# ─── API: Sync ──────────────────────────────────────────────────────
+@app.route("/api/sync")
+@login_required
+def api_sync():
+    """Зміни після версії since: змінені рядки і id видалених.
+
+    Без since (або з since, якого сервер не видавав) — повний знімок
+    з full=true. Клієнт зберігає version і передає її наступного разу.
+    """
+    user_id = get_user_id()
+    since = request.args.get("since", 0, type=int)
+    db = get_read_db()
+    # Версію читаємо першою: рядки, змінені після неї, прийдуть
+    # і зараз, і наступного разу, а застосовувати їх можна повторно.
+    version = dal.get_version(db, user_id)
+    full = since <= 0 or since > version
+    after = -1 if full else since
+    deleted = {"todos": [], "subtasks": []}
+    if not full:
+        for row in dal.tombstones_since(db, user_id, since):
+            deleted[row["kind"] + "s"].append(row["row_id"])
+    return jsonify({
+        "user_id": user_id,
+        "version": version,
+        "full": full,
+        "todos": [row_to_dict(r) for r in dal.todos_since(db, user_id, after)],
+        "subtasks": [dict(r) for r in dal.subtasks_since(db, user_id, after)],
+        "deleted": deleted,
+    })
+
+
+# ─── API: Events ────────────────────────────────────────────────────
+# SSE-потік змін користувача. Події приходять зі спільного опитувача
+# воркера (events.py), тож потік лише спить на своїй черзі й не тримає
+# з'єднання з базою. Потік живе SSE_STREAM_SECONDS, після чого браузер
+# перепідключається з Last-Event-ID і отримує пропущене з журналу changes.
+# Опитувач у кожного шарду свій, а SSE_MAX_STREAMS — спільний на воркер.
+# Під WSGI відкритий потік займає потік воркера на весь свій час, тож
+# типово потоків немає: /api/events відповідає 503, і сторінка лишається
+# на періодичній синхронізації. asgi.py тримає потоки в циклі подій і
+# ставить свій ліміт (ASGI_SSE_MAX_STREAMS).
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 0))
+SSE_STREAM_SECONDS = 120
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def render_changes(db, user_id, changes):
+    """Події SSE (seq, event, data) з рядків changes одного користувача.
+
+    Кілька змін одного рядка стискаються до останньої, наприкінці —
+    свіжа статистика.
+    """
+    latest = {}
+    for change in changes:
+        key = (change["kind"], change["row_id"])
+        latest.pop(key, None)
+        latest[key] = change
+    todo_ids = [c["row_id"] for c in latest.values() if c["kind"] == "todo" and c["action"] != "deleted"]
+    sub_ids = [c["row_id"] for c in latest.values() if c["kind"] == "subtask" and c["action"] != "deleted"]
+    todos = {r["id"]: r for r in dal.todos_by_ids(db, user_id, todo_ids)}
+    subtasks = {r["id"]: r for r in dal.subtasks_by_ids(db, user_id, sub_ids)}
+
+    events = []
+    for change in latest.values():
+        data = {"action": change["action"], "id": change["row_id"]}
+        if change["kind"] == "subtask":
+            data["todo_id"] = change["todo_id"]
+        if change["action"] != "deleted":
+            row = (todos if change["kind"] == "todo" else subtasks).get(change["row_id"])
+            if row is None:
+                continue  # рядок уже видалено — його подія «deleted» прийде далі
+            data[change["kind"]] = row_to_dict(row) if change["kind"] == "todo" else dict(row)
+        events.append((change["seq"], change["kind"], data))
+    events.append((changes[-1]["seq"], "stats", stats_payload(db, user_id)))
+    return events
+
+
+def sse_message(seq, event, data):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+class EventStream:
+    """Один SSE-потік: пропущене з журналу, дедуплікація за seq і текст подій.
+
+    Спільний для маршруту нижче і нативного потоку asgi.py — відрізняється
+    лише те, як вони чекають на чергу.
+    """
+
+    def __init__(self, hub, user_id, q, backlog, last_id):
+        self.hub = hub
+        self.user_id = user_id
+        self.queue = q
+        self.backlog = backlog
+        self.sent = last_id or 0
+
+    def opening(self):
+        parts = ["retry: 2000\n\n"]
+        for events in self.backlog:
+            self.sent = max(self.sent, events[-1][0])
+            parts.append("".join(sse_message(*e) for e in events))
+        return "".join(parts)
+
+    def render(self, events):
+        """Текст пачки подій з черги; "" — вже надіслано з журналу."""
+        if events[-1][0] <= self.sent:
+            return ""
+        self.sent = events[-1][0]
+        return "".join(sse_message(*e) for e in events)
+
+    def close(self):
+        self.hub.unsubscribe(self.user_id, self.queue)
+
+
+sse_lock = threading.Lock()
+
+
+def open_event_stream(db, user_id, last_id, q=None):
+    """EventStream або None, якщо ліміт потоків вичерпано; db — з'єднання шарду користувача."""
+    hub = get_shard().events
+    with sse_lock:
+        if sum(shard.events.stats()["streams"] for shard in shards.opened()) >= SSE_MAX_STREAMS:
+            return None
+        q = hub.subscribe(user_id, db, q)
+    if q is None:
+        return None
+    backlog = []
+    if last_id is not None:
+        first = dal.first_change_seq(db)
+        last = dal.last_change_seq(db)
+        if first is not None and last_id < first - 1:
+            backlog = [[(last_id, "resync", {})]]
+        elif last_id > last:
+            # id з журналу іншого шарду: користувача перенесли
+            last_id = last
+            backlog = [[(last_id, "resync", {})]]
+        else:
+            changes = dal.user_changes_since(db, user_id, last_id)
+            if changes:
+                backlog = [render_changes(db, user_id, changes)]
+    return EventStream(hub, user_id, q, backlog, last_id)
+
+
+@app.route("/api/events")
+@login_required
+def api_events():
+    stream = open_event_stream(get_read_db(), get_user_id(),
+                               request.headers.get("Last-Event-ID", type=int))
+    if stream is None:
+        # Клієнт лишається на періодичній синхронізації
+        return jsonify({"error": "Забагато потоків"}), 503
+    # Потік може жити хвилинами — з'єднання повертаємо в пули одразу
+    release_read_dbs()
+
+    def generate():
+        deadline = time.monotonic() + SSE_STREAM_SECONDS
+        try:
+            yield stream.opening()
+            while time.monotonic() < deadline:
+                try:
+                    events = stream.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                chunk = stream.render(events)
+                if chunk:
+                    yield chunk
+        finally:
+            stream.close()
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.route("/api/subtasks/<int:todo_id>/add", methods=["POST"])
 @login_required
 def api_add_subtask(todo_id):
     user_id = get_user_id()
-    data = request.get_json(silent=True) or {}
-    text = data.get("text", "").strip()
-    if not text:
-        return jsonify({"error": "Текст не може бути порожнім"}), 400
-    db = get_db()
-    get_todo_or_404(db, todo_id, user_id)
-    cur = db.execute(
-        "INSERT INTO subtasks (todo_id, text, done, created_at) VALUES (?, ?, 0, ?)",
-        (todo_id, text, datetime.now().isoformat())
-    )
-    db.commit()
-    row = db.execute("SELECT * FROM subtasks WHERE id=?", (cur.lastrowid,)).fetchone()
+    text = clean_text(request.get_json(silent=True) or {})
+    row = submit_write(add_subtask, user_id, todo_id, text)
     return jsonify(dict(row)), 201
 
 
 @app.route("/api/subtasks/toggle/<int:sub_id>", methods=["POST"])
 @login_required
 def api_toggle_subtask(sub_id):
-    user_id = get_user_id()
-    db = get_db()
-    sub = db.execute("SELECT * FROM subtasks WHERE id=?", (sub_id,)).fetchone()
-    if not sub:
+    row = submit_write(toggle_subtask, get_user_id(), sub_id)
+    if not row:
         return jsonify({"error": "Не знайдено"}), 404
-    get_todo_or_404(db, sub["todo_id"], user_id)
-    new_done = 0 if sub["done"] else 1
-    db.execute("UPDATE subtasks SET done=? WHERE id=?", (new_done, sub_id))
-    db.commit()
-    return jsonify(dict(db.execute("SELECT * FROM subtasks WHERE id=?", (sub_id,)).fetchone()))
+    return jsonify(dict(row))
 
 
 @app.route("/api/subtasks/delete/<int:sub_id>", methods=["DELETE"])
 @login_required
 def api_delete_subtask(sub_id):
-    user_id = get_user_id()
-    db = get_db()
-    sub = db.execute("SELECT * FROM subtasks WHERE id=?", (sub_id,)).fetchone()
-    if not sub:
+    if not submit_write(delete_subtask, get_user_id(), sub_id):
         return jsonify({"error": "Не знайдено"}), 404
-    get_todo_or_404(db, sub["todo_id"], user_id)
-    db.execute("DELETE FROM subtasks WHERE id=?", (sub_id,))
-    db.commit()
     return jsonify({"ok": True})
 
-with app.app_context():
-    init_db()
+# ─── API: Batch ─────────────────────────────────────────────────────
+@app.route("/api/batch", methods=["POST"])
+@login_required
+def api_batch():
+    """Кілька операцій однією транзакцією: усі виконуються або жодна
+    (з "atomic": false — кожна окремо, див. run_batch)."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiError("Очікується JSON-об'єкт")
+    ops = data.get("ops")
+    if not isinstance(ops, list) or not ops:
+        raise ApiError("Порожній пакет")
+    if len(ops) > MAX_BATCH_OPS:
+        raise ApiError(f"Максимум {MAX_BATCH_OPS} операцій")
+    atomic = data.get("atomic", True) is not False
+    parsed = []
+    for i, op in enumerate(ops):
+        try:
+            parsed.append(parse_batch_op(op, i))
+        except ApiError as e:
+            if atomic:
+                raise
+            parsed.append(e)
+
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        results, stats = submit_write(run_batch, get_user_id(), parsed, atomic)
+        return jsonify({"results": results, "stats": stats})
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX:
+        raise ApiError("Невірний Idempotency-Key")
+    body, replayed = submit_write(run_batch_once, get_user_id(), key, parsed, atomic)
+    response = jsonify(body)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+# ─── Migrations ─────────────────────────────────────────────────────
+# Актуальна схема — лише читання user_version. Бекфіли, що лишились після
+# міграції, ідуть шматками через письменника між звичайними записами.
+BACKFILL_PAUSE = 0.05
+
+
+def run_backfills(shard):
+    while shard.writes.submit(migrations.backfill_step):
+        time.sleep(BACKFILL_PAUSE)
+
+
+# Каталог і всі налаштовані шарди відкриваються (і доганяють схему) під час старту
+shards.all()
+if ARCHIVE_AFTER_DAYS > 0:
+    threading.Thread(target=run_archiver, name="archiver", daemon=True).start()
+threading.Thread(target=run_rollover, name="rollover", daemon=True).start()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
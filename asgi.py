@@ -0,0 +1,295 @@
+"""ASGI-вхід: ті самі маршрути, сесії й шаблони app.py, але з'єднання тримає asyncio.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+
+Запит спершу повністю читається в циклі подій (до MAX_BODY), потім
+Flask-обробник виконується в обмеженому пулі потоків (ASGI_DB_THREADS, типово
+DB_POOL_SIZE) — лише там відбуваються читання SQLite. Записи, як і під
+gunicorn, ідуть через єдиного письменника WriteQueue. Відповідь збирається
+ще в потоці пулу, тож курсор ніколи не живе між await, а повільний
+клієнт не тримає потік: її віддає вже цикл подій. Виняток — потокові
+відповіді, довші за STREAM_CHUNK (експорт): їх потік пулу віддає шматками.
+Так само тіло імпорту (STREAM_BODY_PATHS) не буферизується: обробник
+читає його з receive() шматками, поки пише в базу, і ліміт MAX_BODY на
+нього не діє.
+
+/api/events обслуговується нативно: підписка й журнал пропущеного — у
+пулі, а далі потік чекає на asyncio.Queue, яку наповнює опитувач
+EventHub. Відкритий потік чи простий keep-alive коштує корутину, а не
+потік, тому ліміт потоків тут свій (ASGI_SSE_MAX_STREAMS).
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, request, session
+
+import app as app_module
+
+flask_app = app_module.app
+
+DB_THREADS = int(os.environ.get("ASGI_DB_THREADS", app_module.POOL_SIZE))
+MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", 1024 * 1024))
+STREAM_CHUNK = 64 * 1024  # довші відповіді йдуть у цикл подій шматками такого розміру
+STREAM_BODY_PATHS = {"/api/import"}  # тіло читається по ходу, без MAX_BODY
+
+# Потоки пулу читань більше за з'єднання не дадуть нічого, крім черги в пулі
+executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="sqlite")
+# Ліміт потоків спільний на воркер; опитувачі вже відкритих шардів отримують його теж
+app_module.SSE_MAX_STREAMS = int(os.environ.get("ASGI_SSE_MAX_STREAMS", 10000))
+for shard in app_module.shards.opened():
+    shard.events.max_streams = app_module.SSE_MAX_STREAMS
+
+
+class LoopQueue:
+    """Черга для EventHub: put() з потоку опитувача будить корутину потоку."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, events):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, events)
+
+
+# ─── ASGI → WSGI ────────────────────────────────────────────────────
+class ClientDisconnected(OSError):
+    pass
+
+
+class BodyStream(io.RawIOBase):
+    """wsgi.input, що тягне тіло з receive() у потоці пулу, шматок за шматком."""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected("клієнт пішов посеред тіла запиту")
+            self._buffer = message.get("body", b"")
+            self._more = message.get("more_body", False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def build_environ(scope, body):
+    """WSGI environ за PEP 3333 для HTTP-запиту ASGI; body — байти або BodyStream."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body if isinstance(body, BodyStream) else io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    if isinstance(body, BodyStream):
+        # Кінець тіла позначає сам потік (more_body), зокрема й для chunked
+        environ["wsgi.input_terminated"] = True
+    else:
+        # Тіло вже прочитане повністю, зокрема й chunked
+        environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def call_wsgi(environ, loop, send):
+    """Виконується в пулі: повна відповідь Flask як (статус, заголовки, тіло).
+
+    Потокову відповідь (як-от експорт), довшу за STREAM_CHUNK, цей самий
+    потік віддає шматками сам і повертає None: генератор тримає курсор
+    SQLite і контекст запиту, тож має доїхати до кінця там, де почався.
+    Кожен шматок чекає, поки цикл подій його відправить, — пам'ять не росте.
+    """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = flask_app.wsgi_app(environ, start_response)
+    try:
+        chunks = iter(result)
+        buffered, size = [], 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK:
+                break
+        else:
+            return started[0], started[1], b"".join(buffered)
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        send_now({"type": "http.response.start", "status": started[0],
+                  "headers": encode_headers(started[1])})
+        send_now({"type": "http.response.body", "body": b"".join(buffered), "more_body": True})
+        buffered, size = [], 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK:
+                send_now({"type": "http.response.body", "body": b"".join(buffered), "more_body": True})
+                buffered, size = [], 0
+        send_now({"type": "http.response.body", "body": b"".join(buffered)})
+        return None
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+def encode_headers(headers):
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+
+async def send_response(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status,
+                "headers": encode_headers(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+async def read_body(receive):
+    """Тіло запиту; None — клієнт пішов, не дочекавшись відповіді."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise RequestTooLarge
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+# ─── SSE ────────────────────────────────────────────────────────────
+def open_events(environ, q):
+    """Виконується в пулі: (EventStream, None) або (None, відповідь-помилка)."""
+    with flask_app.request_context(environ):
+        rv = app_module.login_required(lambda: None)()
+        if rv is None:
+            stream = app_module.open_event_stream(
+                app_module.get_read_db(), app_module.get_user_id(),
+                request.headers.get("Last-Event-ID", type=int), q)
+            if stream is not None:
+                return stream, None
+            rv = jsonify({"error": "Забагато потоків"}), 503
+        response = flask_app.make_response(rv)
+        flask_app.session_interface.save_session(flask_app, session, response)
+        return None, (response.status_code, response.headers.to_wsgi_list(), response.get_data())
+
+
+async def serve_events(environ, receive, send):
+    loop = asyncio.get_running_loop()
+    q = LoopQueue(loop)
+    stream, error = await loop.run_in_executor(executor, open_events, environ, q)
+    if error is not None:
+        await send_response(send, *error)
+        return
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    headers = [("Content-Type", "text/event-stream; charset=utf-8"), *app_module.SSE_HEADERS.items()]
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": encode_headers(headers)})
+        chunk = stream.opening()
+        deadline = time.monotonic() + app_module.SSE_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+            get = asyncio.ensure_future(q.queue.get())
+            done, _ = await asyncio.wait({get, disconnected}, timeout=app_module.SSE_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                get.cancel()
+                return
+            if get in done:
+                chunk = stream.render(get.result())
+            else:
+                get.cancel()
+                chunk = ": ping\n\n"
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        stream.close()
+
+
+# ─── Вхід ───────────────────────────────────────────────────────────
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return  # WebSocket застосунок не обслуговує
+
+    loop = asyncio.get_running_loop()
+    if scope["method"] == "POST" and scope["path"] in STREAM_BODY_PATHS:
+        body = BodyStream(receive, loop)
+    else:
+        try:
+            body = await read_body(receive)
+        except RequestTooLarge:
+            await send_response(send, 413, [("Content-Type", "application/json")],
+                                b'{"error": "Request too large"}')
+            return
+        if body is None:
+            return
+    environ = build_environ(scope, body)
+    if scope["method"] == "GET" and scope["path"] == "/api/events":
+        await serve_events(environ, receive, send)
+        return
+    response = await loop.run_in_executor(executor, call_wsgi, environ, loop, send)
+    if response is not None:
+        await send_response(send, *response)
@@ -0,0 +1,18 @@
+"""Навантажувальні бенчмарки застосунку.
+
+    python -m bench                       # обидва режими, звіт у stdout
+    python -m bench --mode inprocess --out result.json
+    python -m bench --save-baseline       # записати bench/baseline.json
+
+Кожен запуск засіває тимчасову базу (кілька «потужних» користувачів
+мають більшість місій), проганяє суміш запитів через test client Flask
+і/або через gunicorn з налаштуваннями Procfile і друкує JSON з
+пропускною здатністю та p50/p95/p99 для кожного маршруту. Якщо
+результат гірший за baseline більше ніж на --tolerance, код виходу 1.
+
+    python -m bench.plans                 # плани гарячих запитів
+
+перевіряє EXPLAIN QUERY PLAN кожного запиту, який застосунок виконує
+під тією ж сумішшю: жодного тимчасового B-дерева для сортування і
+жодного повного скану таблиці.
+"""
@@ -0,0 +1,94 @@
+"""python -m bench — див. bench/__init__.py."""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from bench import runner
+from bench.seed import copy, seed
+from bench.workload import Workload
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    p.add_argument("--mode", choices=("inprocess", "gunicorn", "both"), default="both")
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--todos", type=int, default=5000, help="місій на всіх користувачів")
+    p.add_argument("--subtasks", type=int, default=10000, help="підзадач на всіх користувачів")
+    p.add_argument("--skew", type=float, default=1.0, help="показник перекосу між користувачами")
+    p.add_argument("--requests", type=int, default=2000, help="виміряних запитів на режим")
+    p.add_argument("--warmup", type=int, default=50, help="невиміряних запитів на потік")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--tolerance", type=float, default=0.5,
+                   help="допустиме погіршення відносно baseline (0.5 = 50%%)")
+    p.add_argument("--save-baseline", action="store_true",
+                   help="записати результат як новий baseline замість порівняння")
+    p.add_argument("--out", help="файл для JSON-звіту (типово stdout)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {k: getattr(args, k) for k in
+              ("users", "todos", "subtasks", "skew", "requests", "warmup", "concurrency", "seed")}
+    modes = ("inprocess", "gunicorn") if args.mode == "both" else (args.mode,)
+
+    with tempfile.TemporaryDirectory(prefix="ninja-bench-") as tmp:
+        inprocess_db = os.path.join(tmp, "inprocess.db")
+        gunicorn_db = os.path.join(tmp, "gunicorn.db")
+
+        # Схему створює сам застосунок під час імпорту, тож шлях задаємо до нього
+        os.environ["DATABASE_PATH"] = inprocess_db
+        import app as app_module
+
+        codes = seed(inprocess_db, args.users, args.todos, args.subtasks, args.skew, args.seed)
+        if "gunicorn" in modes:
+            copy(inprocess_db, gunicorn_db)
+
+        results = {}
+        if "inprocess" in modes:
+            print("inprocess…", file=sys.stderr)
+            results["inprocess"] = runner.run(
+                Workload(inprocess_db, codes, args.skew), codes,
+                lambda user_id, code: runner.InProcessClient(app_module.app, user_id, code),
+                args.requests, args.concurrency, args.warmup, args.seed,
+            )
+        if "gunicorn" in modes:
+            print("gunicorn…", file=sys.stderr)
+            with runner.Gunicorn(gunicorn_db) as server:
+                results["gunicorn"] = runner.run(
+                    Workload(gunicorn_db, codes, args.skew), codes,
+                    lambda user_id, code: runner.HttpClient("127.0.0.1", server.port, user_id, code),
+                    args.requests, args.concurrency, args.warmup, args.seed,
+                )
+
+    report = {"config": config, "results": results}
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("Увага: параметри прогону відрізняються від baseline", file=sys.stderr)
+        report["regressions"] = runner.compare(results, baseline, args.tolerance)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Плани гарячих запитів: без тимчасових B-дерев і повних сканів.
+
+    python -m bench.plans             # код виходу 1, якщо є порушення
+    python -m bench.plans --verbose   # ще й плани всіх запитів
+
+Гарячі запити — ті, що застосунок справді виконує: суміш bench.workload
+плюс наступні сторінки списку й синхронізація проганяються через test
+client, а хук dal.add_query_hook збирає кожен різний SQL. Для кожного
+EXPLAIN QUERY PLAN з тими ж параметрами на засіяній базі; порушення —
+рядок плану з USE TEMP B-TREE або SCAN таблиці (сканувати віртуальні
+FTS5-таблиці — це і є пошук за індексом).
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+from bench.seed import seed
+from bench.workload import Workload
+
+# Запити, яким сортування чи скан дозволено, і чому
+EXEMPT = {
+    "search_todos": "порядок за bm25 не індексується; сортуються лише збіги FTS5",
+    "subtasks_since": "сортується лише дельта синхронізації, а не всі підзадачі",
+}
+
+
+def violations(plan):
+    found = []
+    for detail in plan:
+        if "USE TEMP B-TREE" in detail:
+            found.append(detail)
+        elif detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail:
+            found.append(detail)
+    return found
+
+
+def collect(app_module, codes, path, requests, seed_value):
+    """{(назва, sql): параметри} усіх запитів dal під сумішшю."""
+    import dal
+
+    seen = {}
+
+    def hook(name, sql, params, seconds, db):
+        seen.setdefault((name, " ".join(sql.split())), params)
+
+    workload = Workload(path, codes, 1.0)
+    rng = random.Random(seed_value)
+    clients = {}
+    for user_id in codes:
+        clients[user_id] = client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+
+    dal.add_query_hook(hook)
+    try:
+        for _ in range(requests):
+            name, user_id, method, url, body = workload.next(rng)
+            # Відповідь читається до кінця й закривається: потокові (експорт)
+            # інакше лишають відкритий контекст запиту
+            with clients[user_id].open(url, method=method, json=body) as response:
+                response.get_data()
+                if response.status_code == 201:
+                    workload.observe(name, user_id, 201, response.get_json())
+        # Наступні сторінки (keyset-умови) і синхронізація — у суміші їх немає
+        client = clients[next(iter(codes))]
+        for url in ("/api/todos", "/api/todos?filter=active", "/api/todos?search=місія"):
+            with client.get(url) as response:
+                data = response.get_json()
+            if data.get("next_cursor"):
+                sep = "&" if "?" in url else "?"
+                client.get(f"{url}{sep}cursor={data['next_cursor']}").close()
+        client.get("/api/sync?since=1").close()
+    finally:
+        dal.remove_query_hook(hook)
+    return seen
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.plans", description=__doc__)
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--todos", type=int, default=5000)
+    p.add_argument("--subtasks", type=int, default=10000)
+    p.add_argument("--requests", type=int, default=500, help="запитів суміші")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="ninja-plans-") as tmp:
+        path = os.path.join(tmp, "plans.db")
+        os.environ["DATABASE_PATH"] = path
+        import app as app_module
+
+        codes = seed(path, args.users, args.todos, args.subtasks, 1.0, args.seed)
+        seen = collect(app_module, codes, path, args.requests, args.seed)
+
+        db = sqlite3.connect(path)
+        report = []
+        for (name, sql), params in sorted(seen.items()):
+            if params is None:  # executemany — план від значень не залежить
+                params = [None] * sql.count("?")
+            plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            bad = [] if name in EXEMPT else violations(plan)
+            report.append({"query": name, "sql": sql, "plan": plan, "violations": bad})
+        db.close()
+
+    failed = [r for r in report if r["violations"]]
+    for r in report if args.verbose else failed:
+        mark = "FAIL" if r["violations"] else "ok"
+        if r["query"] in EXEMPT:
+            mark = "exempt: " + EXEMPT[r["query"]]
+        print(f"{r['query']} [{mark}]\n  {r['sql']}")
+        for detail in r["plan"]:
+            print("    " + detail)
+    print(json.dumps({"queries": len(report), "violations": len(failed)}), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
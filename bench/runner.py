@@ -0,0 +1,250 @@
+"""Прогін суміші запитів і статистика затримок.
+
+Клієнти двох видів: test client Flask у цьому ж процесі (лише код
+застосунку, без мережі й WSGI-сервера) і HTTP до gunicorn, запущеного
+з командою з Procfile.
+"""
+import http.client
+import json
+import math
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class InProcessClient:
+    def __init__(self, app, user_id, code):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["user_id"] = user_id
+
+    def request(self, method, url, body=None):
+        response = self.client.open(url, method=method, json=body)
+        data = response.get_data()  # дочитуємо потокові відповіді
+        return response.status_code, data
+
+    def close(self):
+        pass
+
+
+class HttpClient:
+    """Keep-alive з'єднання з сесійною cookie одного користувача."""
+
+    def __init__(self, host, port, user_id, code):
+        self.host = host
+        self.port = port
+        self.conn = None
+        status, _, headers = self._send("POST", "/login", f"code={code}",
+                                         {"Content-Type": "application/x-www-form-urlencoded"})
+        cookie = headers.get("Set-Cookie", "")
+        if status != 302 or "session=" not in cookie:
+            raise RuntimeError(f"Не вдалося увійти як {code}: HTTP {status}")
+        self.cookie = cookie.split(";", 1)[0]
+
+    def _send(self, method, url, body, headers):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, url, body=body, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read(), response.headers
+            except (http.client.HTTPException, OSError):
+                # Сервер закрив keep-alive з'єднання — відкриваємо нове
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def request(self, method, url, body=None):
+        headers = {"Cookie": self.cookie}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        status, data, _ = self._send(method, url, body, headers)
+        return status, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def procfile_command(port):
+    """Команда web з Procfile, прив'язана до 127.0.0.1:port."""
+    with open(os.path.join(ROOT, "Procfile")) as f:
+        line = next(l for l in f if l.startswith("web:"))
+    args = shlex.split(line[len("web:"):].replace("$PORT", str(port)))
+    args = [a.replace("0.0.0.0:", "127.0.0.1:") for a in args]
+    # Той самий інтерпретатор, що й у бенчмарку, — і той самий virtualenv
+    return [sys.executable, "-m", args[0], *args[1:]]
+
+
+class Gunicorn:
+    def __init__(self, database, startup_timeout=30):
+        self.database = database
+        self.startup_timeout = startup_timeout
+        self.port = free_port()
+        self.proc = None
+
+    def __enter__(self):
+        env = dict(os.environ, DATABASE_PATH=self.database, PORT=str(self.port))
+        self.proc = subprocess.Popen(procfile_command(self.port), cwd=ROOT, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError("gunicorn завершився: " + self.proc.stderr.read().decode()[-2000:])
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("gunicorn не відповів за %d с" % self.startup_timeout)
+
+    def __exit__(self, *exc):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGTERM)
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+def percentile(sorted_values, p):
+    """Перцентиль найближчого рангу."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(len(sorted_values) * p / 100))
+    return sorted_values[rank - 1]
+
+
+def run(workload, codes, make_client, requests, concurrency, warmup, seed):
+    """Проганяє requests запитів у concurrency потоків; повертає звіт."""
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index, count):
+        rng = random.Random(seed * 1000 + index)
+        clients = {}
+        local = {}
+        local_errors = {}
+
+        def one():
+            name, user_id, method, url, body = workload.next(rng)
+            client = clients.get(user_id)
+            if client is None:
+                client = clients[user_id] = make_client(user_id, codes[user_id])
+            started = time.perf_counter()
+            status, data = client.request(method, url, body)
+            elapsed = time.perf_counter() - started
+            if status == 201:
+                workload.observe(name, user_id, status, json.loads(data))
+            return name, status, elapsed
+
+        try:
+            for _ in range(warmup):
+                one()
+            start_barrier.wait()
+            for _ in range(count):
+                name, status, elapsed = one()
+                local.setdefault(name, []).append(elapsed)
+                if status >= 400:
+                    local_errors[name] = local_errors.get(name, 0) + 1
+        except BaseException:
+            start_barrier.abort()
+            raise
+        finally:
+            for client in clients.values():
+                client.close()
+            with lock:
+                for name, values in local.items():
+                    latencies.setdefault(name, []).extend(values)
+                for name, n in local_errors.items():
+                    errors[name] = errors.get(name, 0) + n
+
+    per_thread = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread)]
+    for t in threads:
+        t.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        for t in threads:
+            t.join()
+        raise RuntimeError("Прогін перервано: потік клієнта завершився з помилкою")
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - started
+
+    endpoints = {}
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        endpoints[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "throughput": round(len(values) / seconds, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    overall = sorted(v for values in latencies.values() for v in values)
+    return {
+        "requests": len(overall),
+        "errors": sum(errors.values()),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(overall) / seconds, 2),
+        "p50_ms": round(percentile(overall, 50) * 1000, 3),
+        "p95_ms": round(percentile(overall, 95) * 1000, 3),
+        "p99_ms": round(percentile(overall, 99) * 1000, 3),
+        "endpoints": endpoints,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Регресії відносно baseline.
+
+    Хвости окремого маршруту на кількох сотнях запитів надто шумні, тож
+    перевіряються пропускна здатність і p95 режиму загалом та p50 кожного
+    маршруту; p95/p99 маршрутів лишаються у звіті для порівняння вручну.
+    """
+    regressions = []
+
+    def check(mode, endpoint, metric, old, value, higher_is_worse=True):
+        limit = old * (1 + tolerance) if higher_is_worse else old * (1 - tolerance)
+        if (value > limit) if higher_is_worse else (value < limit):
+            regressions.append({"mode": mode, "endpoint": endpoint, "metric": metric,
+                                "baseline": old, "value": value})
+
+    for mode, report in results.items():
+        base = baseline.get("results", {}).get(mode)
+        if base is None:
+            continue
+        check(mode, "*", "throughput", base["throughput"], report["throughput"], False)
+        check(mode, "*", "p95_ms", base["p95_ms"], report["p95_ms"])
+        for name, current in report["endpoints"].items():
+            if current["errors"]:
+                regressions.append({"mode": mode, "endpoint": name, "metric": "errors",
+                                    "baseline": 0, "value": current["errors"]})
+            old = base["endpoints"].get(name)
+            if old is not None:
+                check(mode, name, "p50_ms", old["p50_ms"], current["p50_ms"])
+    return regressions
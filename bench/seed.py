@@ -0,0 +1,91 @@
+"""Тимчасова база з перекошеними обсягами даних.
+
+Частка i-го користувача — 1 / (i + 1) ** skew, тож за skew=1 перший
+користувач має приблизно стільки ж місій, скільки десятеро наступних.
+Схему створюють міграції під час імпорту застосунку; тут лише дані.
+"""
+import random
+import sqlite3
+from datetime import date, datetime, timedelta
+
+# Слова для текстів: пошук у суміші запитів шукає ці ж слова
+WORDS = ("місія", "сувій", "чакра", "тренування", "розвідка",
+         "клан", "техніка", "печатка", "кунай", "рамен")
+
+RANKS = ("D", "C", "B", "A", "S")
+
+
+def user_weights(users, skew):
+    weights = [1 / (i + 1) ** skew for i in range(users)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def split(total, weights):
+    """Ціле total, розкладене за вагами; сума частин дорівнює total."""
+    parts = [int(total * w) for w in weights]
+    for i in range(total - sum(parts)):
+        parts[i % len(parts)] += 1
+    return parts
+
+
+def text(rng, words=3):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(path, users=50, todos=5000, subtasks=10000, skew=1.0, seed=42):
+    """Засіває базу path; повертає {user_id: code}."""
+    rng = random.Random(seed)
+    weights = user_weights(users, skew)
+    today = date.today()
+    now = datetime.now()
+
+    db = sqlite3.connect(path)
+
+    codes = {}
+    for i in range(users):
+        code = f"BENCH{i:04d}"
+        user_id = db.execute(
+            "INSERT INTO users (code, name, created_at) VALUES (?, ?, ?) RETURNING id",
+            (code, f"Ніндзя {i}", now.isoformat()),
+        ).fetchone()[0]
+        codes[user_id] = code
+
+    user_ids = list(codes)
+    for user_id, count in zip(user_ids, split(todos, weights)):
+        rows = []
+        for n in range(count):
+            done = rng.random() < 0.4
+            deadline = None
+            if rng.random() < 0.3:
+                deadline = (today + timedelta(days=rng.randint(-30, 30))).isoformat()
+            created = now - timedelta(minutes=count - n)
+            rows.append((user_id, text(rng), int(done), rng.choice(RANKS), deadline,
+                         created.isoformat(), created.isoformat() if done else None,
+                         -1024.0 * n))
+        db.executemany("""
+            INSERT INTO todos (user_id, text, done, rank, deadline, created_at, done_at, position)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+    todo_ids = [row[0] for row in db.execute("SELECT id FROM todos")]
+    if todo_ids:
+        # Підзадачі розподіляються пропорційно місіям, тож теж перекошено
+        rows = [(rng.choice(todo_ids), text(rng, 2), int(rng.random() < 0.5), now.isoformat())
+                for _ in range(subtasks)]
+        db.executemany(
+            "INSERT INTO subtasks (todo_id, text, done, created_at) VALUES (?, ?, ?, ?)", rows)
+
+    db.commit()
+    db.close()
+    return codes
+
+
+def copy(src, dst):
+    """Узгоджена копія бази через backup API (WAL теж враховується)."""
+    source = sqlite3.connect(src)
+    target = sqlite3.connect(dst)
+    with target:
+        source.backup(target)
+    target.close()
+    source.close()
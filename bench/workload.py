@@ -0,0 +1,111 @@
+"""Суміш запитів, близька до реальної роботи зі сторінкою.
+
+Користувач для кожного запиту вибирається з тими ж вагами, що й обсяги
+даних: «потужні» користувачі і даних мають більше, і звертаються частіше.
+"""
+import sqlite3
+from urllib.parse import quote
+
+from bench.seed import WORDS, user_weights
+
+# (назва, вага) — назва є ключем у звіті
+MIX = (
+    ("index", 10),
+    ("todos", 20),
+    ("todos_filter", 10),
+    ("todos_search", 10),
+    ("stats", 5),
+    ("add", 10),
+    ("toggle", 10),
+    ("reorder", 5),
+    ("subtasks", 10),
+    ("subtask_add", 5),
+    ("subtask_toggle", 5),
+)
+
+
+class Workload:
+    def __init__(self, path, user_ids, skew):
+        self.users = list(user_ids)
+        self.weights = user_weights(len(self.users), skew)
+        self.names = [name for name, _ in MIX]
+        self.mix_weights = [weight for _, weight in MIX]
+        self.todos = {user_id: [] for user_id in self.users}
+        self.subtasks = {user_id: [] for user_id in self.users}
+
+        db = sqlite3.connect(path)
+        for todo_id, user_id in db.execute("SELECT id, user_id FROM todos"):
+            self.todos[user_id].append(todo_id)
+        for sub_id, user_id in db.execute(
+                "SELECT s.id, t.user_id FROM subtasks s JOIN todos t ON t.id = s.todo_id"):
+            self.subtasks[user_id].append(sub_id)
+        db.close()
+
+    def next(self, rng):
+        """(назва, user_id, метод, url, json-тіло) наступного запиту."""
+        name = rng.choices(self.names, self.mix_weights)[0]
+        user_id = rng.choices(self.users, self.weights)[0]
+        request = getattr(self, "_" + name)(rng, user_id)
+        if request is None:  # у користувача немає потрібних рядків
+            name, request = "todos", self._todos(rng, user_id)
+        return (name, user_id, *request)
+
+    def observe(self, name, user_id, status, body):
+        """Нові id з відповідей, щоб наступні запити їх зачіпали."""
+        if status != 201 or not isinstance(body, dict):
+            return
+        if name == "add":
+            self.todos[user_id].append(body["id"])
+        elif name == "subtask_add":
+            self.subtasks[user_id].append(body["id"])
+
+    def _index(self, rng, user_id):
+        return "GET", "/", None
+
+    def _todos(self, rng, user_id):
+        return "GET", "/api/todos", None
+
+    def _todos_filter(self, rng, user_id):
+        return "GET", f"/api/todos?filter={rng.choice(('active', 'done'))}", None
+
+    def _todos_search(self, rng, user_id):
+        return "GET", "/api/todos?search=" + quote(rng.choice(WORDS)), None
+
+    def _stats(self, rng, user_id):
+        return "GET", "/api/stats", None
+
+    def _add(self, rng, user_id):
+        return "POST", "/api/add", {"text": f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+                                    "rank": rng.choice("DCBAS")}
+
+    def _toggle(self, rng, user_id):
+        ids = self.todos[user_id]
+        if not ids:
+            return None
+        return "POST", f"/api/toggle/{rng.choice(ids)}", None
+
+    def _reorder(self, rng, user_id):
+        ids = self.todos[user_id]
+        if len(ids) < 2:
+            return None
+        items = [{"id": todo_id, "position": rng.uniform(-1e6, 0)}
+                 for todo_id in rng.sample(ids, min(len(ids), rng.randint(2, 5)))]
+        return "POST", "/api/reorder", items
+
+    def _subtasks(self, rng, user_id):
+        ids = self.todos[user_id]
+        if not ids:
+            return None
+        return "GET", f"/api/subtasks/{rng.choice(ids)}", None
+
+    def _subtask_add(self, rng, user_id):
+        ids = self.todos[user_id]
+        if not ids:
+            return None
+        return "POST", f"/api/subtasks/{rng.choice(ids)}/add", {"text": rng.choice(WORDS)}
+
+    def _subtask_toggle(self, rng, user_id):
+        ids = self.subtasks[user_id]
+        if not ids:
+            return None
+        return "POST", f"/api/subtasks/toggle/{rng.choice(ids)}", None
@@ -0,0 +1,762 @@
+"""Доступ до даних: увесь SQL для users, todos і subtasks.
+
+Кожна функція першим аргументом приймає з'єднання SQLite і не комітить.
+Записи перевіряють власника в самій інструкції (WHERE ... AND user_id = ?,
+для підзадач — через todos) і повертають рядок через RETURNING, тож кожна
+мутація — одна інструкція. None означає «не знайдено або чуже».
+
+add_query_hook() дозволяє підписатися на тривалість кожного запиту.
+"""
+import re
+import time
+from datetime import datetime, date
+
+_query_hooks = []
+
+
+def add_query_hook(hook):
+    """hook(name, sql, params, seconds, db) викликається після кожного запиту модуля;
+    db — з'єднання, яким його виконано (у шардах — файл шарду).
+
+    Виклик іде в потоці, що виконував запит, тож контекст запиту (contextvars)
+    хуку доступний і тоді, коли запис виконує потік-письменник.
+    """
+    _query_hooks.append(hook)
+
+
+def remove_query_hook(hook):
+    _query_hooks.remove(hook)
+
+
+def _report(db, name, sql, params, start):
+    if _query_hooks:
+        elapsed = time.perf_counter() - start
+        for hook in _query_hooks:
+            hook(name, sql, params, elapsed, db)
+
+
+def _one(db, name, sql, params=()):
+    start = time.perf_counter()
+    row = db.execute(sql, params).fetchone()
+    _report(db, name, sql, params, start)
+    return row
+
+
+def _all(db, name, sql, params=()):
+    start = time.perf_counter()
+    rows = db.execute(sql, params).fetchall()
+    _report(db, name, sql, params, start)
+    return rows
+
+
+def _cursor(db, name, sql, params=()):
+    """Курсор для потокового читання; час рахується до першого рядка."""
+    start = time.perf_counter()
+    cur = db.execute(sql, params)
+    _report(db, name, sql, params, start)
+    return cur
+
+
+def _columns(db, name, sql, params=()):
+    """(назви колонок, рядки-кортежі) — без sqlite3.Row на кожен рядок."""
+    start = time.perf_counter()
+    cur = db.execute(sql, params)
+    cur.row_factory = None
+    rows = cur.fetchall()
+    _report(db, name, sql, params, start)
+    return [d[0] for d in cur.description], rows
+
+
+def _many(db, name, sql, seq):
+    start = time.perf_counter()
+    db.executemany(sql, seq)
+    _report(db, name, sql, None, start)
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+DEADLINE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y")
+
+
+def iso_date(value):
+    """Дата як YYYY-MM-DD; None, якщо value — не дата."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()[:10]  # і datetime-local, і ISO з часом
+    for fmt in DEADLINE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+# ─── Users ──────────────────────────────────────────────────────────
+def get_user(db, user_id):
+    return _one(db, "get_user", "SELECT * FROM users WHERE id = ?", (user_id,))
+
+
+def users_version(db):
+    """Лічильник змін таблиці users (тригери counters_users_*)."""
+    return _one(db, "users_version", "SELECT value FROM counters WHERE name = 'users'")[0]
+
+
+def get_user_by_code(db, code):
+    return _one(db, "get_user_by_code", "SELECT * FROM users WHERE code = ?", (code,))
+
+
+# Коди перевіряються пакетами: більше за ліміт змінних SQLite не буває
+CODE_BATCH = 500
+
+
+def existing_codes(db, codes):
+    """Які з codes уже зайняті — пакетами по CODE_BATCH через унікальний індекс."""
+    codes = list(codes)
+    taken = set()
+    for i in range(0, len(codes), CODE_BATCH):
+        batch = codes[i:i + CODE_BATCH]
+        taken.update(code for code, in _all(
+            db, "existing_codes",
+            "SELECT code FROM users WHERE code IN (%s)" % ",".join("?" * len(batch)), batch))
+    return taken
+
+
+def create_users(db, rows):
+    """Вставляє (code, name) одним executemany; коди мають бути вільні."""
+    created_at = _now()
+    _many(db, "create_users", "INSERT INTO users (code, name, created_at) VALUES (?, ?, ?)",
+          [(code, name, created_at) for code, name in rows])
+    return created_at
+
+
+def delete_user(db, user_id):
+    return _one(db, "delete_user", "DELETE FROM users WHERE id = ? RETURNING id", (user_id,))
+
+
+def delete_users(db, user_ids):
+    _many(db, "delete_users", "DELETE FROM users WHERE id = ?", [(i,) for i in user_ids])
+
+
+# Адмінка гортає користувачів від нових через idx_users_created
+USER_KEYS = [("created_at", "DESC"), ("id", "DESC")]
+
+
+def list_users_page(db, search, after, limit):
+    """До limit + 1 користувачів каталогу; search — префікс коду або частина імені."""
+    sql = "SELECT u.id, u.code, u.name, u.created_at, u.shard FROM users u WHERE 1"
+    params = []
+    keys = [("u." + col, direction) for col, direction in USER_KEYS]
+    if search:
+        # casefold() — з dbpool: LIKE сам по собі не зводить кирилицю до одного регістру
+        pattern = search.casefold().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        sql += " AND (u.code LIKE ? ESCAPE '\\' OR casefold(u.name) LIKE ? ESCAPE '\\')"
+        params += [pattern + "%", "%" + pattern + "%"]
+    if after is not None:
+        cond, cond_params = keyset_after(keys, after)
+        sql += " AND " + cond
+        params += cond_params
+    sql += order_by(keys) + " LIMIT ?"
+    params.append(limit + 1)
+    return _all(db, "list_users_page", sql, params)
+
+
+def count_users(db):
+    return _one(db, "count_users", "SELECT COUNT(*) FROM users")[0]
+
+
+def users_stats(db, user_ids):
+    """(user_id, total, done) для сторінки адмінки — з шарду цих користувачів."""
+    return _all(db, "users_stats",
+                "SELECT user_id, total, done FROM user_stats WHERE user_id IN (%s)"
+                % ",".join("?" * len(user_ids)), list(user_ids))
+
+
+def todo_totals(db):
+    """Місії всіх користувачів бази для шапки адмінки без обходу сторінок."""
+    return _one(db, "todo_totals", """
+        SELECT COALESCE(SUM(total), 0) as total_todos, COALESCE(SUM(done), 0) as done_todos
+        FROM user_stats
+    """)
+
+
+# ─── Stats ──────────────────────────────────────────────────────────
+def get_stats(db, user_id):
+    row = _one(db, "get_stats", "SELECT * FROM user_stats WHERE user_id = ?", (user_id,))
+    if row is None:
+        return {"total": 0, "done": 0, "pending": 0, "overdue": 0, "due_today": 0,
+                "subtasks_total": 0, "subtasks_done": 0}
+    today = date.today().isoformat()
+    overdue, due_today = row["overdue"], row["due_today"]
+    if row["overdue_day"] != today:
+        # Денний перерахунок ще не дійшов до користувача — рахуємо наживо
+        overdue, due_today = count_due(db, user_id, today)
+    return {
+        "total": row["total"],
+        "done": row["done"],
+        "pending": row["total"] - row["done"],
+        "overdue": overdue,
+        "due_today": due_today,
+        "subtasks_total": row["subtasks_total"],
+        "subtasks_done": row["subtasks_done"],
+    }
+
+
+def count_due(db, user_id, today):
+    """(прострочені, на сьогодні) серед активних — один прохід індексом дедлайнів."""
+    return tuple(_one(db, "count_due", """
+        SELECT COALESCE(SUM(deadline < ?1), 0), COALESCE(SUM(deadline = ?1), 0)
+        FROM todos WHERE user_id = ?2 AND done = 0 AND deadline <= ?1
+    """, (today, user_id)))
+
+
+def roll_over_stats(db, today, limit):
+    """Перераховує overdue/due_today на today для до limit користувачів,
+    у яких вони ще за попередній день; повертає кількість."""
+    return db.execute("""
+        UPDATE user_stats SET
+            overdue = (SELECT COUNT(*) FROM todos WHERE user_id = user_stats.user_id
+                       AND done = 0 AND deadline < ?1),
+            due_today = (SELECT COUNT(*) FROM todos WHERE user_id = user_stats.user_id
+                         AND done = 0 AND deadline = ?1),
+            overdue_day = ?1
+        WHERE user_id IN (SELECT user_id FROM user_stats WHERE overdue_day != ?1 LIMIT ?2)
+    """, (today, limit)).rowcount
+
+
+def get_version(db, user_id):
+    """Версія даних користувача; зростає з кожною зміною його місій і підзадач."""
+    row = _one(db, "get_version", "SELECT version FROM user_stats WHERE user_id = ?", (user_id,))
+    return row[0] if row else 0
+
+
+# ─── Listing & search ───────────────────────────────────────────────
+# Канонічний порядок списку. id наприкінці робить ключ унікальним,
+# тож курсор сторінки завжди однозначний.
+ORDER_KEYS = [("done", "ASC"), ("position", "ASC"), ("created_at", "DESC"), ("id", "DESC")]
+# Результати пошуку: спочатку активні, далі за релевантністю.
+SEARCH_KEYS = [("done", "ASC"), ("score", "ASC"), ("id", "DESC")]
+
+
+def order_by(keys):
+    return " ORDER BY " + ", ".join(f"{col} {direction}" for col, direction in keys)
+
+
+ORDER_SQL = order_by(ORDER_KEYS)
+
+# bm25() повертає від'ємні значення (менше — краще); збіг лише у підзадачі
+# важить удвічі менше, ніж збіг у тексті самої місії.
+SEARCH_SQL = """
+    WITH hits(todo_id, score, sub_id) AS (
+        SELECT rowid, bm25(todos_fts), NULL
+        FROM todos_fts WHERE todos_fts MATCH ?
+        UNION ALL
+        SELECT s.todo_id, bm25(subtasks_fts) * 0.5, s.id
+        FROM subtasks_fts JOIN subtasks s ON s.id = subtasks_fts.rowid
+        WHERE subtasks_fts MATCH ?
+    )
+    SELECT t.*, MIN(h.score) AS score, GROUP_CONCAT(h.sub_id) AS matched_subtasks
+    FROM hits h JOIN todos t ON t.id = h.todo_id
+    WHERE t.user_id = ? {done}
+    GROUP BY t.id
+"""
+
+
+def fts_query(search):
+    """Перетворює рядок пошуку на FTS5-запит: кожне слово — префікс, всі через AND."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", search))
+
+
+def keyset_after(keys, values):
+    """SQL-умова «рядок стоїть після values» для сортування keys."""
+    (col, direction), value = keys[0], values[0]
+    op = ">" if direction == "ASC" else "<"
+    if len(keys) == 1:
+        return f"{col} {op} ?", [value]
+    rest_sql, rest_params = keyset_after(keys[1:], values[1:])
+    return f"({col} {op} ? OR ({col} = ? AND {rest_sql}))", [value, value] + rest_params
+
+
+def query_todos(db, user_id, filter_by, search, after, limit):
+    """Сторінка місій: у канонічному порядку або, під час пошуку, за релевантністю.
+
+    Повертає курсор на до limit + 1 рядків — зайвий рядок лише означає,
+    що існує наступна сторінка.
+    """
+    done = ""
+    if filter_by == "active":
+        done = "done = 0"
+    elif filter_by == "done":
+        done = "done = 1"
+
+    if search:
+        keys = SEARCH_KEYS
+        q = fts_query(search)
+        if not q:
+            return []
+        sql = "SELECT * FROM (" + SEARCH_SQL.format(done=f"AND t.{done}" if done else "") + ") WHERE 1"
+        params = [q, q, user_id]
+    else:
+        keys = ORDER_KEYS
+        sql = "SELECT * FROM todos WHERE user_id = ?" + (f" AND {done}" if done else "")
+        params = [user_id]
+
+    if after is not None:
+        cond, cond_params = keyset_after(keys, after)
+        sql += " AND " + cond
+        params += cond_params
+    sql += order_by(keys) + " LIMIT ?"
+    params.append(limit + 1)
+    return _cursor(db, "search_todos" if search else "list_todos", sql, params)
+
+
+# ─── Deadlines ──────────────────────────────────────────────────────
+# Дедлайни — ISO-дати, тож діапазон [start, end] — це діапазон індексу
+# idx_todos_deadline(user_id, done, deadline), уже відсортований.
+DUE_KEYS = [("deadline", "ASC"), ("id", "ASC")]
+
+
+def due_todos(db, user_id, done, start, end, after, limit):
+    """До limit + 1 місій з done і дедлайном у [start, end] за (deadline, id)."""
+    sql = "SELECT * FROM todos WHERE user_id = ? AND done = ? AND deadline BETWEEN ? AND ?"
+    params = [user_id, done, start, end]
+    if after is not None:
+        cond, cond_params = keyset_after(DUE_KEYS, after)
+        sql += " AND " + cond
+        params += cond_params
+    sql += order_by(DUE_KEYS) + " LIMIT ?"
+    params.append(limit + 1)
+    return _all(db, "due_todos", sql, params)
+
+
+def due_counts(db, user_id, done, start, end):
+    """{дата: кількість} місій з done і дедлайном у [start, end]."""
+    return dict(_all(db, "due_counts", """
+        SELECT deadline, COUNT(*) FROM todos
+        WHERE user_id = ? AND done = ? AND deadline BETWEEN ? AND ?
+        GROUP BY deadline
+    """, (user_id, done, start, end)))
+
+
+# ─── Todos ──────────────────────────────────────────────────────────
+# Колонки без version: його ставлять AFTER-тригери вже після RETURNING,
+# тож у повернутому рядку він був би застарілим. Версії дає /api/sync.
+TODO_COLUMNS = "id, user_id, text, done, rank, deadline, created_at, done_at, position"
+SUBTASK_COLUMNS = "id, todo_id, text, done, created_at"
+
+
+def insert_todo(db, user_id, text, rank, deadline, gap):
+    """Нова місія стає на gap вище за верхню активну."""
+    return _one(db, "insert_todo", f"""
+        INSERT INTO todos (user_id, text, rank, deadline, created_at, position)
+        VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MIN(position), 0) - ? FROM todos
+                                WHERE user_id = ? AND done = 0))
+        RETURNING {TODO_COLUMNS}
+    """, (user_id, text, rank, deadline, _now(), gap, user_id))
+
+
+def toggle_todo(db, user_id, todo_id):
+    # У SET праворуч видно старе значення done
+    return _one(db, "toggle_todo", f"""
+        UPDATE todos SET done = 1 - done, done_at = CASE WHEN done = 0 THEN ? END
+        WHERE id = ? AND user_id = ?
+        RETURNING {TODO_COLUMNS}
+    """, (_now(), todo_id, user_id))
+
+
+def update_todo(db, user_id, todo_id, text, rank, deadline, keep_deadline):
+    """rank=None залишає ранг, keep_deadline=True — дедлайн."""
+    return _one(db, "update_todo", f"""
+        UPDATE todos SET
+            text = ?,
+            rank = COALESCE(?, rank),
+            deadline = CASE WHEN ? THEN deadline ELSE ? END
+        WHERE id = ? AND user_id = ?
+        RETURNING {TODO_COLUMNS}
+    """, (text, rank, keep_deadline, deadline, todo_id, user_id))
+
+
+def delete_todo(db, user_id, todo_id):
+    return _one(
+        db, "delete_todo",
+        f"DELETE FROM todos WHERE id = ? AND user_id = ? RETURNING {TODO_COLUMNS}",
+        (todo_id, user_id)
+    )
+
+
+def set_position(db, user_id, todo_id, position):
+    return _one(
+        db, "set_position",
+        "UPDATE todos SET position = ? WHERE id = ? AND user_id = ? RETURNING id",
+        (position, todo_id, user_id)
+    )
+
+
+def get_positions(db, user_id, ids=None):
+    """{id: position} для всіх місій користувача або лише для ids."""
+    if ids is None:
+        return dict(_all(db, "get_positions",
+                         "SELECT id, position FROM todos WHERE user_id = ?", (user_id,)))
+    if not ids:
+        return {}
+    return dict(_all(
+        db, "get_positions",
+        "SELECT id, position FROM todos WHERE user_id = ? AND id IN (%s)" % ",".join("?" * len(ids)),
+        [user_id, *ids]
+    ))
+
+
+def todo_places(db, user_id, ids):
+    """{id: (done, position)} для ids користувача — список і місце в ньому."""
+    if not ids:
+        return {}
+    return {row[0]: (row[1], row[2]) for row in _all(
+        db, "todo_places",
+        "SELECT id, done, position FROM todos WHERE user_id = ? AND id IN (%s)" % ",".join("?" * len(ids)),
+        [user_id, *ids]
+    )}
+
+
+def update_positions(db, user_id, positions):
+    """positions — список (position, id)."""
+    _many(db, "update_positions",
+          "UPDATE todos SET position = ? WHERE id = ? AND user_id = ?",
+          [(position, todo_id, user_id) for position, todo_id in positions])
+
+
+def ordered_todo_ids(db, user_id):
+    return [r[0] for r in _all(db, "ordered_todo_ids",
+                               "SELECT id FROM todos WHERE user_id = ?" + ORDER_SQL, (user_id,))]
+
+
+# ─── Sync ───────────────────────────────────────────────────────────
+def todos_since(db, user_id, version):
+    return _all(db, "todos_since",
+                "SELECT * FROM todos WHERE user_id = ? AND version > ?", (user_id, version))
+
+
+def subtasks_since(db, user_id, version):
+    return _all(db, "subtasks_since", """
+        SELECT s.* FROM todos t JOIN subtasks s ON s.todo_id = t.id
+        WHERE t.user_id = ? AND s.version > ?
+        ORDER BY s.created_at ASC
+    """, (user_id, version))
+
+
+def tombstones_since(db, user_id, version):
+    return _all(db, "tombstones_since",
+                "SELECT kind, row_id FROM tombstones WHERE user_id = ? AND version > ?",
+                (user_id, version))
+
+
+# ─── Change feed ────────────────────────────────────────────────────
+def last_change_seq(db):
+    return _one(db, "last_change_seq", "SELECT COALESCE(MAX(seq), 0) FROM changes")[0]
+
+
+def first_change_seq(db):
+    return _one(db, "first_change_seq", "SELECT MIN(seq) FROM changes")[0]
+
+
+def changes_since(db, seq, limit):
+    return _all(db, "changes_since",
+                "SELECT * FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit))
+
+
+def user_changes_since(db, user_id, seq):
+    return _all(db, "user_changes_since",
+                "SELECT * FROM changes WHERE user_id = ? AND seq > ? ORDER BY seq", (user_id, seq))
+
+
+def todos_by_ids(db, user_id, ids):
+    if not ids:
+        return []
+    return _all(
+        db, "todos_by_ids",
+        "SELECT * FROM todos WHERE user_id = ? AND id IN (%s)" % ",".join("?" * len(ids)),
+        [user_id, *ids]
+    )
+
+
+def subtasks_by_ids(db, user_id, ids):
+    if not ids:
+        return []
+    return _all(db, "subtasks_by_ids", """
+        SELECT s.* FROM subtasks s JOIN todos t ON t.id = s.todo_id
+        WHERE t.user_id = ? AND s.id IN (%s)
+    """ % ",".join("?" * len(ids)), [user_id, *ids])
+
+
+# ─── Idempotency ────────────────────────────────────────────────────
+def get_idempotent_response(db, user_id, key):
+    row = _one(db, "get_idempotent_response",
+               "SELECT response FROM idempotency_keys WHERE user_id = ? AND key = ?",
+               (user_id, key))
+    return row[0] if row else None
+
+
+def save_idempotent_response(db, user_id, key, response):
+    _one(db, "save_idempotent_response",
+         "INSERT INTO idempotency_keys (user_id, key, response, created_at) VALUES (?, ?, ?, ?)",
+         (user_id, key, response, _now()))
+
+
+def prune_idempotency_keys(db, user_id, before):
+    _one(db, "prune_idempotency_keys",
+         "DELETE FROM idempotency_keys WHERE user_id = ? AND created_at < ?",
+         (user_id, before))
+
+
+# ─── Archive ────────────────────────────────────────────────────────
+# Архів показується від нещодавно виконаних
+ARCHIVE_KEYS = [("done_at", "DESC"), ("id", "DESC")]
+
+
+def archivable_todo_ids(db, before, limit):
+    return [r[0] for r in _all(
+        db, "archivable_todo_ids",
+        "SELECT id FROM todos WHERE done = 1 AND done_at < ? ORDER BY done_at LIMIT ?",
+        (before, limit))]
+
+
+def archive_todos(db, ids, archived_at):
+    """Переносить місії ids разом із підзадачами в архів."""
+    marks = ",".join("?" * len(ids))
+    _one(db, "archive_todos", f"""
+        INSERT INTO archived_todos ({TODO_COLUMNS}, archived_at)
+        SELECT {TODO_COLUMNS}, ? FROM todos WHERE id IN ({marks})
+    """, (archived_at, *ids))
+    _one(db, "archive_subtasks", f"""
+        INSERT INTO archived_subtasks ({SUBTASK_COLUMNS})
+        SELECT {SUBTASK_COLUMNS} FROM subtasks WHERE todo_id IN ({marks})
+    """, ids)
+    _one(db, "archive_delete", f"DELETE FROM todos WHERE id IN ({marks})", ids)
+
+
+def list_archive(db, user_id, after, limit):
+    """До limit + 1 архівних місій користувача після курсора after."""
+    sql = "SELECT * FROM archived_todos WHERE user_id = ?"
+    params = [user_id]
+    if after is not None:
+        cond, cond_params = keyset_after(ARCHIVE_KEYS, after)
+        sql += " AND " + cond
+        params += cond_params
+    sql += order_by(ARCHIVE_KEYS) + " LIMIT ?"
+    params.append(limit + 1)
+    return _all(db, "list_archive", sql, params)
+
+
+def archived_subtasks(db, todo_ids):
+    if not todo_ids:
+        return []
+    return _all(db, "archived_subtasks",
+                "SELECT * FROM archived_subtasks WHERE todo_id IN (%s) ORDER BY todo_id, created_at"
+                % ",".join("?" * len(todo_ids)), todo_ids)
+
+
+def restore_todo(db, user_id, todo_id):
+    """Повертає архівну місію з підзадачами в todos; None, якщо її немає."""
+    row = _one(db, "restore_todo", f"""
+        INSERT INTO todos ({TODO_COLUMNS})
+        SELECT {TODO_COLUMNS} FROM archived_todos WHERE id = ? AND user_id = ?
+        RETURNING {TODO_COLUMNS}
+    """, (todo_id, user_id))
+    if row is None:
+        return None
+    _one(db, "restore_subtasks", f"""
+        INSERT INTO subtasks ({SUBTASK_COLUMNS})
+        SELECT {SUBTASK_COLUMNS} FROM archived_subtasks WHERE todo_id = ?
+    """, (todo_id,))
+    _one(db, "restore_delete", "DELETE FROM archived_todos WHERE id = ?", (todo_id,))
+    return row
+
+
+# ─── Subtasks ───────────────────────────────────────────────────────
+LIST_SUBTASKS_SQL = """
+    SELECT s.* FROM todos t LEFT JOIN subtasks s ON s.todo_id = t.id
+    WHERE t.id = ? AND t.user_id = ?
+    ORDER BY s.created_at ASC
+"""
+
+
+def list_subtasks(db, user_id, todo_id):
+    """None, якщо місія чужа або її немає; інакше список підзадач."""
+    rows = _all(db, "list_subtasks", LIST_SUBTASKS_SQL, (todo_id, user_id))
+    if not rows:
+        return None
+    return [r for r in rows if r["id"] is not None]
+
+
+def list_subtasks_columns(db, user_id, todo_id):
+    """Як list_subtasks, але (колонки, кортежі) для колонкового формату."""
+    columns, rows = _columns(db, "list_subtasks", LIST_SUBTASKS_SQL, (todo_id, user_id))
+    if not rows:
+        return None
+    return columns, [r for r in rows if r[0] is not None]
+
+
+def insert_subtask(db, user_id, todo_id, text):
+    return _one(db, "insert_subtask", f"""
+        INSERT INTO subtasks (todo_id, text, done, created_at)
+        SELECT id, ?, 0, ? FROM todos WHERE id = ? AND user_id = ?
+        RETURNING {SUBTASK_COLUMNS}
+    """, (text, _now(), todo_id, user_id))
+
+
+def toggle_subtask(db, user_id, sub_id):
+    return _one(db, "toggle_subtask", f"""
+        UPDATE subtasks SET done = 1 - done
+        WHERE id = ? AND todo_id IN (SELECT id FROM todos WHERE user_id = ?)
+        RETURNING {SUBTASK_COLUMNS}
+    """, (sub_id, user_id))
+
+
+def delete_subtask(db, user_id, sub_id):
+    return _one(db, "delete_subtask", """
+        DELETE FROM subtasks
+        WHERE id = ? AND todo_id IN (SELECT id FROM todos WHERE user_id = ?)
+        RETURNING id
+    """, (sub_id, user_id))
+
+
+# ─── Export / import ────────────────────────────────────────────────
+# Експорт читає місії разом із підзадачами одним курсором: рядок на
+# підзадачу (або на місію без них), місії — в порядку індексу, тож
+# рядки однієї місії йдуть поспіль і сортувати нічого не треба.
+EXPORT_SQL = """
+    SELECT t.id, t.text, t.done, t.rank, t.deadline, t.created_at, t.done_at, t.position,
+           {archived_at} as archived_at,
+           s.id as sub_id, s.text as sub_text, s.done as sub_done, s.created_at as sub_created_at
+    FROM {todos} t LEFT JOIN {subtasks} s ON s.todo_id = t.id
+    WHERE t.user_id = ?
+"""
+
+
+def export_users(db, shard=None):
+    """Користувачі бази; shard — лише ті, чиї дані лежать у шарді з цим іменем."""
+    sql = "SELECT id, code, name, is_admin, created_at FROM users"
+    if shard is None:
+        return _cursor(db, "export_users", sql + " ORDER BY id")
+    return _cursor(db, "export_users_shard", sql + " WHERE shard = ? ORDER BY id", (shard,))
+
+
+def export_todos(db, user_id):
+    sql = EXPORT_SQL.format(archived_at="NULL", todos="todos", subtasks="subtasks")
+    keys = [("t." + col, direction) for col, direction in ORDER_KEYS] + [("s.created_at", "ASC")]
+    return _cursor(db, "export_todos", sql + order_by(keys), (user_id,))
+
+
+def export_archive(db, user_id):
+    sql = EXPORT_SQL.format(archived_at="t.archived_at", todos="archived_todos",
+                            subtasks="archived_subtasks")
+    keys = [("t." + col, direction) for col, direction in ARCHIVE_KEYS] + [("s.created_at", "ASC")]
+    return _cursor(db, "export_archive", sql + order_by(keys), (user_id,))
+
+
+def import_user(db, code, name, is_admin, created_at):
+    """id користувача з кодом code; якщо такого немає — створює."""
+    _one(db, "import_user", """
+        INSERT INTO users (code, name, is_admin, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (code) DO NOTHING
+    """, (code, name, is_admin, created_at))
+    return _one(db, "import_user_id", "SELECT id FROM users WHERE code = ?", (code,))[0]
+
+
+def allocate_ids(db, table, archive_table, count):
+    """Перший із count поспіль вільних id спільного простору table і archive_table.
+
+    Лічильник AUTOINCREMENT зсувається за них одразу, тож ні нові рядки,
+    ні архів уже не отримають ці id.
+    """
+    start = _one(db, "allocate_ids", f"""
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),
+                   COALESCE((SELECT MAX(id) FROM {table}), 0),
+                   COALESCE((SELECT MAX(id) FROM {archive_table}), 0)) + 1
+    """, (table,))[0]
+    if count:
+        last = start + count - 1
+        if not db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (last, table)).rowcount:
+            db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, last))
+    return start
+
+
+IMPORT_COLUMNS = {
+    "todos": ("id", "user_id", "text", "done", "rank", "deadline", "created_at", "done_at", "position"),
+    "archived_todos": ("id", "user_id", "text", "done", "rank", "deadline", "created_at", "done_at",
+                       "position", "archived_at"),
+    "subtasks": ("id", "todo_id", "text", "done", "created_at"),
+    "archived_subtasks": ("id", "todo_id", "text", "done", "created_at"),
+}
+
+
+def import_rows(db, table, rows):
+    """Рядки в порядку IMPORT_COLUMNS[table] одним executemany."""
+    columns = IMPORT_COLUMNS[table]
+    _many(db, "import_" + table, "INSERT INTO %s (%s) VALUES (%s)" % (
+        table, ", ".join(columns), ", ".join("?" * len(columns))), rows)
+
+
+# ─── Shards ─────────────────────────────────────────────────────────
+# Каталог знає шард кожного користувача (users.shard); у файлі шарду
+# лежить копія рядка users з тим самим id, на яку посилаються місії.
+USER_STUB_COLUMNS = ("id", "code", "name", "is_admin", "created_at", "shard")
+
+
+def users_by_codes(db, codes):
+    """Рядки users за кодами — пакетами по CODE_BATCH, як existing_codes()."""
+    codes = list(codes)
+    rows = []
+    for i in range(0, len(codes), CODE_BATCH):
+        batch = codes[i:i + CODE_BATCH]
+        rows += _all(db, "users_by_codes",
+                     "SELECT * FROM users WHERE code IN (%s)" % ",".join("?" * len(batch)), batch)
+    return rows
+
+
+def user_shards(db):
+    """{id: шард} усіх користувачів каталогу."""
+    return dict(_all(db, "user_shards", "SELECT id, shard FROM users"))
+
+
+def user_shard(db, user_id):
+    """Шард користувача за рядком users цього файлу; None — рядка тут немає."""
+    row = _one(db, "user_shard", "SELECT shard FROM users WHERE id = ?", (user_id,))
+    return None if row is None else row[0]
+
+
+def set_user_shards(db, pairs):
+    """pairs — (шард, user_id)."""
+    _many(db, "set_user_shards", "UPDATE users SET shard = ? WHERE id = ?", pairs)
+
+
+def insert_user_stubs(db, users):
+    """Копії рядків каталогу в шарді; тригер user_stats_user_ai заводить їм статистику."""
+    _many(db, "insert_user_stubs", "INSERT INTO users (%s) VALUES (%s)" % (
+        ", ".join(USER_STUB_COLUMNS), ", ".join("?" * len(USER_STUB_COLUMNS))),
+        [tuple(u[c] for c in USER_STUB_COLUMNS) for u in users])
+
+
+def purge_user_data(db, user_id):
+    """Місії, архів і ключі ідемпотентності користувача — без самого рядка users.
+
+    Для каталогу, з якого дані переїхали в шард: рядок users там справжній.
+    """
+    for table in ("todos", "archived_todos", "idempotency_keys"):
+        db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+def continue_version(db, user_id, version):
+    """Версія користувача в новому шарді продовжує стару: клієнти з since
+    зі старого шарду отримають перенесені рядки як нові."""
+    db.execute("UPDATE user_stats SET version = MAX(version, ?) WHERE user_id = ?",
+               (version, user_id))
+
+
+def add_tombstones(db, user_id, kind, row_ids):
+    """Видалення row_ids однією новою версією — для id, що змінились при переносі."""
+    db.execute("UPDATE user_stats SET version = version + 1 WHERE user_id = ?", (user_id,))
+    _many(db, "add_tombstones", """
+        INSERT INTO tombstones (user_id, kind, row_id, version)
+        SELECT user_id, ?, ?, version FROM user_stats WHERE user_id = ?
+    """, [(kind, row_id, user_id) for row_id in row_ids])
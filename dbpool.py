@@ -0,0 +1,134 @@
+"""Пул SQLite-з'єднань на процес gunicorn-воркера.
+
+З'єднання відкриваються ліниво, PRAGMA налаштовуються один раз на
+з'єднання, а кеш сторінок і скомпільованих запитів живе між запитами.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+# Налаштування, що діють у межах одного з'єднання.
+# journal_mode=WAL зберігається у файлі бази, його ставить migrations.migrate().
+PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA cache_size=-8000",        # 8 МБ кешу сторінок
+    "PRAGMA mmap_size=67108864",      # 64 МБ
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# Кожен коміт з'єднання для запису — fsync WAL (FULL): письменник комітить
+# пакетом, тож запис, про який запит уже отримав відповідь, переживе й
+# вимкнення живлення, а fsync ділиться на весь пакет. NORMAL втратив би
+# останні коміти до чекпойнта; для читань він нічого не змінює.
+WRITE_SYNCHRONOUS = "PRAGMA synchronous=FULL"
+READ_SYNCHRONOUS = "PRAGMA synchronous=NORMAL"
+
+
+def casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+# Функції SQL для запитів dal: вбудовані lower() і LIKE знають регістр лише ASCII
+FUNCTIONS = (
+    ("casefold", 1, casefold),
+)
+
+# Запитів у застосунку кілька десятків (разом із варіантами keyset-умов),
+# тож 128 вистачає, щоб жоден не компілювався повторно.
+CACHED_STATEMENTS = 128
+
+
+class ConnectionPool:
+    """Потокобезпечний пул щонайбільше size з'єднань до однієї бази."""
+
+    def __init__(self, database, size, readonly=False, timeout=30.0,
+                 row_factory=sqlite3.Row, on_connect=None):
+        """on_connect(conn) викликається для кожного нового з'єднання."""
+        self.database = database
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+        self.row_factory = row_factory
+        self.on_connect = on_connect
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._opened = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(
+                f"file:{self.database}?mode=ro", uri=True,
+                check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+            )
+        else:
+            conn = sqlite3.connect(
+                self.database,
+                check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+            )
+        conn.row_factory = self.row_factory
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(READ_SYNCHRONOUS if self.readonly else WRITE_SYNCHRONOUS)
+        for name, nargs, fn in FUNCTIONS:
+            conn.create_function(name, nargs, fn, deterministic=True)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def acquire(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                # Після fork з'єднання батьківського процесу використовувати не можна
+                self._reset()
+            if not self._idle and self._opened >= self.size:
+                self.waits += 1
+                start = time.perf_counter()
+                deadline = start + self.timeout
+                while not self._idle and self._opened >= self.size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError("connection pool exhausted")
+                    self._cond.wait(remaining)
+                self.wait_time += time.perf_counter() - start
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self._opened += 1
+            self.misses += 1
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_time, 6),
+            }
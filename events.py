@@ -0,0 +1,141 @@
+"""Потік змін для SSE: один опитувач на воркер.
+
+Тригери записують кожну зміну місій і підзадач у таблицю changes з
+глобальним seq. Опитувач тримає власне read-only з'єднання і раз на
+interval читає PRAGMA data_version — це не торкається таблиць. Лише
+після чужого коміту він вибирає нові рядки changes, тож зміни з будь-якого
+воркера доходять до всіх підписників цього воркера.
+
+Поки підписників немає, потік спить на Event і базу не опитує.
+"""
+import os
+import queue
+import threading
+import time
+
+import dal
+
+# Скільки рядків changes опитувач читає за один такт
+CHANGES_PAGE = 1000
+
+
+class EventHub:
+    def __init__(self, pool, render, interval=0.25, max_streams=4):
+        """render(db, user_id, changes) -> [(seq, event, data)] для одного користувача."""
+        self.pool = pool
+        self.render = render
+        self.interval = interval
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._subs = {}
+        self._last_seq = None
+        self.polls = 0
+        self.dispatched = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._subs = {}
+        self._last_seq = None
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, name="sse-hub", daemon=True).start()
+        self._pid = os.getpid()
+
+    def subscribe(self, user_id, db, q=None):
+        """Черга подій користувача або None, якщо ліміт потоків вичерпано.
+
+        db — будь-яке з'єднання запиту: ним фіксується seq, з якого
+        опитувач почне, якщо досі спав. q — власна черга з методом put(),
+        що викликається з потоку опитувача (типово queue.SimpleQueue).
+        """
+        with self._lock:
+            self._ensure_started()
+            if sum(len(s) for s in self._subs.values()) >= self.max_streams:
+                return None
+            if self._last_seq is None:
+                self._last_seq = dal.last_change_seq(db)
+            if q is None:
+                q = queue.SimpleQueue()
+            self._subs.setdefault(user_id, set()).add(q)
+        self._wake.set()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            subs = self._subs.get(user_id)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[user_id]
+
+    def _run(self):
+        db = None
+        data_version = None
+        while True:
+            with self._lock:
+                idle = not self._subs
+                if idle:
+                    # Без підписників позицію не тримаємо: наступний subscribe() задасть нову
+                    self._last_seq = None
+                    self._wake.clear()
+            if idle:
+                if db is not None:
+                    self.pool.release(db)
+                    db = None
+                self._wake.wait()
+                continue
+            try:
+                if db is None:
+                    db = self.pool.acquire()
+                    data_version = None
+                version = db.execute("PRAGMA data_version").fetchone()[0]
+                if version != data_version:
+                    data_version = version
+                    if self._poll(db):
+                        data_version = None  # вибрали не все — дочитаємо в наступному такті
+            except Exception:
+                # База тимчасово недоступна — спробуємо з наступним тактом
+                data_version = None
+            # _wake лише виводить зі сну без підписників; такт — звичайна пауза,
+            # інакше встановлена подія перетворила б опитування на гарячий цикл
+            time.sleep(self.interval)
+
+    def _poll(self, db):
+        """Розсилає нові зміни; True, якщо в changes лишилися непрочитані."""
+        self.polls += 1
+        with self._lock:
+            after = self._last_seq
+            users = set(self._subs)
+        if after is None:
+            return False
+        changes = dal.changes_since(db, after, CHANGES_PAGE)
+        if not changes:
+            return False
+        by_user = {}
+        for change in changes:
+            if change["user_id"] in users:
+                by_user.setdefault(change["user_id"], []).append(change)
+        for user_id, user_changes in by_user.items():
+            events = self.render(db, user_id, user_changes)
+            with self._lock:
+                targets = list(self._subs.get(user_id, ()))
+            for q in targets:
+                q.put(events)
+            self.dispatched += len(events) * len(targets)
+        with self._lock:
+            if self._last_seq is not None:
+                self._last_seq = max(self._last_seq, changes[-1]["seq"])
+        return len(changes) == CHANGES_PAGE
+
+    def stats(self):
+        with self._lock:
+            return {
+                "streams": sum(len(s) for s in self._subs.values()),
+                "users": len(self._subs),
+                "max_streams": self.max_streams,
+                "last_seq": self._last_seq,
+                "polls": self.polls,
+                "dispatched": self.dispatched,
+            }
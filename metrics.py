@@ -0,0 +1,324 @@
+"""Метрики запитів: затримка маршрутів, SQL і очікування блокувань.
+
+Поки триває запит, його лічильники лежать у ContextVar. Хук
+dal.add_query_hook (кількість і час запитів), колбеки SQLite і on_commit
+черги записів додають до них у тому потоці, що виконує SQL, — зокрема в
+потоці письменника, бо WriteQueue запускає записи в контексті запиту.
+Після відповіді лічильники зливаються в агрегати за маршрутом.
+
+progress-колбек (кожні PROGRESS_STEPS кроків VM) стоїть на всіх
+з'єднаннях, trace — лише на з'єднаннях запису: він спрацьовує і на
+кожну внутрішню інструкцію FTS5 та програму тригера, і на читаннях
+із пошуком це сотні викликів Python на запит.
+
+Агрегати живуть у воркері, як і /admin/pool: scrape бачить той воркер,
+який його обслужив.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50)
+PROGRESS_STEPS = 1000
+
+log = logging.getLogger(__name__)
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Лічильники одного запиту."""
+
+    __slots__ = ("started", "queries", "statements", "vm_steps", "sql_seconds",
+                 "template_seconds", "lock_seconds", "commit_seconds", "render_started")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.statements = 0
+        self.vm_steps = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.lock_seconds = 0.0
+        self.commit_seconds = 0.0
+        self.render_started = None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # останній — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            yield bound, total
+
+    def quantile(self, q):
+        """Верхня межа кошика, в який потрапляє квантиль q."""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.statuses = {}
+        self.statements = 0
+        self.vm_steps = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.lock_seconds = 0.0
+        self.commit_seconds = 0.0
+
+    def add(self, m, elapsed, status):
+        self.latency.observe(elapsed)
+        self.queries.observe(m.queries)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.statements += m.statements
+        self.vm_steps += m.vm_steps
+        self.sql_seconds += m.sql_seconds
+        self.template_seconds += m.template_seconds
+        self.lock_seconds += m.lock_seconds
+        self.commit_seconds += m.commit_seconds
+
+
+class Metrics:
+    def __init__(self, database, slow_query_ms=None):
+        """slow_query_ms — поріг журналу повільних запитів; None вимикає журнал."""
+        self.database = database
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms is not None else None
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    # ─── Життєвий цикл запиту ───
+    def start(self):
+        return _current.set(RequestMetrics())
+
+    def finish(self, token, route, method, status):
+        m = _current.get()
+        _current.reset(token)
+        elapsed = time.perf_counter() - m.started
+        with self._lock:
+            stats = self._routes.get((route, method))
+            if stats is None:
+                stats = self._routes[(route, method)] = RouteStats()
+            stats.add(m, elapsed, status)
+
+    # ─── Колбеки ───
+    def instrument(self, conn):
+        """on_connect для пулу читань: лічильник кроків VM."""
+        conn.set_progress_handler(self._progress, PROGRESS_STEPS)
+
+    def instrument_writes(self, conn):
+        """on_connect для пулу запису: ще й кожна інструкція SQLite."""
+        conn.set_progress_handler(self._progress, PROGRESS_STEPS)
+        conn.set_trace_callback(self._trace)
+
+    @staticmethod
+    def _trace(sql):
+        m = _current.get()
+        if m is not None:
+            m.statements += 1
+
+    @staticmethod
+    def _progress():
+        m = _current.get()
+        if m is not None:
+            m.vm_steps += PROGRESS_STEPS
+        return 0
+
+    def on_query(self, name, sql, params, seconds, db=None):
+        m = _current.get()
+        if m is not None:
+            m.queries += 1
+            m.sql_seconds += seconds
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self._log_slow(name, sql, params, seconds, db)
+
+    @staticmethod
+    def on_commit(lock_seconds, commit_seconds):
+        m = _current.get()
+        if m is not None:
+            m.lock_seconds += lock_seconds
+            m.commit_seconds += commit_seconds
+
+    @staticmethod
+    def template_started(sender, **extra):
+        m = _current.get()
+        if m is not None:
+            m.render_started = time.perf_counter()
+
+    @staticmethod
+    def template_rendered(sender, **extra):
+        m = _current.get()
+        if m is not None and m.render_started is not None:
+            m.template_seconds += time.perf_counter() - m.render_started
+            m.render_started = None
+
+    @contextmanager
+    def rendering(self):
+        """Рендеринг поза render_template (макроси), який сигнали не бачать."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            m = _current.get()
+            if m is not None:
+                m.template_seconds += time.perf_counter() - start
+
+    # ─── Повільні запити ───
+    def explain(self, sql, params, database=None):
+        """Рядки EXPLAIN QUERY PLAN з окремого read-only з'єднання до database
+        (типово — каталог)."""
+        if params is None:  # executemany — план від значень не залежить
+            params = [None] * sql.count("?")
+        db = sqlite3.connect(f"file:{database or self.database}?mode=ro", uri=True)
+        try:
+            return db.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        finally:
+            db.close()
+
+    def _log_slow(self, name, sql, params, seconds, conn=None):
+        with self._lock:
+            self.slow_queries += 1
+        try:
+            # План — по файлу, де запит виконано: у шардах це не каталог
+            database = conn.execute("PRAGMA database_list").fetchone()[2] if conn else None
+            depth = {0: 0}
+            lines = []
+            for node, parent, _, detail in self.explain(sql, params, database):
+                depth[node] = depth.get(parent, 0) + 1
+                lines.append("  " * depth[node] + detail)
+            plan = "\n".join(lines) or "  (плану немає)"
+        except sqlite3.Error as e:
+            plan = f"  EXPLAIN не вдався: {e}"
+        log.warning("slow query %s: %.1f ms\n%s\n%s",
+                    name, seconds * 1000, " ".join(sql.split()), plan)
+
+    # ─── Звіти ───
+    def summary(self):
+        """Рядки для адмін-панелі, найдорожчі маршрути першими."""
+        rows = []
+        with self._lock:
+            for (route, method), s in self._routes.items():
+                n = s.latency.count
+                rows.append({
+                    "route": route,
+                    "method": method,
+                    "requests": n,
+                    "errors": sum(c for status, c in s.statuses.items() if status >= 500),
+                    "avg_ms": s.latency.sum / n * 1000,
+                    "p50_ms": _bound_ms(s.latency.quantile(0.5)),
+                    "p95_ms": _bound_ms(s.latency.quantile(0.95)),
+                    "queries": s.queries.sum / n,
+                    "statements": s.statements / n,
+                    "sql_ms": s.sql_seconds / n * 1000,
+                    "template_ms": s.template_seconds / n * 1000,
+                    "lock_ms": s.lock_seconds / n * 1000,
+                    "commit_ms": s.commit_seconds / n * 1000,
+                    "total_s": s.latency.sum,
+                })
+        rows.sort(key=lambda r: r["total_s"], reverse=True)
+        return rows
+
+    def prometheus(self, families=()):
+        """Текстовий формат Prometheus; families — додаткові
+        (name, type, help, [(labels, value)]) від застосунку."""
+        with self._lock:
+            items = sorted(self._routes.items())
+            slow = self.slow_queries
+            out = []
+            latency, queries = [], []
+            requests, statements, sql, vm, template, lock, commit = [], [], [], [], [], [], []
+            for (route, method), s in items:
+                labels = {"route": route, "method": method}
+                latency.append((labels, s.latency))
+                queries.append((labels, s.queries))
+                for status, n in sorted(s.statuses.items()):
+                    requests.append(({**labels, "status": str(status)}, n))
+                statements.append((labels, s.statements))
+                sql.append((labels, s.sql_seconds))
+                vm.append((labels, s.vm_steps))
+                template.append((labels, s.template_seconds))
+                lock.append((labels, s.lock_seconds))
+                commit.append((labels, s.commit_seconds))
+
+            _histograms(out, "ninja_http_request_duration_seconds",
+                        "Час обробки запиту до відповіді.", latency)
+            _family(out, "ninja_http_requests_total", "counter",
+                    "Запити за маршрутом і статусом.", requests)
+            _histograms(out, "ninja_sql_queries_per_request",
+                        "Запитів dal на запит.", queries)
+            _family(out, "ninja_sql_seconds_total", "counter",
+                    "Час запитів dal.", sql)
+            _family(out, "ninja_sqlite_write_statements_total", "counter",
+                    "Інструкції SQLite на з'єднаннях запису, разом із тригерами й FTS5.", statements)
+            _family(out, "ninja_sqlite_vm_steps_total", "counter",
+                    f"Кроки VM SQLite, з точністю до {PROGRESS_STEPS}.", vm)
+            _family(out, "ninja_template_seconds_total", "counter",
+                    "Час рендерингу Jinja.", template)
+            _family(out, "ninja_write_lock_wait_seconds_total", "counter",
+                    "Очікування BEGIN IMMEDIATE пакетів, у яких був запис запиту.", lock)
+            _family(out, "ninja_write_commit_seconds_total", "counter",
+                    "COMMIT пакетів, у яких був запис запиту.", commit)
+        _family(out, "ninja_slow_queries_total", "counter",
+                "Запити dal, довші за поріг журналу.", [({}, slow)])
+        for name, kind, help_text, samples in families:
+            _family(out, name, kind, help_text, samples)
+        return "\n".join(out) + "\n"
+
+
+def _bound_ms(bound):
+    """Межа кошика в мс; None — вище за останній кошик."""
+    return None if bound == float("inf") else bound * 1000
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _family(out, name, kind, help_text, samples):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        out.append(f"{name}{_labels(labels)} {_number(value)}")
+
+
+def _histograms(out, name, help_text, histograms):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, h in histograms:
+        for bound, total in h.cumulative():
+            out.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {total}")
+        out.append(f"{name}_sum{_labels(labels)} {_number(h.sum)}")
+        out.append(f"{name}_count{_labels(labels)} {h.count}")
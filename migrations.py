@@ -0,0 +1,715 @@
+"""Версійні міграції схеми, номер застосованої — у PRAGMA user_version.
+
+    python migrations.py [--status] [шлях до бази]
+
+Застосунок під час старту викликає migrate(): коли схема актуальна, це
+одне читання user_version і таблиці бекфілів, без блокування запису.
+Відсталу схему доганяє той воркер, що першим візьме BEGIN IMMEDIATE;
+решта, дочекавшись блокування, бачать уже новий user_version.
+
+Кожна міграція — одна транзакція разом зі зміною user_version, тож
+перервана міграція не лишає схему напівзміненою. Великі бекфіли в цю
+транзакцію не входять: міграція лише реєструє їх у migration_backfills,
+а backfill_step() обробляє по шматку за раз і зберігає курсор. Під
+застосунком шматки йдуть через письменника між звичайними записами,
+після перезапуску — продовжуються з курсору.
+
+Нову міграцію додають у кінець MIGRATIONS з наступним номером; уже
+випущені не змінюють.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import date
+
+import dal
+
+BACKFILL_CHUNK = 100  # користувачів за крок бекфілу позицій
+POSITION_GAP = 1024.0  # той самий крок, що й app.POSITION_GAP
+
+
+def _script(db, sql):
+    """Інструкції скрипта по одній: executescript() сам комітить транзакцію."""
+    statement = ""
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            db.execute(statement)
+            statement = ""
+    if statement.strip():
+        db.execute(statement)
+
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+def _has_table(db, name):
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone() is not None
+
+
+# ─── Base tables ────────────────────────────────────────────────────
+# Бази, створені до міграцій, мають user_version 0 і частину таблиць,
+# тож перша міграція створює відсутнє й додає колонки, яких бракує.
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        code       TEXT    NOT NULL UNIQUE,
+        name       TEXT    NOT NULL DEFAULT 'Ніндзя',
+        created_at TEXT    NOT NULL,
+        is_admin   INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS todos (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id     INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        text        TEXT    NOT NULL,
+        done        INTEGER NOT NULL DEFAULT 0,
+        rank        TEXT    NOT NULL DEFAULT 'D',
+        deadline    TEXT,
+        created_at  TEXT    NOT NULL,
+        done_at     TEXT,
+        position    REAL    NOT NULL DEFAULT 0,
+        version     INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS subtasks (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        todo_id    INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
+        text       TEXT NOT NULL,
+        done       INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        version    INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_subtasks_todo ON subtasks(todo_id);
+
+    -- Індекс повторює dal.ORDER_SQL, тож список читається без сортування;
+    -- старі (user_id) і (user_id, done) — його префікси.
+    CREATE INDEX IF NOT EXISTS idx_todos_order
+        ON todos(user_id, done, position, created_at DESC, id DESC);
+    DROP INDEX IF EXISTS idx_todos_user;
+    DROP INDEX IF EXISTS idx_todos_done;
+"""
+
+LEGACY_COLUMNS = (
+    ("users", "is_admin", "INTEGER NOT NULL DEFAULT 0"),
+    ("todos", "position", "REAL NOT NULL DEFAULT 0"),
+    ("todos", "version", "INTEGER NOT NULL DEFAULT 0"),
+    ("subtasks", "version", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+
+def base_tables(db):
+    # Індекс idx_todos_order посилається на position, тож колонки — до нього
+    for table in ("users", "todos", "subtasks"):
+        if _has_table(db, table):
+            columns = _columns(db, table)
+            for t, column, decl in LEGACY_COLUMNS:
+                if t == table and column not in columns:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    _script(db, BASE_SCHEMA)
+
+
+# ─── Positions ──────────────────────────────────────────────────────
+# Колонка position з'явилась пізніше за місії: у старих базах усі місії
+# користувача мають однакову позицію 0, і перетягування між ними не має
+# проміжку. Бекфіл нумерує такі списки у поточному порядку показу.
+def positions(db):
+    return db.execute("SELECT 1 FROM todos LIMIT 1").fetchone() is not None
+
+
+def backfill_positions(db, cursor, limit):
+    user_ids = [row[0] for row in db.execute(
+        "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit))]
+    for user_id in user_ids:
+        lo, hi, count = db.execute(
+            "SELECT MIN(position), MAX(position), COUNT(*) FROM todos WHERE user_id = ?",
+            (user_id,)).fetchone()
+        if count > 1 and lo == hi:
+            ids = dal.ordered_todo_ids(db, user_id)
+            dal.update_positions(db, user_id, [((i + 1) * POSITION_GAP, todo_id)
+                                               for i, todo_id in enumerate(ids)])
+    return user_ids[-1] if len(user_ids) == limit else None
+
+
+# ─── Full-text search ───────────────────────────────────────────────
+# External-content FTS5 індекси над todos.text і subtasks.text.
+# unicode61 коректно токенізує кирилицю, prefix='2 3' пришвидшує
+# префіксні запити, які генерує dal.fts_query().
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5(
+        text,
+        content='todos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS todos_fts_ai AFTER INSERT ON todos BEGIN
+        INSERT INTO todos_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS todos_fts_ad AFTER DELETE ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS todos_fts_au AFTER UPDATE OF text ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO todos_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS subtasks_fts USING fts5(
+        text,
+        content='subtasks', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS subtasks_fts_ai AFTER INSERT ON subtasks BEGIN
+        INSERT INTO subtasks_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS subtasks_fts_ad AFTER DELETE ON subtasks BEGIN
+        INSERT INTO subtasks_fts(subtasks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS subtasks_fts_au AFTER UPDATE OF text ON subtasks BEGIN
+        INSERT INTO subtasks_fts(subtasks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO subtasks_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+"""
+
+# ─── Per-user counters ──────────────────────────────────────────────
+# user_stats тримає лічильники кожного користувача точними через тригери,
+# тож статистика читається одним запитом за первинним ключем.
+# overdue рахується відносно overdue_day: коли день змінився,
+# dal.get_stats() перераховує прострочені місії наживо.
+STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id        INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        total          INTEGER NOT NULL DEFAULT 0,
+        done           INTEGER NOT NULL DEFAULT 0,
+        overdue        INTEGER NOT NULL DEFAULT 0,
+        overdue_day    TEXT    NOT NULL DEFAULT '',
+        subtasks_total INTEGER NOT NULL DEFAULT 0,
+        subtasks_done  INTEGER NOT NULL DEFAULT 0,
+        version        INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TRIGGER IF NOT EXISTS user_stats_user_ai AFTER INSERT ON users BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id, overdue_day)
+        VALUES (new.id, date('now', 'localtime'));
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS user_stats_todo_ai AFTER INSERT ON todos BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id) VALUES (new.user_id);
+        UPDATE user_stats SET
+            total = total + 1,
+            done = done + new.done,
+            overdue = overdue + COALESCE(new.done = 0 AND new.deadline < overdue_day, 0)
+        WHERE user_id = new.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_stats_todo_au AFTER UPDATE OF done, deadline ON todos BEGIN
+        UPDATE user_stats SET
+            done = done - old.done + new.done,
+            overdue = overdue
+                - COALESCE(old.done = 0 AND old.deadline < overdue_day, 0)
+                + COALESCE(new.done = 0 AND new.deadline < overdue_day, 0)
+        WHERE user_id = new.user_id;
+    END;
+    -- BEFORE: під час каскадного видалення підзадач місії вже немає,
+    -- тож їхні лічильники знімаються тут, поки підзадачі ще видно.
+    CREATE TRIGGER IF NOT EXISTS user_stats_todo_bd BEFORE DELETE ON todos BEGIN
+        UPDATE user_stats SET
+            total = total - 1,
+            done = done - old.done,
+            overdue = overdue - COALESCE(old.done = 0 AND old.deadline < overdue_day, 0),
+            subtasks_total = subtasks_total - (SELECT COUNT(*) FROM subtasks WHERE todo_id = old.id),
+            subtasks_done = subtasks_done - (SELECT COALESCE(SUM(done), 0) FROM subtasks WHERE todo_id = old.id)
+        WHERE user_id = old.user_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS user_stats_subtask_ai AFTER INSERT ON subtasks BEGIN
+        UPDATE user_stats SET
+            subtasks_total = subtasks_total + 1,
+            subtasks_done = subtasks_done + new.done
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = new.todo_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_stats_subtask_au AFTER UPDATE OF done ON subtasks BEGIN
+        UPDATE user_stats SET subtasks_done = subtasks_done - old.done + new.done
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = new.todo_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_stats_subtask_ad AFTER DELETE ON subtasks BEGIN
+        UPDATE user_stats SET
+            subtasks_total = subtasks_total - 1,
+            subtasks_done = subtasks_done - old.done
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = old.todo_id);
+    END;
+"""
+
+# Версія даних користувача: зростає з кожною зміною його місій чи підзадач.
+# З неї будується ETag для GET-запитів, а кожен змінений рядок отримує
+# нову версію у своєму version — /api/sync віддає рядки з version > since.
+# Видалення лишають надгробок (tombstone) з версією, на якій рядок зник.
+# Підзадачі, видалені каскадом разом із місією, надгробка не лишають:
+# клієнт прибирає їх разом з місією.
+# Оновлення самого version тригери не чіпає (UPDATE OF без version).
+#
+# Ті самі тригери пишуть журнал changes для /api/events: глобальний seq
+# дозволяє кожному воркеру одним запитом дізнатися про всі нові зміни.
+# Журнал короткий — кожна тисячна зміна обрізає все старше 10 000 записів.
+VERSION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tombstones (
+        user_id INTEGER NOT NULL,
+        kind    TEXT    NOT NULL,  -- 'todo' | 'subtask'
+        row_id  INTEGER NOT NULL,
+        version INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_tombstones_user ON tombstones(user_id, version);
+    CREATE INDEX IF NOT EXISTS idx_todos_version ON todos(user_id, version);
+
+    CREATE TABLE IF NOT EXISTS changes (
+        seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind    TEXT    NOT NULL,  -- 'todo' | 'subtask'
+        action  TEXT    NOT NULL,  -- 'added' | 'toggled' | 'edited' | 'moved' | 'deleted'
+        row_id  INTEGER NOT NULL,
+        todo_id INTEGER             -- для підзадач
+    );
+    CREATE INDEX IF NOT EXISTS idx_changes_user ON changes(user_id, seq);
+    CREATE TRIGGER IF NOT EXISTS changes_prune AFTER INSERT ON changes
+    WHEN new.seq % 1000 = 0 BEGIN
+        DELETE FROM changes WHERE seq <= new.seq - 10000;
+    END;
+
+    DROP TRIGGER IF EXISTS user_version_todo_ai;
+    DROP TRIGGER IF EXISTS user_version_todo_au;
+    DROP TRIGGER IF EXISTS user_version_todo_ad;
+    DROP TRIGGER IF EXISTS user_version_subtask_ai;
+    DROP TRIGGER IF EXISTS user_version_subtask_au;
+    DROP TRIGGER IF EXISTS user_version_subtask_ad;
+
+    CREATE TRIGGER user_version_todo_ai AFTER INSERT ON todos BEGIN
+        UPDATE user_stats SET version = version + 1 WHERE user_id = new.user_id;
+        UPDATE todos SET version = (SELECT version FROM user_stats WHERE user_id = new.user_id)
+        WHERE id = new.id;
+        INSERT INTO changes (user_id, kind, action, row_id)
+        VALUES (new.user_id, 'todo', 'added', new.id);
+    END;
+    CREATE TRIGGER user_version_todo_au
+    AFTER UPDATE OF text, done, rank, deadline, done_at, position ON todos BEGIN
+        UPDATE user_stats SET version = version + 1 WHERE user_id = new.user_id;
+        UPDATE todos SET version = (SELECT version FROM user_stats WHERE user_id = new.user_id)
+        WHERE id = new.id;
+        INSERT INTO changes (user_id, kind, action, row_id)
+        VALUES (new.user_id, 'todo', CASE
+            WHEN old.done IS NOT new.done THEN 'toggled'
+            WHEN old.text IS new.text AND old.rank IS new.rank AND old.deadline IS new.deadline
+                THEN 'moved'
+            ELSE 'edited'
+        END, new.id);
+    END;
+    CREATE TRIGGER user_version_todo_ad AFTER DELETE ON todos BEGIN
+        UPDATE user_stats SET version = version + 1 WHERE user_id = old.user_id;
+        INSERT INTO tombstones (user_id, kind, row_id, version)
+        SELECT user_id, 'todo', old.id, version FROM user_stats WHERE user_id = old.user_id;
+        INSERT INTO changes (user_id, kind, action, row_id)
+        VALUES (old.user_id, 'todo', 'deleted', old.id);
+    END;
+    CREATE TRIGGER user_version_subtask_ai AFTER INSERT ON subtasks BEGIN
+        UPDATE user_stats SET version = version + 1
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = new.todo_id);
+        UPDATE subtasks SET version = (
+            SELECT s.version FROM todos t JOIN user_stats s ON s.user_id = t.user_id
+            WHERE t.id = new.todo_id
+        ) WHERE id = new.id;
+        INSERT INTO changes (user_id, kind, action, row_id, todo_id)
+        SELECT user_id, 'subtask', 'added', new.id, new.todo_id FROM todos WHERE id = new.todo_id;
+    END;
+    CREATE TRIGGER user_version_subtask_au AFTER UPDATE OF text, done ON subtasks BEGIN
+        UPDATE user_stats SET version = version + 1
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = new.todo_id);
+        UPDATE subtasks SET version = (
+            SELECT s.version FROM todos t JOIN user_stats s ON s.user_id = t.user_id
+            WHERE t.id = new.todo_id
+        ) WHERE id = new.id;
+        INSERT INTO changes (user_id, kind, action, row_id, todo_id)
+        SELECT user_id, 'subtask', CASE WHEN old.done IS NOT new.done THEN 'toggled' ELSE 'edited' END,
+               new.id, new.todo_id
+        FROM todos WHERE id = new.todo_id;
+    END;
+    CREATE TRIGGER user_version_subtask_ad AFTER DELETE ON subtasks BEGIN
+        UPDATE user_stats SET version = version + 1
+        WHERE user_id = (SELECT user_id FROM todos WHERE id = old.todo_id);
+        INSERT INTO tombstones (user_id, kind, row_id, version)
+        SELECT s.user_id, 'subtask', old.id, s.version
+        FROM todos t JOIN user_stats s ON s.user_id = t.user_id
+        WHERE t.id = old.todo_id;
+        INSERT INTO changes (user_id, kind, action, row_id, todo_id)
+        SELECT user_id, 'subtask', 'deleted', old.id, old.todo_id FROM todos WHERE id = old.todo_id;
+    END;
+    -- Каскад видаляє місії раніше, ніж спрацює цей тригер
+    CREATE TRIGGER IF NOT EXISTS tombstones_user_ad AFTER DELETE ON users BEGIN
+        DELETE FROM tombstones WHERE user_id = old.id;
+    END;
+"""
+
+# Відповіді на пакети з заголовком Idempotency-Key. Офлайн-клієнт
+# повторює пакет, доки не отримає відповідь, а сервер виконує його
+# лише раз і на повтори віддає збережену відповідь.
+IDEMPOTENCY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        key        TEXT    NOT NULL,
+        response   TEXT    NOT NULL,
+        created_at TEXT    NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID;
+"""
+
+# Глобальні лічильники змін. counters.users зростає з кожною зміною
+# таблиці users і входить у ключ кешу користувачів.
+COUNTERS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (
+        name  TEXT    PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO counters (name) VALUES ('users');
+
+    CREATE TRIGGER IF NOT EXISTS counters_users_ai AFTER INSERT ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+    END;
+    CREATE TRIGGER IF NOT EXISTS counters_users_au AFTER UPDATE ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+    END;
+    CREATE TRIGGER IF NOT EXISTS counters_users_ad AFTER DELETE ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+    END;
+"""
+
+
+def backfill_stats(db):
+    """Одноразово заповнює user_stats з наявних todos/subtasks."""
+    db.execute("""
+        INSERT OR REPLACE INTO user_stats
+            (user_id, total, done, overdue, overdue_day, subtasks_total, subtasks_done)
+        SELECT u.id,
+               (SELECT COUNT(*) FROM todos WHERE user_id = u.id),
+               (SELECT COALESCE(SUM(done), 0) FROM todos WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM todos
+                 WHERE user_id = u.id AND done = 0 AND deadline < date('now', 'localtime')),
+               date('now', 'localtime'),
+               (SELECT COUNT(*) FROM subtasks s JOIN todos t ON t.id = s.todo_id
+                 WHERE t.user_id = u.id),
+               (SELECT COALESCE(SUM(s.done), 0) FROM subtasks s JOIN todos t ON t.id = s.todo_id
+                 WHERE t.user_id = u.id)
+        FROM users u
+    """)
+
+
+# ─── Schema steps ───────────────────────────────────────────────────
+def full_text_search(db):
+    existed = _has_table(db, "todos_fts")
+    _script(db, FTS_SCHEMA)
+    if not existed:
+        # Існуюча база: індексуємо вже збережені місії один раз.
+        # Шматками не можна: тригер видалення з індексу рядка, якого там
+        # ще немає, псує external-content FTS5.
+        db.execute("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')")
+        db.execute("INSERT INTO subtasks_fts(subtasks_fts) VALUES ('rebuild')")
+
+
+def user_stats(db):
+    existed = _has_table(db, "user_stats")
+    _script(db, STATS_SCHEMA)
+    if not existed:
+        backfill_stats(db)
+    if "version" not in _columns(db, "user_stats"):
+        db.execute("ALTER TABLE user_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def versions(db):
+    _script(db, VERSION_SCHEMA)
+
+
+def idempotency_keys(db):
+    _script(db, IDEMPOTENCY_SCHEMA)
+
+
+def counters(db):
+    _script(db, COUNTERS_SCHEMA)
+
+
+def subtask_order(db):
+    # Підзадачі місії читаються в порядку створення — без сортування
+    _script(db, """
+        CREATE INDEX IF NOT EXISTS idx_subtasks_order ON subtasks(todo_id, created_at);
+        DROP INDEX IF EXISTS idx_subtasks_todo;
+    """)
+
+
+# ─── Archive ────────────────────────────────────────────────────────
+# Давно виконані місії переїжджають в archived_* разом із підзадачами і
+# зі своїми id, тож живий todos лишається малим. Статистика рахує і
+# архів: тригери архіву додають рівно те, що тригери todos знімають під
+# час переносу, і навпаки під час відновлення.
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archived_todos (
+        id          INTEGER PRIMARY KEY,  -- той самий id, що був у todos
+        user_id     INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        text        TEXT    NOT NULL,
+        done        INTEGER NOT NULL,
+        rank        TEXT    NOT NULL,
+        deadline    TEXT,
+        created_at  TEXT    NOT NULL,
+        done_at     TEXT,
+        position    REAL    NOT NULL,
+        archived_at TEXT    NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_archived_todos_user
+        ON archived_todos(user_id, done_at DESC, id DESC);
+
+    CREATE TABLE IF NOT EXISTS archived_subtasks (
+        id         INTEGER PRIMARY KEY,
+        todo_id    INTEGER NOT NULL REFERENCES archived_todos(id) ON DELETE CASCADE,
+        text       TEXT    NOT NULL,
+        done       INTEGER NOT NULL,
+        created_at TEXT    NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_archived_subtasks_todo
+        ON archived_subtasks(todo_id, created_at);
+
+    -- Кандидати на архів; виконаних у живій таблиці мало, тож індекс теж малий
+    CREATE INDEX IF NOT EXISTS idx_todos_archivable ON todos(done_at) WHERE done = 1;
+
+    CREATE TRIGGER IF NOT EXISTS user_stats_archived_ai AFTER INSERT ON archived_todos BEGIN
+        UPDATE user_stats SET total = total + 1, done = done + new.done
+        WHERE user_id = new.user_id;
+    END;
+    -- BEFORE: як і для todos, каскад видаляє підзадачі вже без місії
+    CREATE TRIGGER IF NOT EXISTS user_stats_archived_bd BEFORE DELETE ON archived_todos BEGIN
+        UPDATE user_stats SET
+            total = total - 1,
+            done = done - old.done,
+            subtasks_total = subtasks_total
+                - (SELECT COUNT(*) FROM archived_subtasks WHERE todo_id = old.id),
+            subtasks_done = subtasks_done
+                - (SELECT COALESCE(SUM(done), 0) FROM archived_subtasks WHERE todo_id = old.id)
+        WHERE user_id = old.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_stats_archived_subtask_ai AFTER INSERT ON archived_subtasks BEGIN
+        UPDATE user_stats SET
+            subtasks_total = subtasks_total + 1,
+            subtasks_done = subtasks_done + new.done
+        WHERE user_id = (SELECT user_id FROM archived_todos WHERE id = new.todo_id);
+    END;
+"""
+
+
+def archive(db):
+    _script(db, ARCHIVE_SCHEMA)
+    # Старі виконані місії без done_at інакше не потрапили б в архів ніколи
+    db.execute("UPDATE todos SET done_at = created_at WHERE done = 1 AND done_at IS NULL")
+
+
+# ─── Deadlines ──────────────────────────────────────────────────────
+# Дедлайни зберігаються як ISO-дати (dal.iso_date), тож порівняння рядків
+# — це порівняння дат, а діапазони йдуть індексом. due_today рахується
+# тими ж тригерами, що й overdue, відносно overdue_day; денний
+# перерахунок (dal.roll_over_stats) переносить обидва на новий день.
+DEADLINE_SCHEMA = """
+    CREATE INDEX IF NOT EXISTS idx_todos_deadline ON todos(user_id, done, deadline);
+
+    DROP TRIGGER IF EXISTS user_stats_todo_ai;
+    DROP TRIGGER IF EXISTS user_stats_todo_au;
+    DROP TRIGGER IF EXISTS user_stats_todo_bd;
+
+    CREATE TRIGGER user_stats_todo_ai AFTER INSERT ON todos BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id) VALUES (new.user_id);
+        UPDATE user_stats SET
+            total = total + 1,
+            done = done + new.done,
+            overdue = overdue + COALESCE(new.done = 0 AND new.deadline < overdue_day, 0),
+            due_today = due_today + COALESCE(new.done = 0 AND new.deadline = overdue_day, 0)
+        WHERE user_id = new.user_id;
+    END;
+    CREATE TRIGGER user_stats_todo_au AFTER UPDATE OF done, deadline ON todos BEGIN
+        UPDATE user_stats SET
+            done = done - old.done + new.done,
+            overdue = overdue
+                - COALESCE(old.done = 0 AND old.deadline < overdue_day, 0)
+                + COALESCE(new.done = 0 AND new.deadline < overdue_day, 0),
+            due_today = due_today
+                - COALESCE(old.done = 0 AND old.deadline = overdue_day, 0)
+                + COALESCE(new.done = 0 AND new.deadline = overdue_day, 0)
+        WHERE user_id = new.user_id;
+    END;
+    CREATE TRIGGER user_stats_todo_bd BEFORE DELETE ON todos BEGIN
+        UPDATE user_stats SET
+            total = total - 1,
+            done = done - old.done,
+            overdue = overdue - COALESCE(old.done = 0 AND old.deadline < overdue_day, 0),
+            due_today = due_today - COALESCE(old.done = 0 AND old.deadline = overdue_day, 0),
+            subtasks_total = subtasks_total - (SELECT COUNT(*) FROM subtasks WHERE todo_id = old.id),
+            subtasks_done = subtasks_done - (SELECT COALESCE(SUM(done), 0) FROM subtasks WHERE todo_id = old.id)
+        WHERE user_id = old.user_id;
+    END;
+"""
+
+
+def deadlines(db):
+    if "due_today" not in _columns(db, "user_stats"):
+        db.execute("ALTER TABLE user_stats ADD COLUMN due_today INTEGER NOT NULL DEFAULT 0")
+    # Довільний текст з давніх версій: дата, якщо її можна розібрати, інакше NULL
+    for table in ("todos", "archived_todos"):
+        rows = db.execute(f"""
+            SELECT id, deadline FROM {table}
+            WHERE deadline IS NOT NULL
+              AND deadline NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+        """).fetchall()
+        db.executemany(f"UPDATE {table} SET deadline = ? WHERE id = ?",
+                       [(dal.iso_date(deadline), todo_id) for todo_id, deadline in rows])
+    _script(db, DEADLINE_SCHEMA)
+    db.execute("UPDATE user_stats SET overdue_day = ''")
+    while dal.roll_over_stats(db, date.today().isoformat(), BACKFILL_CHUNK):
+        pass
+
+
+def users_order(db):
+    # Сторінки адмінки йдуть від нових користувачів без сортування
+    _script(db, "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id);")
+
+
+def shards(db):
+    # Файл шарду користувача поруч із каталогом; '' — сам каталог (див. shards.py)
+    if "shard" not in _columns(db, "users"):
+        db.execute("ALTER TABLE users ADD COLUMN shard TEXT NOT NULL DEFAULT ''")
+
+
+# ─── Runner ─────────────────────────────────────────────────────────
+# (номер, назва, зміна схеми, бекфіл або None). Зміна схеми з бекфілом
+# повертає, чи є для нього дані: на порожній базі бекфіл не реєструється.
+MIGRATIONS = (
+    (1, "base tables", base_tables, None),
+    (2, "positions", positions, backfill_positions),
+    (3, "full-text search", full_text_search, None),
+    (4, "user stats", user_stats, None),
+    (5, "row versions and change log", versions, None),
+    (6, "idempotency keys", idempotency_keys, None),
+    (7, "counters", counters, None),
+    (8, "subtask order index", subtask_order, None),
+    (9, "archive", archive, None),
+    (10, "deadlines", deadlines, None),
+    (11, "users order index", users_order, None),
+    (12, "shards", shards, None),
+)
+LATEST = MIGRATIONS[-1][0]
+BACKFILLS = {number: backfill for number, _, _, backfill in MIGRATIONS if backfill}
+
+BACKFILLS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS migration_backfills (
+        version INTEGER PRIMARY KEY,
+        cursor  INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+
+def schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_backfills(db):
+    if not _has_table(db, "migration_backfills"):
+        return []
+    return [row[0] for row in db.execute("SELECT version FROM migration_backfills ORDER BY version")]
+
+
+def migrate(path):
+    """Доганяє схему бази path; True, якщо лишились незавершені бекфіли."""
+    db = sqlite3.connect(path, isolation_level=None, timeout=30)
+    try:
+        if schema_version(db) < LATEST:
+            # WAL зберігається у файлі; всередині транзакції його не змінити
+            db.execute("PRAGMA journal_mode=WAL")
+            while _apply_next(db):
+                pass
+        return bool(pending_backfills(db))
+    finally:
+        db.close()
+
+
+def _apply_next(db):
+    """Наступна міграція в окремій транзакції; False — схема актуальна."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(db)  # інший воркер міг встигнути раніше
+        if current >= LATEST:
+            db.execute("COMMIT")
+            return False
+        number, _, apply, backfill = MIGRATIONS[current]
+        needs_backfill = apply(db)
+        if backfill is not None and needs_backfill:
+            _script(db, BACKFILLS_SCHEMA)
+            db.execute("INSERT OR IGNORE INTO migration_backfills (version) VALUES (?)", (number,))
+        db.execute(f"PRAGMA user_version = {number}")
+        db.execute("COMMIT")
+        return True
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+
+def backfill_step(db, limit=BACKFILL_CHUNK):
+    """Один шматок найстарішого незавершеного бекфілу в поточній транзакції.
+
+    Не комітить — під застосунком це робить письменник. False — бекфілів
+    не лишилось.
+    """
+    if not _has_table(db, "migration_backfills"):
+        return False
+    row = db.execute(
+        "SELECT version, cursor FROM migration_backfills ORDER BY version LIMIT 1").fetchone()
+    if row is None:
+        return False
+    number, cursor = row
+    cursor = BACKFILLS[number](db, cursor, limit)
+    if cursor is None:
+        db.execute("DELETE FROM migration_backfills WHERE version = ?", (number,))
+    else:
+        db.execute("UPDATE migration_backfills SET cursor = ? WHERE version = ?", (cursor, number))
+    return True
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Міграції схеми бази ninja-todo.")
+    p.add_argument("database", nargs="?", help="шлях до бази (типово DATABASE_PATH або todo.db)")
+    p.add_argument("--status", action="store_true", help="лише показати стан")
+    args = p.parse_args(argv)
+    path = args.database
+    if path is None:
+        path = os.environ.get("DATABASE_PATH") or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "todo.db")
+
+    if not args.status:
+        migrate(path)
+        db = sqlite3.connect(path, isolation_level=None, timeout=30)
+        steps = 0
+        while True:
+            db.execute("BEGIN IMMEDIATE")
+            if not backfill_step(db):
+                db.execute("COMMIT")
+                break
+            db.execute("COMMIT")
+            steps += 1
+        db.close()
+        if steps:
+            print(f"бекфіли: {steps} кроків")
+
+    db = sqlite3.connect(path)
+    version = schema_version(db)
+    pending = pending_backfills(db)
+    db.close()
+    for number, name, _, backfill in MIGRATIONS:
+        state = "застосовано" if number <= version else "очікує"
+        if number in pending:
+            state += ", бекфіл не завершено"
+        print(f"{number:3d}  {name:32s} {state}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+import migrations
+
 DATABASE = os.environ.get('DATABASE_PATH', 'todo.db')
 
 users = [
@@ -8,14 +10,9 @@ users = [
     (2, '9WH9FKDN', 'Юля', 0, '2026-02-20T00:37:31.055209'),
 ]
 
+migrations.migrate(DATABASE)
 db = sqlite3.connect(DATABASE)
 
-# Ensure is_admin column exists
-try:
-    db.execute('ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0')
-except:
-    pass
-
 for user in users:
     existing = db.execute('SELECT id FROM users WHERE code = ?', (user[1],)).fetchone()
     if not existing:
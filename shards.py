@@ -0,0 +1,300 @@
+"""Шарди: дані користувачів у кількох файлах SQLite, користувачі — в каталозі.
+
+    python shards.py [--shards N] [--status] [каталог]
+
+Каталог — це сама DATABASE (todo.db): у ній users, invite-коди й
+лічильник counters.users, тобто все, що потрібно для входу й адмінки.
+Місії, підзадачі, архів, user_stats і журнал змін користувача лежать у
+файлі його шарду: users.shard — ім'я шарду (shard0 — це todo-shard0.db
+поруч із каталогом), '' — сам каталог. У шарді є копія рядка users з
+тим самим id: на неї посилаються зовнішні ключі й тригери статистики.
+Кожен шард має власне блокування запису SQLite, а застосунок тримає на
+нього окремого письменника, тож записи користувачів різних шардів ідуть
+паралельно.
+
+Новий користувач потрапляє в шард names[id % N]. З SHARDS=1 (типово)
+шард один — '' — і все лежить у todo.db, як до шардування.
+
+Без --status утиліта переносить кожного користувача, чий шард не
+збігається з цільовим для N: так наявна todo.db ділиться на шарди, і так
+само вони перерозподіляються після зміни N. Користувач переїжджає
+однією транзакцією в кожному з файлів, поки джерело тримає блокування
+запису. Місії й підзадачі отримують нові id (як в імпорті transfer.py),
+а для старих у новому шарді лишаються tombstones, тож /api/sync клієнта
+просто отримує заміну. Перерваний перенос безпечно запустити знову.
+Наприкінці утиліта прибирає з шардів залишки, яких каталог уже не знає
+(перерваний перенос чи видалення), і дописує копії users, яких бракує
+(реєстрація, перервана між каталогом і шардом).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+import dal
+import migrations
+import transfer
+
+CATALOG = ""  # ім'я шарду, що живе у файлі каталогу
+
+
+def shard_names(count):
+    """Імена N шардів; один шард — сам каталог."""
+    if count <= 1:
+        return [CATALOG]
+    return [f"shard{i}" for i in range(count)]
+
+
+def shard_path(database, name):
+    """Файл шарду name поруч із каталогом database: todo.db → todo-shard0.db."""
+    if name == CATALOG:
+        return database
+    stem, ext = os.path.splitext(database)
+    return f"{stem}-{os.path.basename(name)}{ext}"
+
+
+class Router:
+    """Відкриті шарди воркера за іменем.
+
+    open_shard(name, path) створює об'єкт шарду (у застосунку — пули,
+    письменник і опитувач SSE) і викликається раз на ім'я, ліниво.
+    """
+
+    def __init__(self, database, count, open_shard):
+        self.database = database
+        self.names = shard_names(count)
+        self._open_shard = open_shard
+        self._lock = threading.Lock()
+        self._shards = {}
+
+    def get(self, name):
+        shard = self._shards.get(name)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.get(name)
+                if shard is None:
+                    shard = self._open_shard(name, shard_path(self.database, name))
+                    self._shards[name] = shard
+        return shard
+
+    @property
+    def catalog(self):
+        return self.get(CATALOG)
+
+    def target(self, user_id):
+        """Шард, у який потрапляє новий користувач."""
+        return self.names[user_id % len(self.names)]
+
+    def all(self):
+        """Каталог, налаштовані шарди і ті, що вже відкривались (користувачі,
+        яких ще не перенесли після зміни N)."""
+        names = dict.fromkeys([CATALOG, *self.names, *list(self._shards)])
+        return [self.get(name) for name in names]
+
+    def opened(self):
+        return list(self._shards.values())
+
+
+# ─── Rebalance ──────────────────────────────────────────────────────
+def connect(path):
+    db = sqlite3.connect(path, isolation_level=None, timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys=ON")
+    return db
+
+
+def clear_user(db, name, user_id):
+    """Прибирає дані user_id з шарду name; рядок каталогу не чіпає."""
+    if name == CATALOG:
+        dal.purge_user_data(db, user_id)
+    else:
+        dal.delete_user(db, user_id)  # каскадом — місії, архів і статистика
+
+
+def reserve_ids(source, target):
+    """Нові id у target — більші за всі id джерела, тож жоден старий id,
+    що лишається в tombstones, не збігається з новим рядком."""
+    for table, archive_table in (("todos", "archived_todos"), ("subtasks", "archived_subtasks")):
+        after = dal.allocate_ids(source, table, archive_table, 0)
+        start = dal.allocate_ids(target, table, archive_table, 0)
+        if start < after:
+            dal.allocate_ids(target, table, archive_table, after - start)
+
+
+def copy_user(source, target, user_id):
+    """Місії користувача з source у target у поточних транзакціях обох;
+    (місій, підзадач)."""
+    dal.continue_version(target, user_id, dal.get_version(source, user_id))
+    reserve_ids(source, target)
+    old = {"todo": [], "subtask": []}
+
+    def records():
+        for record in transfer.user_records(source, user_id):
+            if record["archived_at"] is None:  # архів у /api/sync не входить
+                old["todo"].append(record["id"])
+                old["subtask"] += [sub["id"] for sub in record["subtasks"]]
+            yield record
+
+    todos = subtasks = 0
+    for chunk in transfer.chunks(enumerate(records(), 1)):
+        _, n, m = transfer.import_chunk(target, chunk, user_id, users=False)
+        todos += n
+        subtasks += m
+    for kind, row_ids in old.items():
+        if row_ids:
+            dal.add_tombstones(target, user_id, kind, row_ids)
+    return todos, subtasks
+
+
+def move_user(conns, user_id, source, target):
+    """Переносить користувача з шарду source у target; (місій, підзадач).
+
+    conns — з'єднання за іменем шарду, conns[CATALOG] — каталог. Джерело
+    тримає BEGIN IMMEDIATE, доки каталог не перемкнеться на target, тож
+    записи застосунку в старий шард не загубляться між копією і
+    перемиканням.
+    """
+    src, dst, catalog = conns[source], conns[target], conns[CATALOG]
+    with transfer.immediate(src):
+        user = dict(dal.get_user(catalog, user_id), shard=target)
+        with transfer.immediate(dst):
+            clear_user(dst, target, user_id)  # залишок перерваного переносу
+            if target != CATALOG:
+                dal.insert_user_stubs(dst, [user])
+            counts = copy_user(src, dst, user_id)
+            if target == CATALOG:
+                dal.set_user_shards(catalog, [(target, user_id)])
+        if source != CATALOG and target != CATALOG:
+            with transfer.immediate(catalog):
+                dal.set_user_shards(catalog, [(target, user_id)])
+        elif source == CATALOG:
+            dal.set_user_shards(catalog, [(target, user_id)])
+        clear_user(src, source, user_id)
+    return counts
+
+
+def sweep(conns, owners):
+    """Видаляє з шардів копії користувачів, яких каталог туди не відносить
+    (перерваний перенос, видалення без шарду); повертає кількість."""
+    removed = 0
+    for name, db in conns.items():
+        if name == CATALOG:
+            continue
+        stale = [user_id for user_id in dal.user_shards(db) if owners.get(user_id) != name]
+        if stale:
+            with transfer.immediate(db):
+                for user_id in stale:
+                    dal.delete_user(db, user_id)
+            removed += len(stale)
+    return removed
+
+
+def repair_stubs(conns, owners):
+    """Дописує в шарди копії рядків каталогу, яких там немає; повертає кількість."""
+    catalog = conns[CATALOG]
+    added = 0
+    for name, db in conns.items():
+        if name == CATALOG:
+            continue
+        present = dal.user_shards(db)
+        missing = [user_id for user_id, shard in owners.items()
+                   if shard == name and user_id not in present]
+        if missing:
+            with transfer.immediate(db):
+                dal.insert_user_stubs(db, [dal.get_user(catalog, user_id) for user_id in missing])
+            added += len(missing)
+    return added
+
+
+def rebalance(database, count, log=print):
+    """Переносить усіх користувачів у цільові шарди для count; (користувачів, місій)."""
+    names = shard_names(count)
+    conns = {}
+    try:
+        def open_conn(name):
+            if name not in conns:
+                path = shard_path(database, name)
+                migrations.migrate(path)
+                conns[name] = connect(path)
+            return conns[name]
+
+        for name in [CATALOG, *names]:
+            open_conn(name)
+        owners = dal.user_shards(conns[CATALOG])
+        moved = todos = 0
+        for user_id, source in sorted(owners.items()):
+            target = names[user_id % len(names)]
+            if source == target:
+                continue
+            open_conn(source)
+            n, m = move_user(conns, user_id, source, target)
+            owners[user_id] = target
+            moved += 1
+            todos += n
+            log(f"{user_id}: {source or 'каталог'} → {target or 'каталог'}, місій {n}, підзадач {m}")
+        removed = sweep(conns, owners)
+        if removed:
+            log(f"прибрано залишків: {removed}")
+        repaired = repair_stubs(conns, owners)
+        if repaired:
+            log(f"дописано копій users: {repaired}")
+        return moved, todos
+    finally:
+        for db in conns.values():
+            db.close()
+
+
+def status(database, count):
+    """Рядки (шард, файл, користувачів, місій, переїде) для --status."""
+    names = shard_names(count)
+    catalog = connect(database)
+    try:
+        owners = dal.user_shards(catalog)
+    except sqlite3.OperationalError:
+        # Каталог до міграції 12: усі дані ще в ньому
+        owners = {user_id: CATALOG for user_id, in catalog.execute("SELECT id FROM users")}
+    finally:
+        catalog.close()
+    rows = []
+    for name in dict.fromkeys([CATALOG, *names, *owners.values()]):
+        path = shard_path(database, name)
+        users = [user_id for user_id, shard in owners.items() if shard == name]
+        todos = None
+        if os.path.exists(path):
+            db = connect(path)
+            try:
+                todos = dal.todo_totals(db)["total_todos"]
+            except sqlite3.OperationalError:
+                pass  # файл без схеми — шард ще не створено
+            finally:
+                db.close()
+        moving = sum(1 for user_id in users if names[user_id % len(names)] != name)
+        rows.append((name, path, len(users), todos, moving))
+    return rows
+
+
+# ─── CLI ────────────────────────────────────────────────────────────
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Розподіл користувачів ninja-todo по шардах.")
+    p.add_argument("database", nargs="?", help="каталог (типово DATABASE_PATH або todo.db)")
+    p.add_argument("--shards", type=int, default=int(os.environ.get("SHARDS", 1)),
+                   help="кількість шардів (типово SHARDS або 1)")
+    p.add_argument("--status", action="store_true", help="лише показати розподіл")
+    args = p.parse_args(argv)
+    path = args.database or os.environ.get("DATABASE_PATH") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "todo.db")
+
+    if not args.status:
+        migrations.migrate(path)
+        moved, todos = rebalance(path, args.shards)
+        print(f"перенесено користувачів: {moved}, місій: {todos}")
+    for name, shard_file, users, todos, moving in status(path, args.shards):
+        print(f"{name or 'каталог':10s} {os.path.basename(shard_file):24s} "
+              f"користувачів {users:6d}  місій {'—' if todos is None else todos:>8}"
+              + (f"  переїде {moving}" if moving else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
 #!/bin/bash
-cd /Users/vitaliikovalchuk/ninja-todo
-/Users/vitaliikovalchuk/ninja-todo/venv/bin/python app.py >> /Users/vitaliikovalchuk/ninja-todo/logs/server.log 2>> /Users/vitaliikovalchuk/ninja-todo/logs/error.log
+cd "$(dirname "$0")"
+mkdir -p logs
+venv/bin/python app.py >> logs/server.log 2>> logs/error.log
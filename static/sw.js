@@ -1,4 +1,4 @@
-const CACHE = 'ninja-todo-v1';
+const CACHE = 'ninja-todo-v3';
 const STATIC = [
   '/',
   '/static/style.css',
@@ -7,7 +7,482 @@ const STATIC = [
   '/static/icon-512.png',
 ];
 
-// Install - cache static assets
+// ─── Offline-first ─────────────────────────────────────────────────
+// IndexedDB тримає копію місій і підзадач користувача. Читання /api/*
+// віддаються з неї одразу, а синхронізація з /api/sync іде у фоні.
+// Зміни (/api/batch) застосовуються локально й стають у outbox, який
+// відправляється на сервер по черзі з Idempotency-Key: повтор після
+// обриву зв'язку сервер не виконає вдруге.
+// Нові місії до відправки мають тимчасові від'ємні id; після відправки
+// idmap зіставляє їх зі справжніми.
+
+const DB_NAME = 'ninja-todo';
+const POSITION_GAP = 1024;
+const REFRESH_INTERVAL = 2000;
+
+let dbPromise = null;
+let flushing = null;
+let lastRefresh = 0;
+
+function openDB() {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve, reject) => {
+      const req = indexedDB.open(DB_NAME, 1);
+      req.onupgradeneeded = () => {
+        const db = req.result;
+        db.createObjectStore('todos', { keyPath: 'id' });
+        db.createObjectStore('subtasks', { keyPath: 'id' }).createIndex('todo_id', 'todo_id');
+        db.createObjectStore('outbox', { keyPath: 'seq', autoIncrement: true });
+        db.createObjectStore('meta');
+      };
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+  return dbPromise;
+}
+
+function done(req) {
+  return new Promise((resolve, reject) => {
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+function finished(tx) {
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = tx.onabort = () => reject(tx.error);
+  });
+}
+
+async function transaction(stores, mode, fn) {
+  const db = await openDB();
+  const tx = db.transaction(stores, mode);
+  const complete = finished(tx);
+  complete.catch(() => {});  // якщо fn перервала транзакцію, помилку кидає сама fn
+  const result = await fn(tx);
+  await complete;
+  return result;
+}
+
+function getMeta(tx, key) {
+  return done(tx.objectStore('meta').get(key));
+}
+
+function setMeta(tx, key, value) {
+  return done(tx.objectStore('meta').put(value, key));
+}
+
+function json(body, status = 200) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { 'Content-Type': 'application/json' },
+  });
+}
+
+async function notify(message) {
+  const clients = await self.clients.matchAll({ type: 'window' });
+  clients.forEach(c => c.postMessage(message));
+}
+
+// ─── Mirror ────────────────────────────────────────────────────────
+async function mirrorReady() {
+  return transaction(['meta'], 'readonly', async tx => {
+    const [version, user, active] = await Promise.all([
+      getMeta(tx, 'version'), getMeta(tx, 'user'), getMeta(tx, 'active_user'),
+    ]);
+    return typeof version === 'number' && user === active;
+  });
+}
+
+async function wipe() {
+  await transaction(['todos', 'subtasks', 'outbox', 'meta'], 'readwrite', async tx => {
+    ['todos', 'subtasks', 'outbox', 'meta'].forEach(s => tx.objectStore(s).clear());
+  });
+  // Закешована сторінка / містить перші місії попереднього користувача
+  await caches.delete(CACHE);
+  await caches.open(CACHE).then(c => c.addAll(STATIC)).catch(() => {});
+}
+
+async function setActiveUser(id) {
+  const stale = await transaction(['meta'], 'readonly', async tx => {
+    const user = await getMeta(tx, 'user');
+    return user !== undefined && user !== id;
+  });
+  // Інший користувач на цьому пристрої: чужу копію і чергу не показуємо
+  if (stale) await wipe();
+  await transaction(['meta'], 'readwrite', tx => setMeta(tx, 'active_user', id));
+}
+
+// Застосовує відповідь /api/sync; повертає true, якщо щось змінилося
+async function applySync(data) {
+  return transaction(['todos', 'subtasks', 'meta'], 'readwrite', async tx => {
+    const todos = tx.objectStore('todos');
+    const subtasks = tx.objectStore('subtasks');
+    const byTodo = subtasks.index('todo_id');
+    // Поки fetch летів, з'явилися локальні зміни — знімок уже застарий
+    if (await getMeta(tx, 'outbox_size')) return false;
+    if (data.full) {
+      todos.clear();
+      subtasks.clear();
+      setMeta(tx, 'resync', false);
+    }
+    for (const id of data.deleted.todos) {
+      todos.delete(id);
+      for (const key of await done(byTodo.getAllKeys(id))) subtasks.delete(key);
+    }
+    data.deleted.subtasks.forEach(id => subtasks.delete(id));
+    data.todos.forEach(t => todos.put(t));
+    data.subtasks.forEach(s => subtasks.put(s));
+    // Черга порожня — усі тимчасові рядки вже прийшли зі справжніми id
+    todos.delete(IDBKeyRange.upperBound(0, true));
+    subtasks.delete(IDBKeyRange.upperBound(0, true));
+    const before = await getMeta(tx, 'version');
+    setMeta(tx, 'version', data.version);
+    setMeta(tx, 'user', data.user_id);
+    return data.full || data.version !== before;
+  });
+}
+
+async function refresh() {
+  lastRefresh = Date.now();
+  await flushOutbox();
+  const state = await transaction(['meta', 'outbox'], 'readonly', async tx => ({
+    version: (await getMeta(tx, 'resync')) ? 0 : await getMeta(tx, 'version'),
+    pending: await done(tx.objectStore('outbox').count()),
+    hadTemp: await getMeta(tx, 'had_temp'),
+  }));
+  if (state.pending) return;
+  const res = await fetch(`/api/sync?since=${state.version ?? 0}`, { credentials: 'same-origin' });
+  if (!res.ok) return;
+  const changed = await applySync(await res.json());
+  if (changed) {
+    if (state.hadTemp) await transaction(['meta'], 'readwrite', tx => setMeta(tx, 'had_temp', false));
+    // Тимчасові id у сторінці треба замінити — просимо перемалювати список
+    notify({ type: 'changed', reload: Boolean(state.hadTemp) });
+  }
+}
+
+function scheduleRefresh() {
+  if (Date.now() - lastRefresh < REFRESH_INTERVAL) return Promise.resolve();
+  return refresh().catch(() => {});
+}
+
+// ─── Outbox ────────────────────────────────────────────────────────
+const ID_FIELDS = ['id', 'todo_id', 'prev_id', 'next_id'];
+
+function mapIds(ops, idmap) {
+  return ops.map(op => {
+    const out = { ...op };
+    ID_FIELDS.forEach(f => {
+      if (typeof out[f] === 'number' && out[f] < 0 && idmap[out[f]] !== undefined) {
+        out[f] = idmap[out[f]];
+      }
+    });
+    return out;
+  });
+}
+
+async function sendNext() {
+  const entry = await transaction(['outbox'], 'readonly', async tx => {
+    const cursor = await done(tx.objectStore('outbox').openCursor());
+    return cursor ? cursor.value : null;
+  });
+  if (!entry) return false;
+
+  const idmap = await transaction(['meta'], 'readonly', async tx => (await getMeta(tx, 'idmap')) || {});
+  const res = await fetch('/api/batch', {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': entry.key },
+    body: JSON.stringify(entry.atomic === false
+      ? { ops: mapIds(entry.ops, idmap), atomic: false }
+      : { ops: mapIds(entry.ops, idmap) }),
+  });
+  if (res.status === 401 || res.status >= 500) throw new Error(`outbox: ${res.status}`);
+
+  const body = res.ok ? await res.json() : null;
+  await transaction(['outbox', 'meta'], 'readwrite', async tx => {
+    tx.objectStore('outbox').delete(entry.seq);
+    const size = (await getMeta(tx, 'outbox_size')) - 1;
+    setMeta(tx, 'outbox_size', Math.max(size, 0));
+    if (res.ok) {
+      entry.temps.forEach(([index, tempId]) => {
+        if (!body.results[index].error) idmap[tempId] = body.results[index].id;
+      });
+      setMeta(tx, 'idmap', idmap);
+    }
+    if (!res.ok || body.results.some(r => r.error)) {
+      // Сервер відхилив пакет (або частину неатомарного) — локальна копія
+      // розійшлася з ним, беремо повний знімок
+      setMeta(tx, 'resync', true);
+      setMeta(tx, 'had_temp', true);
+    }
+  });
+  return true;
+}
+
+function flushOutbox() {
+  if (!flushing) {
+    flushing = (async () => {
+      try {
+        while (await sendNext()) {}
+      } finally {
+        flushing = null;
+      }
+    })();
+  }
+  return flushing;
+}
+
+// ─── Local reads ───────────────────────────────────────────────────
+const RANK_NAMES = [[10, '🔴', 'Хокаге'], [7, '🟡', 'Джонін'], [4, '🟢', 'Чунін'], [1, '🔵', 'Генін'], [0, '⚪', 'Академія']];
+
+function localToday() {
+  const d = new Date();
+  d.setMinutes(d.getMinutes() - d.getTimezoneOffset());
+  return d.toISOString().slice(0, 10);
+}
+
+function localNow() {
+  const d = new Date();
+  d.setMinutes(d.getMinutes() - d.getTimezoneOffset());
+  return d.toISOString().slice(0, -1);
+}
+
+// Канонічний порядок, як ORDER_KEYS на сервері
+function compareTodos(a, b) {
+  return (a.done - b.done) || (a.position - b.position)
+    || (a.created_at < b.created_at ? 1 : a.created_at > b.created_at ? -1 : 0)
+    || (b.id - a.id);
+}
+
+function orderKey(t) {
+  return [t.done ? 1 : 0, t.position, t.created_at, t.id];
+}
+
+function encodeCursor(t) {
+  return btoa(JSON.stringify(orderKey(t))).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+}
+
+function decodeCursor(cursor) {
+  try {
+    const [done, position, created_at, id] = JSON.parse(atob(cursor.replace(/-/g, '+').replace(/_/g, '/')));
+    return { done: Boolean(done), position, created_at, id };
+  } catch (e) {
+    return null;
+  }
+}
+
+function computeStats(todos, subtasks) {
+  const today = localToday();
+  const total = todos.length;
+  const doneCount = todos.filter(t => t.done).length;
+  const [, icon, name] = RANK_NAMES.find(([min]) => doneCount >= min);
+  return {
+    total,
+    done: doneCount,
+    pending: total - doneCount,
+    overdue: todos.filter(t => !t.done && t.deadline && t.deadline < today).length,
+    due_today: todos.filter(t => !t.done && t.deadline === today).length,
+    subtasks_total: subtasks.length,
+    subtasks_done: subtasks.filter(s => s.done).length,
+    rank_icon: icon,
+    rank_name: name,
+    chakra: total ? Math.round(doneCount / total * 100) : 0,
+  };
+}
+
+async function readAll() {
+  return transaction(['todos', 'subtasks'], 'readonly', async tx => ({
+    todos: await done(tx.objectStore('todos').getAll()),
+    subtasks: await done(tx.objectStore('subtasks').getAll()),
+  }));
+}
+
+async function localTodos(url) {
+  const filter = url.searchParams.get('filter') || 'all';
+  const search = (url.searchParams.get('search') || '').trim().toLowerCase();
+  const limit = Math.min(Math.max(parseInt(url.searchParams.get('limit')) || 50, 1), 200);
+  const { todos, subtasks } = await readAll();
+
+  let items = todos.filter(t => filter === 'all' || (filter === 'done') === t.done);
+  if (search) {
+    // Офлайн-пошук — простий збіг підрядка, весь результат однією сторінкою
+    const words = search.split(/\s+/);
+    const hit = text => words.every(w => text.toLowerCase().includes(w));
+    items = items.filter(t => {
+      const matched = subtasks.filter(s => s.todo_id === t.id && hit(s.text)).map(s => s.id);
+      t.matched_subtasks = matched;
+      return hit(t.text) || matched.length;
+    }).sort(compareTodos);
+    return { items, next_cursor: null };
+  }
+
+  items.sort(compareTodos);
+  const cursor = url.searchParams.get('cursor');
+  if (cursor) {
+    const after = decodeCursor(cursor);
+    if (!after) return null;
+    items = items.filter(t => compareTodos(t, after) > 0);
+  }
+  const page = items.slice(0, limit);
+  return { items: page, next_cursor: items.length > limit ? encodeCursor(page[page.length - 1]) : null };
+}
+
+async function localRead(url) {
+  if (url.pathname === '/api/todos') {
+    const body = await localTodos(url);
+    return body ? json(body) : json({ error: 'Невірний курсор' }, 400);
+  }
+  if (url.pathname === '/api/stats') {
+    const { todos, subtasks } = await readAll();
+    return json(computeStats(todos, subtasks));
+  }
+  const todoId = parseInt(url.pathname.split('/').pop());
+  return transaction(['todos', 'subtasks'], 'readonly', async tx => {
+    if (!await done(tx.objectStore('todos').get(todoId))) return json({ error: 'Не знайдено' }, 404);
+    const subs = await done(tx.objectStore('subtasks').index('todo_id').getAll(todoId));
+    return json(subs.sort((a, b) => (a.created_at < b.created_at ? -1 : 1)));
+  });
+}
+
+// ─── Local writes ──────────────────────────────────────────────────
+class LocalError extends Error {
+  constructor(message, status, index) {
+    super(message);
+    this.status = status;
+    this.index = index;
+  }
+}
+
+// ref(v) розв'язує "$N"; тимчасовий id, якого вже немає локально,
+// шукаємо за справжнім id з idmap
+async function lookup(store, id, ref, idmap) {
+  id = ref(id);
+  const row = await done(store.get(id));
+  if (row || !(id in idmap)) return row;
+  return done(store.get(idmap[id]));
+}
+
+async function applyOp(tx, op, ref, idmap, nextTempId) {
+  const todos = tx.objectStore('todos');
+  const subtasks = tx.objectStore('subtasks');
+  const need = async (store, id) => {
+    const row = await lookup(store, id, ref, idmap);
+    if (!row) throw new LocalError('Не знайдено', 404);
+    return row;
+  };
+
+  switch (op.op) {
+    case 'add': {
+      const active = (await done(todos.getAll())).filter(t => !t.done);
+      const top = active.length ? Math.min(...active.map(t => t.position)) : 0;
+      const row = {
+        id: nextTempId(), text: op.text, rank: op.rank || 'D', deadline: op.deadline || null,
+        done: false, done_at: null, created_at: localNow(), position: top - POSITION_GAP,
+      };
+      todos.put(row);
+      return row;
+    }
+    case 'toggle': {
+      const row = await need(todos, op.id);
+      row.done = !row.done;
+      row.done_at = row.done ? localNow() : null;
+      todos.put(row);
+      return row;
+    }
+    case 'edit': {
+      const row = await need(todos, op.id);
+      row.text = op.text;
+      if (op.rank && 'DCBAS'.includes(op.rank)) row.rank = op.rank;
+      if ('deadline' in op) row.deadline = op.deadline || null;
+      todos.put(row);
+      return row;
+    }
+    case 'delete': {
+      const row = await need(todos, op.id);
+      todos.delete(row.id);
+      for (const key of await done(subtasks.index('todo_id').getAllKeys(row.id))) subtasks.delete(key);
+      return { ok: true, deleted: row };
+    }
+    case 'move': {
+      const row = await need(todos, op.id);
+      const prev = op.prev_id != null ? await lookup(todos, op.prev_id, ref, idmap) : null;
+      const next = op.next_id != null ? await lookup(todos, op.next_id, ref, idmap) : null;
+      if (prev && next) row.position = (prev.position + next.position) / 2;
+      else if (prev) row.position = prev.position + POSITION_GAP;
+      else if (next) row.position = next.position - POSITION_GAP;
+      todos.put(row);
+      return { ok: true, id: row.id, position: row.position };
+    }
+    case 'subtask_add': {
+      const todo = await need(todos, op.todo_id);
+      const row = { id: nextTempId(), todo_id: todo.id, text: op.text, done: 0, created_at: localNow() };
+      subtasks.put(row);
+      return row;
+    }
+    case 'subtask_toggle': {
+      const row = await need(subtasks, op.id);
+      row.done = 1 - row.done;
+      subtasks.put(row);
+      return row;
+    }
+    case 'subtask_delete': {
+      const row = await need(subtasks, op.id);
+      subtasks.delete(row.id);
+      return { ok: true, id: row.id };
+    }
+    default:
+      throw new LocalError('Невідома операція', 400);
+  }
+}
+
+// Пакет застосовується до локальної копії і стає в outbox однією транзакцією;
+// неатомарний (atomic: false) записує помилку операції в її результат
+async function localBatch(request) {
+  const { ops, atomic } = await request.json();
+  if (!Array.isArray(ops) || !ops.length) return json({ error: 'Порожній пакет' }, 400);
+
+  try {
+    const results = await transaction(['todos', 'subtasks', 'outbox', 'meta'], 'readwrite', async tx => {
+      let tempId = (await getMeta(tx, 'temp_id')) || 0;
+      const idmap = (await getMeta(tx, 'idmap')) || {};
+      const temps = [];
+      const results = [];
+      const ref = v => (typeof v === 'string' ? results[parseInt(v.slice(1))].id : v);
+      for (const [i, op] of ops.entries()) {
+        try {
+          results.push(await applyOp(tx, op, ref, idmap, () => {
+            temps.push([i, --tempId]);
+            return tempId;
+          }));
+        } catch (e) {
+          if (atomic === false && e instanceof LocalError) {
+            results.push({ error: e.message, status: e.status });
+            continue;
+          }
+          if (e instanceof LocalError) e.index = i;
+          tx.abort();
+          throw e;
+        }
+      }
+      tx.objectStore('outbox').add({ key: self.crypto.randomUUID(), ops, temps, atomic });
+      setMeta(tx, 'outbox_size', ((await getMeta(tx, 'outbox_size')) || 0) + 1);
+      setMeta(tx, 'temp_id', tempId);
+      if (temps.length) setMeta(tx, 'had_temp', true);
+      return results;
+    });
+    const { todos, subtasks } = await readAll();
+    return json({ results, stats: computeStats(todos, subtasks) });
+  } catch (e) {
+    if (!(e instanceof LocalError)) throw e;
+    return json({ error: e.message, index: e.index }, e.status);
+  }
+}
+
+// ─── Lifecycle ─────────────────────────────────────────────────────
 self.addEventListener('install', e => {
   e.waitUntil(
     caches.open(CACHE).then(c => c.addAll(STATIC))
@@ -15,7 +490,6 @@ self.addEventListener('install', e => {
   self.skipWaiting();
 });
 
-// Activate - clean old caches
 self.addEventListener('activate', e => {
   e.waitUntil(
     caches.keys().then(keys =>
@@ -25,18 +499,86 @@ self.addEventListener('activate', e => {
   self.clients.claim();
 });
 
-// Fetch - network first, fallback to cache
+// Background Sync: браузер сам розбудить воркер, коли з'явиться мережа
+self.addEventListener('sync', e => {
+  if (e.tag === 'outbox') e.waitUntil(refresh());
+});
+
+self.addEventListener('message', e => {
+  const msg = e.data || {};
+  if (msg.type === 'user') e.waitUntil(setActiveUser(msg.id).then(refresh).catch(() => {}));
+  if (msg.type === 'online') e.waitUntil(refresh().catch(() => {}));
+  if (msg.type === 'flush') {
+    // Перед експортом: дамп має містити й зміни, що ще чекають у черзі
+    e.waitUntil(flushOutbox().catch(() => {}).then(() => e.ports[0].postMessage({ type: 'flushed' })));
+  }
+});
+
+const LOCAL_READS = /^\/api\/(todos|stats|subtasks\/\d+)$/;
+
+async function handleApi(e, url) {
+  if (!await mirrorReady()) {
+    if (e.request.method === 'GET') e.waitUntil(scheduleRefresh());
+    return fetch(e.request);
+  }
+  if (e.request.method === 'POST' && url.pathname === '/api/batch') {
+    const response = await localBatch(e.request);
+    if (self.registration.sync) self.registration.sync.register('outbox').catch(() => {});
+    e.waitUntil(refresh().catch(() => {}));
+    return response;
+  }
+  if (e.request.method === 'GET' && url.pathname === '/api/sync') {
+    // Поки черга не відправлена, сервер не знає про локальні зміни
+    const pending = await transaction(['meta'], 'readonly', tx => getMeta(tx, 'outbox_size'));
+    if (pending) {
+      const since = parseInt(url.searchParams.get('since')) || 0;
+      return json({ version: since, full: false, todos: [], subtasks: [], deleted: { todos: [], subtasks: [] } });
+    }
+    return fetch(e.request);
+  }
+  if (e.request.method === 'GET' && LOCAL_READS.test(url.pathname)) {
+    if (url.searchParams.get('search') && navigator.onLine) {
+      // Пошук за релевантністю вміє лише сервер
+      return fetch(e.request).catch(() => localRead(url));
+    }
+    e.waitUntil(scheduleRefresh());
+    return localRead(url);
+  }
+  return fetch(e.request);
+}
+
 self.addEventListener('fetch', e => {
-  // Skip non-GET and API requests - always network
-  if (e.request.method !== 'GET' || e.request.url.includes('/api/')) {
+  const url = new URL(e.request.url);
+  if (url.origin !== self.location.origin) return;
+
+  // Потік подій, вкладення-дампи й адмінка йдуть напряму в мережу і в кеш не потрапляють
+  if (url.pathname === '/api/events' || url.pathname === '/api/export') return;
+  if (url.pathname === '/admin' || url.pathname.startsWith('/admin/')) return;
+
+  if (url.pathname.startsWith('/api/')) {
+    e.respondWith(handleApi(e, url));
     return;
   }
 
+  if (url.pathname === '/logout') {
+    // Спершу відправляємо чергу — після виходу сервер її вже не прийме
+    e.respondWith(
+      flushOutbox().catch(() => {})
+        .then(() => fetch(e.request))
+        .then(res => wipe().then(() => res))
+    );
+    return;
+  }
+
+  if (e.request.method !== 'GET') return;
+
+  // Сторінки і статика — мережа спершу, кеш як запасний варіант.
+  // Кешуються лише оболонка STATIC і сама / — більше нічого з даними.
+  const cacheable = STATIC.includes(url.pathname) && !url.search;
   e.respondWith(
     fetch(e.request)
       .then(res => {
-        // Cache successful responses
-        if (res.ok) {
+        if (res.ok && cacheable) {
           const clone = res.clone();
           caches.open(CACHE).then(c => c.put(e.request, clone));
         }
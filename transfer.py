@@ -0,0 +1,604 @@
+"""Експорт, імпорт і онлайн-копії бази.
+
+    python transfer.py export [--user КОД] [--format ndjson|csv] [база] > дамп
+    python transfer.py import дамп [--format ndjson|csv] [--keep-indexes] [база]
+    python transfer.py backup копія.db [база]
+    python transfer.py reindex [база]
+
+Кожна команда приймає --shards N (типово SHARDS): із шардами база — це
+каталог, і команди охоплюють його разом з усіма файлами шардів.
+
+NDJSON — запис на рядок: {"type": "user", ...} відкриває користувача,
+наступні {"type": "todo", ..., "subtasks": [...]} — його місії; архівні
+мають archived_at. CSV — рядок на місію з підзадачами JSON-масивом у
+колонці subtasks; у повному експорті перед колонками місії йдуть
+колонки користувача. Експорт іде з курсора SQLite і тримає в пам'яті
+одну місію, імпорт читає вхід построково.
+
+Імпорт не переносить id: місії й підзадачі отримують нові, користувачі
+зіставляються за кодом (наявний код — дописати до нього). Записується
+шматками по IMPORT_CHUNK місій, кожен — executemany в окремій
+транзакції; під застосунком шматки йдуть через письменника. Імпорт із
+командного рядка ще й знімає вторинні індекси місій на час вставки й
+будує їх наприкінці одним проходом; їхній SQL лежить у deferred_indexes,
+тож перерваний імпорт відновлює reindex (або наступний import).
+
+backup() копіює живу базу через sqlite3.Connection.backup кроками по
+BACKUP_PAGES сторінок з паузою між ними, тож письменник не чекає довше
+за один крок.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import dal
+import migrations
+import shards
+
+IMPORT_CHUNK = 500
+MAX_TEXT = 200  # той самий ліміт, що й app.clean_text
+RANKS = ("D", "C", "B", "A", "S")  # як app.RANKS
+
+TODO_FIELDS = ("id", "text", "done", "rank", "deadline", "created_at", "done_at", "position",
+               "archived_at")
+USER_FIELDS = ("code", "name", "is_admin", "created_at")
+CSV_TODO_FIELDS = TODO_FIELDS + ("subtasks",)
+CSV_USER_FIELDS = tuple("user_" + f for f in USER_FIELDS)
+
+# Таблиці, чиї індекси імпорт будує наприкінці; унікальні лишаються
+DEFERRED_TABLES = ("todos", "subtasks", "archived_todos", "archived_subtasks")
+
+BACKUP_PAGES = 1024   # 4 МБ за крок при сторінці 4 КБ
+BACKUP_PAUSE = 0.05   # секунд між кроками
+BACKUP_RESTARTS = 3
+
+
+# ─── Export ─────────────────────────────────────────────────────────
+@contextmanager
+def snapshot(db):
+    """Один знімок на весь експорт: архіватор між запитами нічого не зсуне."""
+    db.execute("BEGIN")
+    try:
+        yield
+    finally:
+        db.execute("ROLLBACK")
+
+
+def todo_records(rows):
+    """Записи місій із рядків dal.export_*: рядки однієї місії йдуть поспіль."""
+    for _, group in itertools.groupby(rows, key=lambda r: r["id"]):
+        first = next(group)
+        record = {"type": "todo", **{f: first[f] for f in TODO_FIELDS}}
+        record["done"] = bool(record["done"])
+        record["subtasks"] = [
+            {"id": r["sub_id"], "text": r["sub_text"], "done": bool(r["sub_done"]),
+             "created_at": r["sub_created_at"]}
+            for r in itertools.chain((first,), group) if r["sub_id"] is not None
+        ]
+        yield record
+
+
+def user_records(db, user_id):
+    """Живі, а потім архівні місії користувача."""
+    yield from todo_records(dal.export_todos(db, user_id))
+    yield from todo_records(dal.export_archive(db, user_id))
+
+
+def database_records(db, shard=None):
+    """Користувачі з місіями; shard — лише ті, чиї дані в цьому шарді (див. shards.py)."""
+    for user in dal.export_users(db, shard):
+        yield {"type": "user", **{f: user[f] for f in USER_FIELDS}}
+        yield from user_records(db, user["id"])
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class _Line:
+    """«Файл» для csv.writer: writerow() повертає готовий рядок."""
+
+    def write(self, line):
+        return line
+
+
+def csv_lines(records, with_users=False):
+    writer = csv.writer(_Line())
+    yield writer.writerow((CSV_USER_FIELDS if with_users else ()) + CSV_TODO_FIELDS)
+    user = ()
+    user_written = True
+    for record in records:
+        if record["type"] == "user":
+            if not user_written:  # користувач без місій — рядок без колонок місії
+                yield writer.writerow(user + ("",) * len(CSV_TODO_FIELDS))
+            user = tuple(record[f] for f in USER_FIELDS)
+            user_written = False
+            continue
+        todo = [record[f] for f in TODO_FIELDS]
+        todo[TODO_FIELDS.index("done")] = int(record["done"])
+        subtasks = json.dumps(record["subtasks"], ensure_ascii=False)
+        yield writer.writerow((user if with_users else ()) + tuple(todo) + (subtasks,))
+        user_written = True
+    if with_users and not user_written:
+        yield writer.writerow(user + ("",) * len(CSV_TODO_FIELDS))
+
+
+def export_lines(records, fmt, with_users=False):
+    if fmt == "csv":
+        return csv_lines(records, with_users)
+    return ndjson_lines(records)
+
+
+# ─── Import ─────────────────────────────────────────────────────────
+class BadRecord(ValueError):
+    """Запис імпорту, який не вдалося розібрати; повідомлення з номером рядка."""
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ("1", "true", "yes") else 0
+    return 1 if value else 0
+
+
+def _text(value, what):
+    text = value.strip() if isinstance(value, str) else ""
+    if not text:
+        raise ValueError(f"{what}: порожній текст")
+    if len(text) > MAX_TEXT:
+        raise ValueError(f"{what}: більше {MAX_TEXT} символів")
+    return text
+
+
+def _timestamp(value, what, default=None):
+    """Мітка часу ISO 8601 як є; порожня — default."""
+    if value is None or value == "":
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f"{what}: очікується дата ISO")
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{what}: очікується дата ISO")
+    return value
+
+
+def clean_todo(record, now):
+    """Поля місії із запису імпорту; ValueError — запис зіпсований."""
+    created_at = _timestamp(record.get("created_at"), "created_at", now)
+    try:
+        position = float(record.get("position") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Невірна позиція")
+    if not math.isfinite(position):
+        raise ValueError("Невірна позиція")
+    deadline = record.get("deadline") or None
+    if deadline is not None:
+        deadline = dal.iso_date(deadline)
+        if deadline is None:
+            raise ValueError("Невірна дата дедлайну")
+    done = _flag(record.get("done"))
+    subtasks = record.get("subtasks") or []
+    if not isinstance(subtasks, list):
+        raise ValueError("subtasks має бути списком")
+    return {
+        "text": _text(record.get("text"), "Місія"),
+        "done": done,
+        "rank": record.get("rank") if record.get("rank") in RANKS else "D",
+        "deadline": deadline,
+        "created_at": created_at,
+        "done_at": _timestamp(record.get("done_at"), "done_at", created_at if done else None),
+        "position": position,
+        "archived_at": _timestamp(record.get("archived_at"), "archived_at"),
+        "subtasks": [(_text(s.get("text") if isinstance(s, dict) else None, "Підзадача"),
+                      _flag(s.get("done")),
+                      _timestamp(s.get("created_at"), "created_at підзадачі", created_at))
+                     for s in subtasks],
+    }
+
+
+def clean_user(record, now):
+    code = record.get("code")
+    if not isinstance(code, str) or not code.strip():
+        raise ValueError("Користувач без коду")
+    name = record.get("name")
+    if name is not None and not isinstance(name, str):
+        raise ValueError("Ім'я користувача має бути рядком")
+    return (code.strip(), (name or "Ніндзя").strip() or "Ніндзя",
+            _flag(record.get("is_admin")), _timestamp(record.get("created_at"), "created_at", now))
+
+
+def parse_ndjson(lines):
+    """(номер рядка, запис) для кожного непорожнього рядка."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise BadRecord(f"Рядок {number}: не JSON")
+        if not isinstance(record, dict):
+            raise BadRecord(f"Рядок {number}: очікується об'єкт")
+        yield number, record
+
+
+def parse_csv(lines):
+    reader = csv.DictReader(lines)
+    code = None
+    for row in reader:
+        number = reader.line_num
+        if row.get("user_code"):
+            if row["user_code"] != code:
+                code = row["user_code"]
+                yield number, {"type": "user", **{f: row.get("user_" + f) for f in USER_FIELDS}}
+            if not row.get("text"):
+                continue
+        try:
+            subtasks = json.loads(row.get("subtasks") or "[]")
+        except ValueError:
+            raise BadRecord(f"Рядок {number}: subtasks — не JSON")
+        yield number, {"type": "todo", **{f: row.get(f) for f in TODO_FIELDS}, "subtasks": subtasks}
+
+
+def parse(lines, fmt):
+    return parse_csv(lines) if fmt == "csv" else parse_ndjson(lines)
+
+
+def chunks(parsed, size=IMPORT_CHUNK):
+    """Шматки записів, у кожному до size місій (користувачі не рахуються)."""
+    chunk, todos = [], 0
+    for number, record in parsed:
+        chunk.append((number, record))
+        if record.get("type", "todo") == "todo":
+            todos += 1
+            if todos == size:
+                yield chunk
+                chunk, todos = [], 0
+    if chunk:
+        yield chunk
+
+
+def import_chunk(db, chunk, user_id, users=True):
+    """Записує шматок у поточній транзакції, не комітить.
+
+    user_id — кому належать місії до першого запису користувача; з users=False
+    такі записи пропускаються і все йде до user_id. Повертає
+    (user_id для наступного шматка, місій, підзадач).
+    """
+    now = datetime.now().isoformat()
+    todos = []
+    for number, record in chunk:
+        kind = record.get("type", "todo")
+        try:
+            if kind == "user":
+                if users:
+                    user_id = dal.import_user(db, *clean_user(record, now))
+                continue
+            if kind != "todo":
+                raise ValueError(f"Невідомий тип запису {kind!r}")
+            if user_id is None:
+                raise ValueError("Місія до першого користувача")
+            todos.append((user_id, clean_todo(record, now)))
+        except ValueError as e:
+            raise BadRecord(f"Рядок {number}: {e}")
+
+    todo_id = dal.allocate_ids(db, "todos", "archived_todos", len(todos))
+    sub_id = dal.allocate_ids(db, "subtasks", "archived_subtasks",
+                              sum(len(t["subtasks"]) for _, t in todos))
+    rows = {table: [] for table in dal.IMPORT_COLUMNS}
+    for owner, t in todos:
+        archived = t["archived_at"] is not None
+        row = (todo_id, owner, t["text"], t["done"], t["rank"], t["deadline"],
+               t["created_at"], t["done_at"], t["position"])
+        rows["archived_todos" if archived else "todos"].append(
+            row + (t["archived_at"],) if archived else row)
+        for sub in t["subtasks"]:
+            rows["archived_subtasks" if archived else "subtasks"].append((sub_id, todo_id, *sub))
+            sub_id += 1
+        todo_id += 1
+    for table in ("todos", "archived_todos", "subtasks", "archived_subtasks"):
+        if rows[table]:
+            dal.import_rows(db, table, rows[table])
+    subtasks = len(rows["subtasks"]) + len(rows["archived_subtasks"])
+    return user_id, len(todos), subtasks
+
+
+# ─── Deferred indexes ───────────────────────────────────────────────
+DEFERRED_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS deferred_indexes (
+        name TEXT PRIMARY KEY,
+        sql  TEXT NOT NULL
+    )
+"""
+
+
+def drop_indexes(db, tables=DEFERRED_TABLES):
+    """Знімає вторинні індекси tables, запам'ятавши їхній SQL (у транзакції db)."""
+    db.execute(DEFERRED_SCHEMA)
+    rows = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        "AND tbl_name IN (%s)" % ",".join("?" * len(tables)), tables).fetchall()
+    db.executemany("INSERT OR REPLACE INTO deferred_indexes (name, sql) VALUES (?, ?)", rows)
+    for name, _ in rows:
+        db.execute(f'DROP INDEX "{name}"')
+    return len(rows)
+
+
+def restore_indexes(db):
+    """Будує індекси, зняті drop_indexes (у транзакції db); кількість."""
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'deferred_indexes'").fetchone()
+    if not exists:
+        return 0
+    rows = db.execute("SELECT name, sql FROM deferred_indexes").fetchall()
+    for name, sql in rows:
+        db.execute(sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+    db.execute("DROP TABLE deferred_indexes")
+    return len(rows)
+
+
+@contextmanager
+def immediate(db):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def connect(path):
+    db = sqlite3.connect(path, isolation_level=None, timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys=ON")
+    db.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+def import_file(path, lines, fmt, defer_indexes=True):
+    """Імпорт із командного рядка прямо в базу path; (місій, підзадач)."""
+    db = connect(path)
+    total_todos = total_subtasks = 0
+    try:
+        with immediate(db):
+            restore_indexes(db)  # залишок перерваного імпорту
+            if defer_indexes:
+                drop_indexes(db)
+        user_id = None
+        for chunk in chunks(parse(lines, fmt)):
+            with immediate(db):
+                user_id, todos, subtasks = import_chunk(db, chunk, user_id)
+            total_todos += todos
+            total_subtasks += subtasks
+    finally:
+        with immediate(db):
+            restore_indexes(db)
+        db.close()
+    return total_todos, total_subtasks
+
+
+# ─── Shards ─────────────────────────────────────────────────────────
+# Із шардами (див. shards.py) path — це каталог: користувачі в ньому,
+# а їхні місії — у файлах шардів. Командний рядок тоді працює з усіма
+# файлами одразу, як і адмінка.
+def shard_files(path, count):
+    """{шард: файл} для каталогу path — сам каталог, шарди з користувачами
+    і наявні файли з count налаштованих; {CATALOG: path} без шардування."""
+    db = sqlite3.connect(path)
+    try:
+        has_column = any(row[1] == "shard" for row in db.execute("PRAGMA table_info(users)"))
+        names = [name for name, in db.execute("SELECT DISTINCT shard FROM users ORDER BY shard")
+                 ] if has_column else []
+    finally:
+        db.close()
+    names += [name for name in shards.shard_names(count)
+              if os.path.exists(shards.shard_path(path, name))]
+    return {name: shards.shard_path(path, name)
+            for name in dict.fromkeys([shards.CATALOG, *names])}
+
+
+def sharded_records(files):
+    """database_records() шард за шардом, кожен у своєму знімку."""
+    for name, path in files.items():
+        db = connect(path)
+        try:
+            with snapshot(db):
+                yield from database_records(db, name)
+        finally:
+            db.close()
+
+
+def import_sharded(path, lines, fmt, count):
+    """Імпорт у каталог path із шардами; (місій, підзадач).
+
+    Користувач створюється в каталозі (новому — шард за id, як у
+    застосунку), його копія — у шарді, а місії йдуть у шард користувача
+    шматками по IMPORT_CHUNK. Копію, якої бракує після перерваного
+    імпорту, наступний імпорт дописує. Індекси тут не знімаються.
+    """
+    names = shards.shard_names(count)
+    now = datetime.now().isoformat()
+    catalog = connect(path)
+    conns = {shards.CATALOG: catalog}
+
+    def open_user(number, record):
+        try:
+            fields = clean_user(record, now)
+        except ValueError as e:
+            raise BadRecord(f"Рядок {number}: {e}")
+        with immediate(catalog):
+            user = dal.get_user_by_code(catalog, fields[0])
+            if user is None:
+                user_id = dal.import_user(catalog, *fields)
+                dal.set_user_shards(catalog, [(names[user_id % len(names)], user_id)])
+                user = dal.get_user(catalog, user_id)
+        name = user["shard"]
+        if name not in conns:
+            shard_file = shards.shard_path(path, name)
+            migrations.migrate(shard_file)
+            conns[name] = connect(shard_file)
+        db = conns[name]
+        if name != shards.CATALOG and dal.get_user(db, user["id"]) is None:
+            with immediate(db):
+                dal.insert_user_stubs(db, [user])
+        return user["id"], db
+
+    total_todos = total_subtasks = 0
+    user_id, db = None, catalog
+    try:
+        for chunk in chunks(parse(lines, fmt)):
+            # Шматок ділиться на відрізки між записами користувачів:
+            # кожен відрізок пишеться в шард свого власника
+            runs = [(user_id, db, [])]
+            for number, record in chunk:
+                if record.get("type", "todo") == "user":
+                    user_id, db = open_user(number, record)
+                    runs.append((user_id, db, []))
+                else:
+                    runs[-1][2].append((number, record))
+            for owner, run_db, run in runs:
+                if run:
+                    with immediate(run_db):
+                        _, todos, subtasks = import_chunk(run_db, run, owner, users=False)
+                    total_todos += todos
+                    total_subtasks += subtasks
+    finally:
+        for conn in conns.values():
+            conn.close()
+    return total_todos, total_subtasks
+
+
+# ─── Backup ─────────────────────────────────────────────────────────
+class BackupRestarted(Exception):
+    pass
+
+
+def backup(source, target, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Онлайн-копія бази source у файл target; {"pages", "seconds", "restarts"}.
+
+    Кожен крок — pages сторінок під коротким блокуванням читання. Якщо базу
+    між кроками змінює інше з'єднання, SQLite починає копію спочатку; після
+    BACKUP_RESTARTS таких перезапусків решта йде одним кроком — у WAL це
+    один знімок, що письменників не блокує. Файл з'являється під своїм
+    ім'ям, лише коли копія повна.
+    """
+    started = time.perf_counter()
+    partial = target + ".part"
+    restarts = 0
+    src = sqlite3.connect(source, timeout=30)
+    try:
+        while True:
+            if os.path.exists(partial):
+                os.remove(partial)
+            dst = sqlite3.connect(partial)
+            last = [None]
+
+            def progress(status, remaining, total):
+                if last[0] is not None and remaining > last[0]:
+                    raise BackupRestarted
+                last[0] = remaining
+                if remaining:
+                    # sleep= у backup() діє лише на SQLITE_BUSY, не між кроками
+                    time.sleep(pause)
+
+            try:
+                step = pages if restarts < BACKUP_RESTARTS else -1
+                src.backup(dst, pages=step, progress=progress)
+                total = dst.execute("PRAGMA page_count").fetchone()[0]
+                break
+            except BackupRestarted:
+                restarts += 1
+            finally:
+                dst.close()
+    finally:
+        src.close()
+    os.replace(partial, target)
+    return {"pages": total, "seconds": round(time.perf_counter() - started, 3),
+            "restarts": restarts}
+
+
+# ─── CLI ────────────────────────────────────────────────────────────
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Експорт, імпорт і копії бази ninja-todo.")
+    sub = p.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="дамп у stdout")
+    exp.add_argument("--user", help="код користувача (типово — уся база)")
+    exp.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    imp = sub.add_parser("import", help="дамп у базу")
+    imp.add_argument("file", help="файл дампу або - для stdin")
+    imp.add_argument("--format", choices=("ndjson", "csv"))
+    imp.add_argument("--keep-indexes", action="store_true",
+                     help="не знімати індекси на час вставки")
+    bak = sub.add_parser("backup", help="онлайн-копія бази")
+    bak.add_argument("target")
+    sub.add_parser("reindex", help="відновити індекси після перерваного імпорту")
+    for parser in (exp, imp, bak, sub.choices["reindex"]):
+        parser.add_argument("database", nargs="?",
+                            help="шлях до бази (типово DATABASE_PATH або todo.db)")
+        parser.add_argument("--shards", type=int, default=int(os.environ.get("SHARDS", 1)),
+                            help="кількість шардів (типово SHARDS або 1)")
+    args = p.parse_args(argv)
+    path = args.database or os.environ.get("DATABASE_PATH") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "todo.db")
+    files = shard_files(path, args.shards)
+    sharded = len(files) > 1 or args.shards > 1
+
+    if args.command == "export":
+        db = connect(path)
+        user = dal.get_user_by_code(db, args.user) if args.user else None
+        if args.user and user is None:
+            db.close()
+            print(f"Немає користувача {args.user}", file=sys.stderr)
+            return 1
+        if user is not None and sharded:
+            db.close()
+            db = connect(files[user["shard"]])  # місії лежать у шарді користувача
+        with snapshot(db):
+            if user is not None:
+                records = user_records(db, user["id"])
+            elif sharded:
+                records = sharded_records(files)  # у кожного файлу свій знімок
+            else:
+                records = database_records(db)
+            sys.stdout.writelines(export_lines(records, args.format, with_users=user is None))
+        db.close()
+    elif args.command == "import":
+        fmt = args.format or ("csv" if args.file.endswith(".csv") else "ndjson")
+        f = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8-sig", newline="")
+        try:
+            if sharded:
+                todos, subtasks = import_sharded(path, f, fmt, args.shards)
+            else:
+                todos, subtasks = import_file(path, f, fmt, defer_indexes=not args.keep_indexes)
+        except BadRecord as e:
+            print(e, file=sys.stderr)
+            return 1
+        finally:
+            f.close()
+        print(f"місій: {todos}, підзадач: {subtasks}")
+    elif args.command == "backup":
+        for name, source in files.items():
+            target = shards.shard_path(args.target, name)
+            result = backup(source, target)
+            print(f"{target}: {result['pages']} сторінок за {result['seconds']} с, "
+                  f"перезапусків {result['restarts']}")
+    else:
+        for source in files.values():
+            db = connect(source)
+            with immediate(db):
+                print(f"{source}: індексів відновлено {restore_indexes(db)}")
+            db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
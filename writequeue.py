@@ -0,0 +1,157 @@
+"""Групові коміти: один потік-письменник на воркер.
+
+Потоки воркера не комітять самі, а ставлять функцію-запис у чергу.
+Письменник збирає записи, що надійшли протягом короткого вікна, виконує
+кожен у власному SAVEPOINT однієї транзакції і робить один COMMIT на всіх.
+Запит отримує результат лише після того, як спільний коміт завершився;
+з'єднання письменника комітять із synchronous=FULL (dbpool), тож цей
+результат означає, що запис уже на диску, а один fsync припадає на пакет.
+Кожен запис виконується в контексті (contextvars) потоку, що його поставив,
+тож метрики запиту бачать і його SQL у потоці письменника.
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Верхні межі кошиків гістограми розмірів пакетів
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class WriteQueue:
+    def __init__(self, pool, window=0.002, max_batch=32, on_commit=None):
+        """on_commit(lock_seconds, commit_seconds) викликається після коміту
+        в контексті кожного запису пакета."""
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.batches = 0
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.batch_sizes = dict.fromkeys(BATCH_BUCKETS + ("+Inf",), 0)
+        self.commit_seconds = 0.0
+        self.commit_max = 0.0
+        self.lock_seconds = 0.0
+        self.lock_max = 0.0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Перший запис у цьому процесі (або після fork) — запускаємо письменника
+            self._queue = queue.SimpleQueue()
+            self._reset_stats()
+            threading.Thread(target=self._run, name="sqlite-writer", daemon=True).start()
+            self._pid = os.getpid()
+
+    def enqueue(self, fn, *args):
+        """Ставить fn(db, *args) у чергу й одразу повертає Future."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args, contextvars.copy_context()))
+        return future
+
+    def submit(self, fn, *args):
+        """Виконує fn(db, *args) у спільній транзакції й чекає на коміт.
+
+        fn не повинна комітити сама; її виняток повертається у потік
+        запиту, а зміни fn відкочуються, не зачіпаючи решту пакета.
+        """
+        return self.enqueue(fn, *args).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._execute(batch)
+            except BaseException as e:  # коміт не вдався — не вдалися всі записи пакета
+                for future, _, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _execute(self, batch):
+        results = []
+        db = self.pool.acquire()
+        try:
+            start = time.perf_counter()
+            db.execute("BEGIN IMMEDIATE")  # чекає, поки інший процес відпустить блокування
+            lock_wait = time.perf_counter() - start
+            for future, fn, args, ctx in batch:
+                db.execute("SAVEPOINT job")
+                try:
+                    results.append((future, ctx, True, ctx.run(fn, db, *args)))
+                except BaseException as e:
+                    db.execute("ROLLBACK TO job")
+                    results.append((future, ctx, False, e))
+                db.execute("RELEASE job")
+            start = time.perf_counter()
+            db.commit()
+            elapsed = time.perf_counter() - start
+        finally:
+            self.pool.release(db)
+
+        self._record(len(batch), elapsed, lock_wait,
+                     sum(1 for _, _, ok, _ in results if not ok))
+        for future, ctx, ok, value in results:
+            if self.on_commit is not None:
+                ctx.run(self.on_commit, lock_wait, elapsed)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _record(self, size, elapsed, lock_wait, failed):
+        with self._lock:
+            self.batches += 1
+            self.jobs += size
+            self.failed_jobs += failed
+            self.commit_seconds += elapsed
+            self.commit_max = max(self.commit_max, elapsed)
+            self.lock_seconds += lock_wait
+            self.lock_max = max(self.lock_max, lock_wait)
+            for bucket in BATCH_BUCKETS:
+                if size <= bucket:
+                    self.batch_sizes[bucket] += 1
+                    break
+            else:
+                self.batch_sizes["+Inf"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "jobs": self.jobs,
+                "failed_jobs": self.failed_jobs,
+                "avg_batch": round(self.jobs / self.batches, 3) if self.batches else 0,
+                "batch_sizes": {str(k): v for k, v in self.batch_sizes.items()},
+                "commit_seconds_total": round(self.commit_seconds, 6),
+                "commit_seconds_max": round(self.commit_max, 6),
+                "lock_seconds_total": round(self.lock_seconds, 6),
+                "lock_seconds_max": round(self.lock_max, 6),
+            }